@@ -1,11 +1,44 @@
+import time
+_started = time.perf_counter()
+
+import asyncio
 import discord
 from discord.ext import commands
 import os
 from dotenv import load_dotenv
-from utils.database import Database
+from utils.database import get_database, get_async_database, DEFAULT_POOL_SIZE, DEFAULT_DB_WORKERS, DEFAULT_STORAGE_PROFILE
+from utils.scheduler import get_scheduler
 
 load_dotenv()
 
+# Длительность этапов запуска для отчета
+startup_timings = {'импорт': time.perf_counter() - _started}
+_phase_started = time.perf_counter()
+
+# Одно общее подключение к базе на весь процесс
+# DB_PROFILE - профиль хранения SQLite: durable, balanced или throughput
+db = get_database(
+    pool_size=int(os.getenv('DB_POOL_SIZE', DEFAULT_POOL_SIZE)),
+    profile=os.getenv('DB_PROFILE', DEFAULT_STORAGE_PROFILE)
+)
+# Асинхронный доступ к базе через отдельные потоки
+adb = get_async_database(workers=int(os.getenv('DB_WORKERS', DEFAULT_DB_WORKERS)))
+# DB_STRICT=1 - предупреждать о синхронных запросах к базе из event loop
+db.strict = os.getenv('DB_STRICT', '0') == '1'
+
+startup_timings['открытие БД'] = time.perf_counter() - _phase_started
+
+COGS = [
+    'cogs.economy',
+    'cogs.levels', 
+    'cogs.moderation',
+    'cogs.settings',
+    'cogs.logs',
+    'cogs.giveaway',
+    'cogs.shop',
+    'cogs.tickets'
+]
+
 intents = discord.Intents.all()
 intents.message_content = True
 
@@ -13,34 +46,76 @@ async def get_prefix(bot, message):
     if not message.guild:
         return '!'
     
-    db = Database()
-    settings = db.get_server_settings(message.guild.id)
-    return settings[8] if settings else '!'
+    # Префиксы всех серверов лежат в памяти - база не нужна
+    return db.prefixes.get(message.guild.id)
+
+class Bot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Фоновый запуск планировщика и очистки, отменяется при закрытии
+        self.background_task = None
+
+    async def close(self):
+        if self.background_task is not None:
+            self.background_task.cancel()
+            self.background_task = None
+        await get_scheduler().stop()
+        await super().close()
+
+bot = Bot(command_prefix=get_prefix, intents=intents, help_command=None)
+
+@bot.event
+async def on_message(message):
+    # Быстрый путь: сообщение без префикса не может быть командой
+    if message.author.bot:
+        return
+    if message.guild and not db.prefixes.matches(message.guild.id, message.content):
+        return
+    await bot.process_commands(message)
+
+async def load_cog(cog):
+    started = time.perf_counter()
+    try:
+        await bot.load_extension(cog)
+        print(f'✅ Загружен ког: {cog} ({(time.perf_counter() - started) * 1000:.0f} мс)')
+    except Exception as e:
+        print(f'❌ Ошибка загрузки {cog}: {e}')
 
-bot = commands.Bot(command_prefix=get_prefix, intents=intents, help_command=None)
+async def timed(name, coro):
+    started = time.perf_counter()
+    await coro
+    startup_timings[name] = time.perf_counter() - started
+
+def print_startup_report():
+    print('⏱️ Время запуска:')
+    for name, seconds in startup_timings.items():
+        print(f'   {name}: {seconds * 1000:.0f} мс')
+
+async def start_background_jobs():
+    # Обработчикам отложенных задач нужен кэш серверов
+    await bot.wait_until_ready()
+    await get_scheduler().start()
+    await adb.resume_purges()
+
+@bot.event
+async def setup_hook():
+    """Выполняется один раз до подключения: коги грузятся параллельно с прогревом кэшей"""
+    await asyncio.gather(
+        timed('настройка когов', asyncio.gather(*(load_cog(cog) for cog in COGS))),
+        timed('прогрев кэшей', adb.warm_settings())
+    )
+    startup_timings['до подключения'] = time.perf_counter() - _started
+    print_startup_report()
+    bot.background_task = asyncio.create_task(start_background_jobs())
 
 @bot.event
 async def on_ready():
+    # Вызывается и при каждом переподключении - здесь только статус
+    if 'готовность' not in startup_timings:
+        startup_timings['готовность'] = time.perf_counter() - _started
+        print(f'⏱️ Бот готов через {startup_timings["готовность"]:.1f} с после старта')
     print(f'✅ Бот {bot.user.name} запущен!')
     
-    cogs = [
-        'cogs.economy',
-        'cogs.levels', 
-        'cogs.moderation',
-        'cogs.settings',
-        'cogs.logs',
-        'cogs.giveaway',
-        'cogs.shop',
-        'cogs.tickets'  # Добавляем тикеты
-    ]
-    
-    for cog in cogs:
-        try:
-            await bot.load_extension(cog)
-            print(f'✅ Загружен ког: {cog}')
-        except Exception as e:
-            print(f'❌ Ошибка загрузки {cog}: {e}')
-    
     activity = discord.Activity(
         type=discord.ActivityType.playing, 
         name="Строит Светогорск"
@@ -53,25 +128,25 @@ async def on_guild_join(guild):
     """При добавлении бота на сервер"""
     print(f'✅ Бот добавлен на сервер: {guild.name} (ID: {guild.id})')
     
+    # Если сервер еще очищается после прошлого удаления, дожидаемся конца
+    await adb.wait_purge(guild.id)
+    
     # Создаем настройки по умолчанию для нового сервера
-    db = Database()
-    db.get_server_settings(guild.id)  # Это создаст настройки по умолчанию
+    await adb.get_server_settings(guild.id)  # Это создаст настройки по умолчанию
 
 @bot.event
 async def on_guild_remove(guild):
     """При удалении бота с сервера"""
     print(f'🗑️ Бот удален с сервера: {guild.name} (ID: {guild.id})')
     
-    # Очищаем данные сервера из базы
-    db = Database()
-    db.cleanup_guild_data(guild.id)
-    print(f'✅ Данные сервера {guild.name} очищены из базы')
+    # Данные удаляются в фоне пачками; кэши сбрасываются сразу
+    await adb.start_guild_purge(guild.id)
+    adb.purge_guild(guild.id)
 
 @bot.command(name='help')
 async def help_command(ctx):
     try:
-        db = Database()
-        settings = db.get_server_settings(ctx.guild.id)
+        settings = await adb.get_server_settings(ctx.guild.id)
         prefix = settings[8] if settings else '!'
         
         embed = discord.Embed(
@@ -107,6 +182,7 @@ async def help_command(ctx):
 `{prefix}levelreward info <уровень>` - Информация о награде
 `{prefix}setxp @user <опыт>` - Установить опыт (админ)
 `{prefix}setlevel @user <уровень>` - Установить уровень (админ)
+`{prefix}recomputelevels` - Пересчитать уровни всех участников (админ)
 """,
             inline=False
         )
@@ -140,6 +216,7 @@ async def help_command(ctx):
 `{prefix}ticket add @user` - Добавить пользователя в тикет
 `{prefix}ticket remove @user` - Удалить пользователя из тикета
 `{prefix}ticket list` - Список активных тикетов (админ)
+`{prefix}ticket transcripts` - Архив закрытых тикетов (админ)
 """,
             inline=False
         )
@@ -202,6 +279,37 @@ async def help_command(ctx):
         print(f"❌ Ошибка в команде help: {e}")
         await ctx.send("❌ Произошла ошибка при выполнении команды.")
 
+@bot.command(name='perfstats')
+@commands.is_owner()
+async def perf_stats(ctx):
+    """Счетчики производительности (владелец бота)"""
+    stats = db.stats()
+    stats.update(get_scheduler().stats())
+    
+    embed = discord.Embed(title="📈 Статистика производительности", color=0x3498db)
+    embed.add_field(
+        name="🗄️ База данных",
+        value="\n".join(f"`{name}`: {value}" for name, value in stats.items()),
+        inline=False
+    )
+    
+    embed.add_field(
+        name="⏱️ Запуск",
+        value="\n".join(f"`{name}`: {seconds * 1000:.0f} мс" for name, seconds in startup_timings.items()),
+        inline=False
+    )
+    
+    # Коги с собственными счетчиками реализуют perf_stats()
+    for name, cog in bot.cogs.items():
+        if hasattr(cog, 'perf_stats'):
+            embed.add_field(
+                name=f"⚙️ {name}",
+                value="\n".join(f"`{key}`: {value}" for key, value in cog.perf_stats().items()),
+                inline=False
+            )
+    
+    await ctx.send(embed=embed)
+
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.CommandNotFound):
@@ -1,13 +1,14 @@
 import discord
 from discord.ext import commands
 import random
-from utils.database import Database
+from utils.database import get_database, get_async_database
 from datetime import datetime
 
 class Economy(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db = Database()
+        self.db = get_database()
+        self.adb = get_async_database()
     
     def get_safe_work_reward(self, settings):
         try:
@@ -36,14 +37,14 @@ class Economy(commands.Cog):
             user_id = ctx.author.id
             guild_id = ctx.guild.id
             
-            settings = self.db.get_server_settings(guild_id)
+            settings = await self.adb.get_server_settings(guild_id)
             if not settings:
                 await ctx.send("❌ Настройки сервера не найдены! Обратитесь к администратору.")
                 return
                 
             print(f"DEBUG: Настройки work - min: {settings[1]}, max: {settings[2]}, cooldown: {settings[3]}")
             
-            cooldown = self.db.get_cooldown(user_id, guild_id, 'work')
+            cooldown = await self.adb.get_cooldown(user_id, guild_id, 'work')
             current_time = datetime.now().timestamp()
             
             work_cooldown = settings[3]
@@ -56,20 +57,19 @@ class Economy(commands.Cog):
             
             base_reward = self.get_safe_work_reward(settings)
             
-            multiplier = 1.0
+            multiplier = self.db.get_member_multipliers([role.id for role in ctx.author.roles])[0]
             multiplier_roles = []
             
-            for role in ctx.author.roles:
-                role_mult = self.db.get_role_multiplier(role.id)
-                if role_mult and role_mult[0] > 1.0:
-                    if role_mult[0] > multiplier:
-                        multiplier = role_mult[0]
-                    multiplier_roles.append(f"{role.name} (x{role_mult[0]})")
+            if multiplier > 1.0:
+                for role in ctx.author.roles:
+                    role_mult = self.db.get_role_multiplier(role.id)
+                    if role_mult and role_mult[0] > 1.0:
+                        multiplier_roles.append(f"{role.name} (x{role_mult[0]})")
             
             final_reward = int(base_reward * multiplier)
             
-            self.db.update_balance(user_id, guild_id, final_reward)
-            self.db.set_cooldown(user_id, guild_id, 'work')
+            await self.adb.update_balance(user_id, guild_id, final_reward)
+            await self.adb.set_cooldown(user_id, guild_id, 'work')
             
             embed = discord.Embed(
                 title="💼 Работа",
@@ -98,7 +98,7 @@ class Economy(commands.Cog):
     async def reset_work(self, ctx):
         try:
             guild_id = ctx.guild.id
-            self.db.update_server_settings(guild_id, 
+            await self.adb.update_server_settings(guild_id, 
                                          work_reward_min=10,
                                          work_reward_max=50,
                                          work_cooldown=3600)
@@ -112,12 +112,12 @@ class Economy(commands.Cog):
             user_id = ctx.author.id
             guild_id = ctx.guild.id
             
-            settings = self.db.get_server_settings(guild_id)
+            settings = await self.adb.get_server_settings(guild_id)
             if not settings:
                 await ctx.send("❌ Настройки сервера не найдены!")
                 return
                 
-            user_data = self.db.get_user(user_id, guild_id)
+            user_data = await self.adb.get_user(user_id, guild_id)
             if not user_data:
                 await ctx.send("❌ Данные пользователя не найдены!")
                 return
@@ -136,12 +136,12 @@ class Economy(commands.Cog):
             symbols = ['🍒', '🍋', '🍊', '🍇', '🔔', '💎']
             result = [random.choice(symbols) for _ in range(3)]
             
-            self.db.update_balance(user_id, guild_id, -bet)
+            await self.adb.update_balance(user_id, guild_id, -bet)
             new_balance = user_data[2] - bet
             
             if result[0] == result[1] == result[2]:
                 win = bet * 5
-                self.db.update_balance(user_id, guild_id, win)
+                await self.adb.update_balance(user_id, guild_id, win)
                 new_balance += win
                 embed = discord.Embed(
                     title="🎰 Слот-машина - ДЖЕКПОТ!",
@@ -152,7 +152,7 @@ class Economy(commands.Cog):
                 embed.add_field(name="💎 Баланс", value=f"{new_balance} монет", inline=True)
             elif result[0] == result[1] or result[1] == result[2]:
                 win = bet * 2
-                self.db.update_balance(user_id, guild_id, win)
+                await self.adb.update_balance(user_id, guild_id, win)
                 new_balance += win
                 embed = discord.Embed(
                     title="🎰 Слот-машина - Победа!",
@@ -180,7 +180,7 @@ class Economy(commands.Cog):
     async def balance(self, ctx, member: discord.Member = None):
         try:
             member = member or ctx.author
-            user_data = self.db.get_user(member.id, ctx.guild.id)
+            user_data = await self.adb.get_user(member.id, ctx.guild.id)
             
             if not user_data:
                 await ctx.send(f"💰 Баланс {member.mention}: 0 монет (пользователь не найден в базе)")
@@ -211,18 +211,11 @@ class Economy(commands.Cog):
             receiver_id = member.id
             guild_id = ctx.guild.id
             
-            sender_data = self.db.get_user(sender_id, guild_id)
-            if not sender_data:
-                await ctx.send("❌ Ваши данные не найдены в базе!")
-                return
-            
-            if sender_data[2] < amount:
+            # Списание с проверкой баланса и зачисление - одна транзакция
+            if not await self.adb.transfer(sender_id, receiver_id, guild_id, amount):
                 await ctx.send("❌ Недостаточно монет для перевода!")
                 return
             
-            self.db.update_balance(sender_id, guild_id, -amount)
-            self.db.update_balance(receiver_id, guild_id, amount)
-            
             embed = discord.Embed(
                 title="✅ Перевод выполнен",
                 description=f"{ctx.author.mention} перевел {amount} монет {member.mention}",
@@ -237,7 +230,7 @@ class Economy(commands.Cog):
     @commands.command(name='leaderboardec', aliases=['lbec'])
     async def leaderboard_ec(self, ctx):
         try:
-            leaders = self.db.get_leaderboard_ec(ctx.guild.id)
+            leaders = await self.adb.get_leaderboard_ec(ctx.guild.id)
             
             embed = discord.Embed(title="💰 Топ по балансу", color=0x00ff00)
             
@@ -263,7 +256,7 @@ class Economy(commands.Cog):
                 await ctx.send("❌ Сумма должна быть положительной!")
                 return
                 
-            self.db.update_balance(member.id, ctx.guild.id, amount)
+            await self.adb.update_balance(member.id, ctx.guild.id, amount)
             await ctx.send(f"✅ {member.mention} выдано {amount} монет")
         except Exception as e:
             await ctx.send(f"❌ Ошибка выдачи: {e}")
@@ -276,7 +269,7 @@ class Economy(commands.Cog):
                 await ctx.send("❌ Сумма должна быть положительной!")
                 return
                 
-            self.db.update_balance(member.id, ctx.guild.id, -amount)
+            await self.adb.update_balance(member.id, ctx.guild.id, -amount)
             await ctx.send(f"✅ У {member.mention} забрано {amount} монет")
         except Exception as e:
             await ctx.send(f"❌ Ошибка изъятия: {e}")
@@ -289,7 +282,7 @@ class Economy(commands.Cog):
                 await ctx.send("❌ Баланс не может быть отрицательным!")
                 return
                 
-            self.db.set_balance(member.id, ctx.guild.id, amount)
+            await self.adb.set_balance(member.id, ctx.guild.id, amount)
             await ctx.send(f"✅ Баланс {member.mention} установлен на {amount} монет")
         except Exception as e:
             await ctx.send(f"❌ Ошибка установки баланса: {e}")
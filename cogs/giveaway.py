@@ -1,68 +1,58 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from datetime import datetime, timedelta
-import asyncio
 import random
 
 class Giveaway(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        from utils.database import Database
-        self.db = Database()
-        self.check_giveaways.start()
+        from utils.database import get_database, get_async_database
+        self.db = get_database()
+        self.adb = get_async_database()
+        from utils.scheduler import get_scheduler
+        self.scheduler = get_scheduler()
+        self.scheduler.register('giveaway_end', self.on_giveaway_due)
+
+    async def cog_load(self):
+        # Розыгрыши, созданные до появления планировщика, ставим в очередь
+        for giveaway in await self.adb.get_active_giveaways():
+            await self.schedule_end(giveaway[0], giveaway[1], giveaway[5])
 
     def cog_unload(self):
-        self.check_giveaways.cancel()
+        self.scheduler.unregister('giveaway_end')
+
+    async def schedule_end(self, message_id, guild_id, end_time):
+        await self.scheduler.schedule(f'giveaway:{message_id}', 'giveaway_end', end_time, {'message_id': message_id}, guild_id)
 
     async def check_permissions(self, ctx):
-        """Проверка прав через систему групп ролей"""
-        cursor = self.db.conn.cursor()
-        
-        # Проверяем группы admin, high_admin, owner
-        admin_roles = []
-        for group in ['admin', 'high_admin', 'owner']:
-            cursor.execute('SELECT role_id FROM role_assignments WHERE guild_id = ? AND role_group = ?', (ctx.guild.id, group))
-            roles = cursor.fetchall()
-            admin_roles.extend([role[0] for role in roles])
-        
-        # Проверяем есть ли у пользователя одна из этих ролей
-        user_roles = [role.id for role in ctx.author.roles]
-        has_permission = any(role_id in user_roles for role_id in admin_roles)
-        
-        # Если нет ролей через систему, проверяем стандартные права Discord
-        if not has_permission:
-            has_permission = ctx.author.guild_permissions.manage_guild
-        
-        return has_permission
+        """Проверка прав через систему групп ролей (ctx - команда или взаимодействие)"""
+        return await self.adb.is_admin(ctx)
 
-    @tasks.loop(seconds=30)
-    async def check_giveaways(self):
-        try:
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT * FROM giveaways WHERE end_time <= ? AND ended = 0', (int(datetime.now().timestamp()),))
-            giveaways = cursor.fetchall()
-            
-            for giveaway in giveaways:
-                await self.end_giveaway(giveaway)
-                
-        except Exception as e:
-            print(f"❌ Ошибка проверки розыгрышей: {e}")
+    async def on_giveaway_due(self, payload):
+        """Срабатывание планировщика в момент окончания розыгрыша"""
+        giveaway = await self.adb.get_giveaway(payload['message_id'], active_only=True)
+        if giveaway and not await self.end_giveaway(giveaway):
+            # Планировщик повторит задачу позже
+            raise RuntimeError(f"розыгрыш {giveaway[0]} не завершен")
 
     async def end_giveaway(self, giveaway):
+        """Подвести итоги. True - розыгрыш завершен, False - повторить позже"""
         try:
             message_id, guild_id, channel_id, prize, winners_count, end_time, ended = giveaway
             
             guild = self.bot.get_guild(guild_id)
-            if not guild:
-                return
+            if not guild or guild.unavailable:
+                # Сервер недоступен или еще не загружен
+                return False
                 
             channel = guild.get_channel(channel_id)
             if not channel:
-                return
+                # Канал удален - объявить итоги негде, закрываем розыгрыш без них
+                print(f"⚠️ Канал розыгрыша {message_id} удален, розыгрыш закрыт без объявления")
+                await self.adb.finish_giveaway(message_id)
+                return True
             
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT user_id FROM giveaway_entries WHERE message_id = ?', (message_id,))
-            entries = [row[0] for row in cursor.fetchall()]
+            entries = await self.adb.get_giveaway_entries(message_id)
             
             if not entries:
                 embed = discord.Embed(
@@ -80,9 +70,8 @@ class Giveaway(commands.Cog):
                 except:
                     pass
                 
-                cursor.execute('UPDATE giveaways SET ended = 1 WHERE message_id = ?', (message_id,))
-                self.db.conn.commit()
-                return
+                await self.adb.finish_giveaway(message_id)
+                return True
             
             winners = []
             available_entries = entries.copy()
@@ -130,11 +119,12 @@ class Giveaway(commands.Cog):
             except:
                 pass
             
-            cursor.execute('UPDATE giveaways SET ended = 1 WHERE message_id = ?', (message_id,))
-            self.db.conn.commit()
+            await self.adb.finish_giveaway(message_id)
+            return True
             
         except Exception as e:
             print(f"❌ Ошибка завершения розыгрыша: {e}")
+            return False
 
     @commands.command(name='giveaway', aliases=['gstart'])
     async def giveaway_start(self, ctx, duration: str, winners: int, *, prize: str):
@@ -200,12 +190,8 @@ class Giveaway(commands.Cog):
         
         message = await ctx.send(embed=embed, view=view)
         
-        cursor = self.db.conn.cursor()
-        cursor.execute('''
-            INSERT INTO giveaways (message_id, guild_id, channel_id, prize, winners_count, end_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (message.id, ctx.guild.id, ctx.channel.id, prize, winners, end_timestamp))
-        self.db.conn.commit()
+        await self.adb.create_giveaway(message.id, ctx.guild.id, ctx.channel.id, prize, winners, end_timestamp)
+        await self.schedule_end(message.id, ctx.guild.id, end_timestamp)
         
         await ctx.send(f"✅ Розыгрыш запущен! Он завершится {time_display}.")
 
@@ -223,9 +209,7 @@ class Giveaway(commands.Cog):
             return
         
         try:
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT * FROM giveaways WHERE message_id = ?', (message_id,))
-            giveaway = cursor.fetchone()
+            giveaway = await self.adb.get_giveaway(message_id)
             
             if not giveaway:
                 await ctx.send("❌ Розыгрыш не найден!")
@@ -237,8 +221,7 @@ class Giveaway(commands.Cog):
                 await ctx.send("❌ Этот розыгрыш еще не завершен!")
                 return
             
-            cursor.execute('SELECT user_id FROM giveaway_entries WHERE message_id = ?', (message_id,))
-            entries = [row[0] for row in cursor.fetchall()]
+            entries = await self.adb.get_giveaway_entries(message_id)
             
             if not entries:
                 await ctx.send("❌ Не было участников для перевыбора!")
@@ -285,9 +268,7 @@ class Giveaway(commands.Cog):
             return
         
         try:
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT * FROM giveaways WHERE message_id = ?', (message_id,))
-            giveaway = cursor.fetchone()
+            giveaway = await self.adb.get_giveaway(message_id)
             
             if not giveaway:
                 await ctx.send("❌ Розыгрыш не найден!")
@@ -297,11 +278,11 @@ class Giveaway(commands.Cog):
                 await ctx.send("❌ Этот розыгрыш уже завершен!")
                 return
             
-            cursor.execute('UPDATE giveaways SET end_time = ? WHERE message_id = ?', 
-                         (int(datetime.now().timestamp()), message_id))
-            self.db.conn.commit()
+            end_timestamp = int(datetime.now().timestamp())
+            await self.adb.set_giveaway_end_time(message_id, end_timestamp)
+            await self.schedule_end(message_id, giveaway[1], end_timestamp)
             
-            await ctx.send("✅ Розыгрыш завершен досрочно! Результаты появятся через несколько секунд.")
+            await ctx.send("✅ Розыгрыш завершен досрочно!")
             
         except Exception as e:
             await ctx.send(f"❌ Ошибка завершения: {e}")
@@ -310,9 +291,7 @@ class Giveaway(commands.Cog):
     async def giveaway_list(self, ctx):
         """Показать активные розыгрыши"""
         # Эта команда доступна всем
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT * FROM giveaways WHERE guild_id = ? AND ended = 0 ORDER BY end_time ASC', (ctx.guild.id,))
-        giveaways = cursor.fetchall()
+        giveaways = await self.adb.get_guild_giveaways(ctx.guild.id)
         
         if not giveaways:
             embed = discord.Embed(
@@ -334,8 +313,7 @@ class Giveaway(commands.Cog):
             channel = ctx.guild.get_channel(channel_id)
             channel_name = channel.mention if channel else "Неизвестный канал"
             
-            cursor.execute('SELECT COUNT(*) FROM giveaway_entries WHERE message_id = ?', (message_id,))
-            participants_count = cursor.fetchone()[0]
+            participants_count = await self.adb.count_giveaway_entries(message_id)
             
             embed.add_field(
                 name=f"🎁 {prize}",
@@ -357,9 +335,7 @@ class Giveaway(commands.Cog):
         try:
             message_id = interaction.message.id
             
-            cursor = self.db.conn.cursor()
-            cursor.execute('SELECT * FROM giveaways WHERE message_id = ? AND ended = 0', (message_id,))
-            giveaway = cursor.fetchone()
+            giveaway = await self.adb.get_giveaway(message_id, active_only=True)
             
             if not giveaway:
                 await interaction.response.send_message("❌ Этот розыгрыш не активен!", ephemeral=True)
@@ -369,16 +345,10 @@ class Giveaway(commands.Cog):
                 await interaction.response.send_message("❌ Розыгрыш уже завершен!", ephemeral=True)
                 return
             
-            cursor.execute('SELECT 1 FROM giveaway_entries WHERE message_id = ? AND user_id = ?', 
-                         (message_id, interaction.user.id))
-            if cursor.fetchone():
+            if not await self.adb.add_giveaway_entry(message_id, interaction.user.id):
                 await interaction.response.send_message("❌ Вы уже участвуете в этом розыгрыше!", ephemeral=True)
                 return
             
-            cursor.execute('INSERT INTO giveaway_entries (message_id, user_id) VALUES (?, ?)', 
-                         (message_id, interaction.user.id))
-            self.db.conn.commit()
-            
             await interaction.response.send_message("✅ Вы успешно присоединились к розыгрышу! 🎉", ephemeral=True)
             
         except Exception as e:
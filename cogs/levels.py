@@ -1,55 +1,168 @@
 import discord
-from discord.ext import commands
-from utils.database import Database
+from discord.ext import commands, tasks
+from utils.database import get_database, get_async_database
+from utils.xp_buffer import XPAccumulator
+from utils.voice_tracker import VoiceTracker
+from utils.leveling import calculate_level, xp_for_level, level_progress, summarize_rewards
+
+# Как часто накопленный опыт сбрасывается в базу
+XP_FLUSH_SECONDS = 30
 
 class Levels(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db = Database()
+        self.db = get_database()
+        self.adb = get_async_database()
+        self.xp_buffer = XPAccumulator(self.adb)
+        self.voice = VoiceTracker(self.adb)
+        self.flush_xp.start()
+        self.voice_tick.start()
     
-    def calculate_level(self, xp):
-        return int((xp / 50) ** 0.5) + 1
+    async def cog_unload(self):
+        self.voice_tick.cancel()
+        # Начисляем набранные минуты; сами сессии остаются в базе до перезапуска
+        await self.award_voice(self.voice.collect())
+        await self.voice.persist()
+        self.flush_xp.cancel()
+        await self.xp_buffer.flush()
     
-    def xp_for_level(self, level):
-        return (level - 1) ** 2 * 50
+    def perf_stats(self):
+        stats = self.xp_buffer.stats()
+        stats.update(self.voice.stats())
+        return stats
+    
+    @tasks.loop(seconds=XP_FLUSH_SECONDS)
+    async def flush_xp(self):
+        await self.xp_buffer.flush()
+    
+    @tasks.loop(minutes=1)
+    async def voice_tick(self):
+        try:
+            await self.award_voice(self.voice.collect())
+            await self.voice.persist()
+        except Exception as e:
+            print(f"❌ Ошибка начисления опыта за голос: {e}")
+    
+    @voice_tick.before_loop
+    async def restore_voice_sessions(self):
+        """Сверить сохраненные сессии с теми, кто сейчас в голосе"""
+        await self.bot.wait_until_ready()
+        saved = await self.voice.restore()
+        
+        for guild in self.bot.guilds:
+            for channel in guild.voice_channels:
+                for member in channel.members:
+                    if not member.bot and self.voice_eligible(member, member.voice):
+                        # Время простоя засчитывается, если пользователь так и не вышел
+                        self.voice.join(guild.id, member.id, *saved.pop((guild.id, member.id), ()))
+        
+        for guild_id, user_id in saved:
+            self.voice.discard(guild_id, user_id)
+        await self.voice.persist()
+    
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.xp_buffer.forget_guild(guild.id)
+        self.voice.forget_guild(guild.id)
+    
+    def voice_eligible(self, member, state):
+        """Опыт идет только в обычных каналах и без заглушенного звука"""
+        if state is None or state.channel is None or state.self_deaf or state.deaf:
+            return False
+        afk_channel = member.guild.afk_channel
+        return afk_channel is None or state.channel.id != afk_channel.id
     
-    async def give_level_reward(self, member, level, channel):
-        """Выдача награды за достижение уровня"""
-        reward = self.db.get_level_reward(member.guild.id, level)
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        if member.bot:
+            return
         
-        if not reward:
-            return None
+        was_eligible = self.voice_eligible(member, before)
+        is_eligible = self.voice_eligible(member, after)
         
-        guild_id, level, reward_type, role_id, currency_amount = reward
+        if is_eligible and not was_eligible:
+            self.voice.join(member.guild.id, member.id)
+        elif was_eligible and not is_eligible:
+            minutes = self.voice.leave(member.guild.id, member.id)
+            if minutes:
+                await self.award_voice([(member.guild.id, member.id, minutes)])
+    
+    async def award_voice(self, awards):
+        """Начислить опыт за минуты в голосе: список (guild_id, user_id, минуты)"""
+        for guild_id, user_id, minutes in awards:
+            guild = self.bot.get_guild(guild_id)
+            member = guild.get_member(user_id) if guild else None
+            if not member:
+                continue
+            
+            settings = await self.adb.get_server_settings(guild_id)
+            multiplier = self.db.get_member_multipliers([role.id for role in member.roles])[1]
+            xp_gain = int(settings[5] * minutes * multiplier)
+            if xp_gain <= 0:
+                continue
+            
+            old_level, new_level = await self.xp_buffer.add(guild_id, user_id, xp_gain, self.calculate_level)
+            if new_level > old_level:
+                # Канала для объявления нет - сообщаем в личные сообщения
+                embed = await self.level_up(member, old_level, new_level)
+                embed.description = f"Вы достигли **{new_level}** уровня на сервере {guild.name}!"
+                try:
+                    await member.send(embed=embed)
+                except:
+                    pass
+    
+    async def get_user_data(self, member):
+        """Данные пользователя с учетом еще не записанного опыта"""
+        user_data = await self.adb.get_user(member.id, member.guild.id)
+        cached = self.xp_buffer.get(member.guild.id, member.id)
+        if cached:
+            user_data = user_data[:3] + cached + user_data[5:]
+        return user_data
+    
+    def calculate_level(self, xp):
+        return calculate_level(xp)
+    
+    def xp_for_level(self, level):
+        return xp_for_level(level)
+    
+    async def level_up(self, member, old_level, new_level):
+        """Переход с old_level на new_level за один проход.
+
+        Награды всех пройденных уровней выдаются вместе: монеты - одной записью
+        баланса, роли - одним add_roles. Возвращает один итоговый embed.
+        """
+        rewards = await self.adb.get_rewards_between(member.guild.id, old_level, new_level)
+        currency, role_ids = summarize_rewards(rewards)
         
         embed = discord.Embed(
-            title="🎁 Получена награда за уровень!",
-            description=f"За достижение **{level}** уровня вы получаете:",
+            title="🎉 Новый уровень!",
+            description=f"{member.mention} достиг **{new_level}** уровня!",
             color=0x00ff00
         )
+        if new_level - old_level > 1:
+            embed.set_footer(text=f"Пройдено уровней: {new_level - old_level}")
         
         rewards_given = []
         
         # Выдача валюты
-        if reward_type in ['currency', 'both'] and currency_amount > 0:
-            self.db.update_balance(member.id, member.guild.id, currency_amount)
-            rewards_given.append(f"💰 **{currency_amount} монет**")
+        if currency > 0:
+            await self.adb.update_balance(member.id, member.guild.id, currency)
+            rewards_given.append(f"💰 **{currency} монет**")
         
-        # Выдача роли
-        if reward_type in ['role', 'both'] and role_id:
-            role = member.guild.get_role(role_id)
-            if role:
-                try:
-                    await member.add_roles(role)
-                    rewards_given.append(f"🎭 Роль {role.mention}")
-                except discord.Forbidden:
-                    rewards_given.append(f"🎭 Роль {role.name} (не удалось выдать)")
-                except Exception as e:
-                    rewards_given.append(f"🎭 Роль {role.name} (ошибка: {str(e)})")
+        # Выдача ролей
+        roles = [role for role in map(member.guild.get_role, role_ids) if role and role not in member.roles]
+        if roles:
+            try:
+                await member.add_roles(*roles, reason=f"Награда за {new_level} уровень")
+                rewards_given.extend(f"🎭 Роль {role.mention}" for role in roles)
+            except discord.Forbidden:
+                rewards_given.extend(f"🎭 Роль {role.name} (не удалось выдать)" for role in roles)
+            except Exception as e:
+                rewards_given.extend(f"🎭 Роль {role.name} (ошибка: {str(e)})" for role in roles)
         
         if rewards_given:
             embed.add_field(
-                name="Полученные награды:",
+                name="🎁 Полученные награды:",
                 value="\n".join(rewards_given),
                 inline=False
             )
@@ -62,20 +175,18 @@ class Levels(commands.Cog):
                     timestamp=discord.utils.utcnow()
                 )
                 log_embed.add_field(name="Пользователь", value=member.mention, inline=True)
-                log_embed.add_field(name="Уровень", value=level, inline=True)
+                log_embed.add_field(name="Уровень", value=new_level if new_level - old_level == 1 else f"{old_level + 1}–{new_level}", inline=True)
                 log_embed.add_field(name="Награды", value=", ".join(rewards_given), inline=True)
                 
-                settings = self.db.get_server_settings(member.guild.id)
+                settings = await self.adb.get_server_settings(member.guild.id)
                 if settings[9] and settings[10]:
                     log_channel = member.guild.get_channel(settings[10])
                     if log_channel:
                         await log_channel.send(embed=log_embed)
             except:
                 pass
-            
-            return embed
         
-        return None
+        return embed
     
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -85,54 +196,32 @@ class Levels(commands.Cog):
         user_id = message.author.id
         guild_id = message.guild.id
         
-        settings = self.db.get_server_settings(guild_id)
+        settings = await self.adb.get_server_settings(guild_id)
         xp_gain = settings[4]
         
         # Применяем множители ролей
-        multiplier = 1.0
-        for role in message.author.roles:
-            role_mult = self.db.get_role_multiplier(role.id)
-            if role_mult and role_mult[1] > multiplier:
-                multiplier = role_mult[1]
+        multiplier = self.db.get_member_multipliers([role.id for role in message.author.roles])[1]
         
         xp_gain = int(xp_gain * multiplier)
-        self.db.update_xp(user_id, guild_id, xp_gain)
         
-        # Проверяем уровень
-        user_data = self.db.get_user(user_id, guild_id)
-        new_level = self.calculate_level(user_data[3])
+        # Опыт копится в памяти, уровень считается по текущей сумме
+        old_level, new_level = await self.xp_buffer.add(guild_id, user_id, xp_gain, self.calculate_level)
         
-        if new_level > user_data[4]:
-            self.db.set_level(user_id, guild_id, new_level)
-            
-            # Основное сообщение о новом уровне
-            embed = discord.Embed(
-                title="🎉 Новый уровень!",
-                description=f"{message.author.mention} достиг **{new_level}** уровня!",
-                color=0x00ff00
-            )
-            
-            # Проверяем и выдает награду за уровень
-            reward_embed = await self.give_level_reward(message.author, new_level, message.channel)
-            
-            if reward_embed:
-                await message.channel.send(embed=embed)
-                await message.channel.send(embed=reward_embed)
-            else:
-                await message.channel.send(embed=embed)
+        if new_level > old_level:
+            # Одно сообщение о новом уровне вместе с наградами
+            embed = await self.level_up(message.author, old_level, new_level)
+            await message.channel.send(embed=embed)
     
     @commands.command(name='level')
     async def level(self, ctx, member: discord.Member = None):
         """Просмотр уровня"""
         member = member or ctx.author
-        user_data = self.db.get_user(member.id, ctx.guild.id)
+        user_data = await self.get_user_data(member)
         
         current_xp = user_data[3]
-        current_level = user_data[4]
+        # Уровень и прогресс - поиск по таблице порогов
+        current_level, progress, total_needed = level_progress(current_xp)
         xp_needed = self.xp_for_level(current_level + 1)
-        xp_current_level = self.xp_for_level(current_level)
-        progress = current_xp - xp_current_level
-        total_needed = xp_needed - xp_current_level
         
         progress_percent = int((progress / total_needed) * 100) if total_needed > 0 else 100
         
@@ -155,7 +244,7 @@ class Levels(commands.Cog):
             inline=False
         )
         
-        next_reward = self.db.get_level_reward(ctx.guild.id, current_level + 1)
+        next_reward = await self.adb.get_level_reward(ctx.guild.id, current_level + 1)
         if next_reward:
             reward_info = self.format_reward_info(next_reward, ctx.guild)
             embed.add_field(
@@ -184,7 +273,8 @@ class Levels(commands.Cog):
     
     @commands.command(name='leaderboardlv', aliases=['lblv'])
     async def leaderboard_lv(self, ctx):
-        leaders = self.db.get_leaderboard_lv(ctx.guild.id)
+        await self.xp_buffer.flush()
+        leaders = await self.adb.get_leaderboard_lv(ctx.guild.id)
         
         embed = discord.Embed(
             title="🏆 Топ по уровням", 
@@ -208,15 +298,11 @@ class Levels(commands.Cog):
     @commands.command(name='rank')
     async def rank(self, ctx, member: discord.Member = None):
         member = member or ctx.author
-        user_data = self.db.get_user(member.id, ctx.guild.id)
+        user_data = await self.get_user_data(member)
         
         current_xp = user_data[3]
-        current_level = user_data[4]
         balance = user_data[2]
-        xp_needed = self.xp_for_level(current_level + 1)
-        xp_current_level = self.xp_for_level(current_level)
-        progress = current_xp - xp_current_level
-        total_needed = xp_needed - xp_current_level
+        current_level, progress, total_needed = level_progress(current_xp)
         progress_percent = int((progress / total_needed) * 100) if total_needed > 0 else 100
         
         progress_bar_length = 15
@@ -232,14 +318,25 @@ class Levels(commands.Cog):
         embed.add_field(name="⭐ Опыт", value=current_xp, inline=True)
         embed.add_field(name="💰 Баланс", value=f"{balance} монет", inline=True)
         
+        # Место в топе считается по записанному опыту
+        await self.xp_buffer.flush()
+        neighbours = await self.adb.get_level_around(ctx.guild.id, member.id)
+        if neighbours:
+            lines = []
+            for position, user_id, level, xp in neighbours:
+                user = self.bot.get_user(user_id)
+                username = user.name if user else f"Неизвестный ({user_id})"
+                line = f"{position}. {username} — ур. {level}"
+                lines.append(f"**{line}**" if user_id == member.id else line)
+            embed.add_field(name="📈 Место в топе", value="\n".join(lines), inline=False)
+        
         embed.add_field(
             name="🎯 Прогресс", 
             value=f"`{progress_bar}` {progress_percent}%\n{progress}/{total_needed} XP до уровня {current_level + 1}", 
             inline=False
         )
         
-        rewards = self.db.get_all_level_rewards(ctx.guild.id)
-        user_rewards = [r for r in rewards if r[1] <= current_level]
+        user_rewards = await self.adb.get_rewards_up_to(ctx.guild.id, current_level)
         
         if user_rewards:
             reward_text = []
@@ -286,7 +383,7 @@ class Levels(commands.Cog):
             await ctx.send("❌ Я не могу управлять этой ролью! Роль находится выше моей в иерархии.")
             return
         
-        self.db.set_level_reward(
+        await self.adb.set_level_reward(
             ctx.guild.id, 
             level, 
             reward_type, 
@@ -312,13 +409,13 @@ class Levels(commands.Cog):
     
     @level_reward.command(name='remove')
     async def remove_level_reward(self, ctx, level: int):
-        reward = self.db.get_level_reward(ctx.guild.id, level)
+        reward = await self.adb.get_level_reward(ctx.guild.id, level)
         
         if not reward:
             await ctx.send(f"❌ Награда за {level} уровень не найдена!")
             return
         
-        self.db.delete_level_reward(ctx.guild.id, level)
+        await self.adb.delete_level_reward(ctx.guild.id, level)
         
         embed = discord.Embed(
             title="✅ Награда удалена",
@@ -329,7 +426,7 @@ class Levels(commands.Cog):
     
     @level_reward.command(name='list')
     async def list_level_rewards(self, ctx):
-        rewards = self.db.get_all_level_rewards(ctx.guild.id)
+        rewards = await self.adb.get_all_level_rewards(ctx.guild.id)
         
         if not rewards:
             embed = discord.Embed(
@@ -368,7 +465,7 @@ class Levels(commands.Cog):
     
     @level_reward.command(name='info')
     async def level_reward_info(self, ctx, level: int):
-        reward = self.db.get_level_reward(ctx.guild.id, level)
+        reward = await self.adb.get_level_reward(ctx.guild.id, level)
         
         if not reward:
             await ctx.send(f"❌ Награда за {level} уровень не найдена!")
@@ -399,10 +496,13 @@ class Levels(commands.Cog):
         if amount < 0:
             await ctx.send("❌ Опыт не может быть отрицательным!")
             return
-            
-        self.db.set_xp(member.id, ctx.guild.id, amount)
+        
+        await self.xp_buffer.flush()
+        self.xp_buffer.forget(ctx.guild.id, member.id)
+        old_level = (await self.adb.get_user(member.id, ctx.guild.id))[4]
+        await self.adb.set_xp(member.id, ctx.guild.id, amount)
         new_level = self.calculate_level(amount)
-        self.db.set_level(member.id, ctx.guild.id, new_level)
+        await self.adb.set_level(member.id, ctx.guild.id, new_level)
         
         embed = discord.Embed(
             title="✅ Опыт установлен",
@@ -411,6 +511,10 @@ class Levels(commands.Cog):
         )
         embed.add_field(name="Новый уровень", value=new_level, inline=True)
         await ctx.send(embed=embed)
+        
+        # Награды за все пропущенные уровни
+        if new_level > old_level:
+            await ctx.send(embed=await self.level_up(member, old_level, new_level))
     
     @commands.command(name='setlevel')
     @commands.has_permissions(administrator=True)
@@ -418,10 +522,13 @@ class Levels(commands.Cog):
         if level < 1:
             await ctx.send("❌ Уровень не может быть меньше 1!")
             return
-            
+        
+        await self.xp_buffer.flush()
+        self.xp_buffer.forget(ctx.guild.id, member.id)
+        old_level = (await self.adb.get_user(member.id, ctx.guild.id))[4]
         xp_needed = self.xp_for_level(level)
-        self.db.set_xp(member.id, ctx.guild.id, xp_needed)
-        self.db.set_level(member.id, ctx.guild.id, level)
+        await self.adb.set_xp(member.id, ctx.guild.id, xp_needed)
+        await self.adb.set_level(member.id, ctx.guild.id, level)
         
         embed = discord.Embed(
             title="✅ Уровень установлен",
@@ -430,6 +537,29 @@ class Levels(commands.Cog):
         )
         embed.add_field(name="Необходимый опыт", value=xp_needed, inline=True)
         await ctx.send(embed=embed)
+        
+        if level > old_level:
+            await ctx.send(embed=await self.level_up(member, old_level, level))
+    
+    @commands.command(name='recomputelevels')
+    @commands.has_permissions(administrator=True)
+    async def recompute_levels(self, ctx):
+        """Пересчитать уровни всех участников по текущей кривой (админ)"""
+        # Сначала записываем накопленный опыт, чтобы пересчет видел актуальные значения
+        await self.xp_buffer.flush()
+        await ctx.send("⏳ Пересчет уровней всех участников...")
+        
+        scanned, changed, elapsed = await self.adb.recompute_levels(ctx.guild.id)
+        
+        embed = discord.Embed(
+            title="✅ Уровни пересчитаны",
+            color=0x00ff00
+        )
+        embed.add_field(name="Проверено", value=scanned, inline=True)
+        embed.add_field(name="Изменено", value=changed, inline=True)
+        embed.add_field(name="Время", value=f"{elapsed:.2f} с", inline=True)
+        embed.set_footer(text="Награды за уровни при пересчете не выдаются")
+        await ctx.send(embed=embed)
 
 async def setup(bot):
     await bot.add_cog(Levels(bot))
\ No newline at end of file
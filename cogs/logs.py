@@ -1,16 +1,67 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from datetime import datetime
-import asyncio
+from collections import Counter
+import os
+from utils.log_dispatcher import LogDispatcher
+from utils.audit_cache import AuditLogCache
+from utils.message_store import MessageStore, MESSAGE_STORE_GUILD_BYTES, MESSAGE_RETENTION
 
 class Logs(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        from utils.database import Database
-        self.db = Database()
+        from utils.database import get_database, get_async_database
+        self.db = get_database()
+        self.adb = get_async_database()
+        self.dispatcher = LogDispatcher(self.summarize_logs)
+        # Один запрос журнала аудита на всплеск событий сервера
+        self.audit = AuditLogCache()
+        # Свой кэш текста сообщений для логов удаления и изменения
+        # MESSAGE_CACHE_MB - память на сервер, MESSAGE_CACHE_HOURS - срок хранения,
+        # MESSAGE_CACHE_SPILL - файл SQLite для вытесненных сообщений
+        self.messages = MessageStore(
+            max_bytes=int(float(os.getenv('MESSAGE_CACHE_MB', MESSAGE_STORE_GUILD_BYTES / 1024 / 1024)) * 1024 * 1024),
+            retention=float(os.getenv('MESSAGE_CACHE_HOURS', MESSAGE_RETENTION / 3600)) * 3600,
+            spill_path=os.getenv('MESSAGE_CACHE_SPILL') or None
+        )
+
+    async def cog_load(self):
+        self.dispatcher.start()
+        self.maintain_messages.start()
+
+    async def cog_unload(self):
+        self.maintain_messages.cancel()
+        await self.dispatcher.stop()
+        self.messages.close()
+
+    def perf_stats(self):
+        stats = self.dispatcher.stats()
+        stats.update(self.audit.stats())
+        stats.update(self.messages.stats())
+        return stats
+
+    @tasks.loop(minutes=1)
+    async def maintain_messages(self):
+        try:
+            await self.messages.maintain()
+        except Exception as e:
+            print(f"❌ Ошибка обслуживания кэша сообщений: {e}")
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.audit.drop(guild.id)
+        self.messages.drop_guild(guild.id)
+
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        # Запоминаем только сообщения серверов, где включены логи
+        if message.author.bot or not message.guild:
+            return
+        if await self.get_log_channel(message.guild.id):
+            self.messages.add(message.id, message.guild.id, message.channel.id, message.author.id, message.content)
 
     async def get_log_channel(self, guild_id):
-        settings = self.db.get_server_settings(guild_id)
+        settings = await self.adb.get_server_settings(guild_id)
         if not settings[9]:  # logs_enabled
             return None
         
@@ -21,13 +72,33 @@ class Logs(commands.Cog):
         channel = self.bot.get_channel(channel_id)
         return channel
 
-    async def send_log(self, guild, embed):
+    async def send_log(self, guild, embed, group=None, detail=None):
+        """Поставить лог в очередь канала; group - ключ для сворачивания всплесков"""
         channel = await self.get_log_channel(guild.id)
         if channel:
-            try:
-                await channel.send(embed=embed)
-            except:
-                pass
+            self.dispatcher.submit(channel, embed, group, detail)
+
+    def summarize_logs(self, group, details):
+        """Сводка вместо пачки однотипных событий"""
+        kind, channel_id = group
+        if kind == 'delete':
+            embed = discord.Embed(
+                title=f"🗑️ Удалено сообщений: {len(details)}",
+                color=0xe74c3c,
+                timestamp=datetime.now()
+            )
+            embed.add_field(name="Канал", value=f"<#{channel_id}>", inline=True)
+            authors = Counter(details).most_common(10)
+            embed.add_field(name="Авторы", value="\n".join(f"{author} × {count}" for author, count in authors), inline=False)
+            return embed
+        
+        embed = discord.Embed(
+            title=f"🎤 Изменений голосового статуса: {len(details)}",
+            description="\n".join(details[:20]) + (f"\n… и еще {len(details) - 20}" if len(details) > 20 else ""),
+            color=0x9b59b6,
+            timestamp=datetime.now()
+        )
+        return embed
 
     # Логирование ролей
     @commands.Cog.listener()
@@ -47,10 +118,9 @@ class Logs(commands.Cog):
         
         # Получаем информацию о том, кто создал роль из аудит-лога
         try:
-            async for entry in role.guild.audit_logs(limit=5, action=discord.AuditLogAction.role_create):
-                if entry.target.id == role.id:
-                    embed.add_field(name="Создатель", value=entry.user.mention, inline=True)
-                    break
+            entry = await self.audit.find(role.guild, discord.AuditLogAction.role_create, role.id)
+            if entry:
+                embed.add_field(name="Создатель", value=entry.user.mention, inline=True)
         except:
             pass
             
@@ -70,10 +140,9 @@ class Logs(commands.Cog):
         
         # Получаем информацию о том, кто удалил роль из аудит-лога
         try:
-            async for entry in role.guild.audit_logs(limit=5, action=discord.AuditLogAction.role_delete):
-                if entry.target.id == role.id:
-                    embed.add_field(name="Удалил", value=entry.user.mention, inline=True)
-                    break
+            entry = await self.audit.find(role.guild, discord.AuditLogAction.role_delete, role.id)
+            if entry:
+                embed.add_field(name="Удалил", value=entry.user.mention, inline=True)
         except:
             pass
             
@@ -128,10 +197,9 @@ class Logs(commands.Cog):
             
             # Получаем информацию о том, кто изменил роль из аудит-лога
             try:
-                async for entry in after.guild.audit_logs(limit=5, action=discord.AuditLogAction.role_update):
-                    if entry.target.id == after.id:
-                        embed.add_field(name="Изменил", value=entry.user.mention, inline=True)
-                        break
+                entry = await self.audit.find(after.guild, discord.AuditLogAction.role_update, after.id)
+                if entry:
+                    embed.add_field(name="Изменил", value=entry.user.mention, inline=True)
             except:
                 pass
                 
@@ -159,10 +227,9 @@ class Logs(commands.Cog):
         
         # Получаем информацию о том, кто создал канал из аудит-лога
         try:
-            async for entry in channel.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_create):
-                if entry.target.id == channel.id:
-                    embed.add_field(name="Создатель", value=entry.user.mention, inline=True)
-                    break
+            entry = await self.audit.find(channel.guild, discord.AuditLogAction.channel_create, channel.id)
+            if entry:
+                embed.add_field(name="Создатель", value=entry.user.mention, inline=True)
         except:
             pass
             
@@ -181,10 +248,9 @@ class Logs(commands.Cog):
         
         # Получаем информацию о том, кто удалил канал из аудит-лога
         try:
-            async for entry in channel.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_delete):
-                if entry.target.id == channel.id:
-                    embed.add_field(name="Удалил", value=entry.user.mention, inline=True)
-                    break
+            entry = await self.audit.find(channel.guild, discord.AuditLogAction.channel_delete, channel.id)
+            if entry:
+                embed.add_field(name="Удалил", value=entry.user.mention, inline=True)
         except:
             pass
             
@@ -262,10 +328,9 @@ class Logs(commands.Cog):
             
             # Получаем информацию о том, кто изменил канал из аудит-лога
             try:
-                async for entry in after.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_update):
-                    if entry.target.id == after.id:
-                        embed.add_field(name="Изменил", value=entry.user.mention, inline=True)
-                        break
+                entry = await self.audit.find(after.guild, discord.AuditLogAction.channel_update, after.id)
+                if entry:
+                    embed.add_field(name="Изменил", value=entry.user.mention, inline=True)
             except:
                 pass
                 
@@ -298,10 +363,9 @@ class Logs(commands.Cog):
         embed.add_field(name="Позиция", value=category.position, inline=True)
         
         try:
-            async for entry in category.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_create):
-                if entry.target.id == category.id:
-                    embed.add_field(name="Создатель", value=entry.user.mention, inline=True)
-                    break
+            entry = await self.audit.find(category.guild, discord.AuditLogAction.channel_create, category.id)
+            if entry:
+                embed.add_field(name="Создатель", value=entry.user.mention, inline=True)
         except:
             pass
             
@@ -318,10 +382,9 @@ class Logs(commands.Cog):
         embed.add_field(name="Позиция", value=category.position, inline=True)
         
         try:
-            async for entry in category.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_delete):
-                if entry.target.id == category.id:
-                    embed.add_field(name="Удалил", value=entry.user.mention, inline=True)
-                    break
+            entry = await self.audit.find(category.guild, discord.AuditLogAction.channel_delete, category.id)
+            if entry:
+                embed.add_field(name="Удалил", value=entry.user.mention, inline=True)
         except:
             pass
             
@@ -347,10 +410,9 @@ class Logs(commands.Cog):
             embed.add_field(name="Изменения", value="\n".join(changes), inline=False)
             
             try:
-                async for entry in after.guild.audit_logs(limit=5, action=discord.AuditLogAction.channel_update):
-                    if entry.target.id == after.id:
-                        embed.add_field(name="Изменил", value=entry.user.mention, inline=True)
-                        break
+                entry = await self.audit.find(after.guild, discord.AuditLogAction.channel_update, after.id)
+                if entry:
+                    embed.add_field(name="Изменил", value=entry.user.mention, inline=True)
             except:
                 pass
                 
@@ -478,45 +540,98 @@ class Logs(commands.Cog):
             await self.send_log(after, embed)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message):
-        if message.author.bot or not message.guild:
+    async def on_raw_message_delete(self, payload):
+        """Удаление сообщения: текст из кэша discord.py или из своего хранилища"""
+        if not payload.guild_id:
+            return
+        guild = self.bot.get_guild(payload.guild_id)
+        record = await self.messages.pop(payload.guild_id, payload.message_id)
+        message = payload.cached_message
+        if guild is None or (message is None and record is None):
             return
+        if message is not None and message.author.bot:
+            return
+        
+        author = message.author.mention if message is not None else f"<@{record.author_id}>"
+        content = record.content if record is not None else message.content
             
         embed = discord.Embed(
             title="🗑️ Удалено сообщение",
             color=0xe74c3c,
             timestamp=datetime.now()
         )
-        embed.add_field(name="Автор", value=message.author.mention, inline=True)
-        embed.add_field(name="Канал", value=message.channel.mention, inline=True)
+        embed.add_field(name="Автор", value=author, inline=True)
+        embed.add_field(name="Канал", value=f"<#{payload.channel_id}>", inline=True)
         
-        if len(message.content) > 0:
-            content = message.content[:1024] + "..." if len(message.content) > 1024 else message.content
+        if len(content) > 0:
+            content = content[:1024] + "..." if len(content) > 1024 else content
             embed.add_field(name="Содержимое", value=content, inline=False)
         
-        await self.send_log(message.guild, embed)
+        await self.send_log(guild, embed, group=('delete', payload.channel_id), detail=author)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        """Массовое удаление (например, !clear) - одна сводка вместо сотни логов"""
+        guild = self.bot.get_guild(payload.guild_id) if payload.guild_id else None
+        if guild is None:
+            return
+        
+        authors = {message.id: message.author for message in payload.cached_messages}
+        mentions = []
+        for message_id in payload.message_ids:
+            record = await self.messages.pop(payload.guild_id, message_id)
+            author = authors.get(message_id)
+            if author is not None:
+                if not author.bot:
+                    mentions.append(author.mention)
+            elif record is not None:
+                mentions.append(f"<@{record.author_id}>")
+        if not mentions:
+            return
+        
+        embed = self.summarize_logs(('delete', payload.channel_id), mentions)
+        await self.send_log(guild, embed)
 
     @commands.Cog.listener()
-    async def on_message_edit(self, before, after):
-        if before.author.bot or before.content == after.content or not before.guild:
+    async def on_raw_message_edit(self, payload):
+        """Изменение сообщения: прежний текст из кэша discord.py или из своего хранилища"""
+        # Без content - это не правка текста (например, подгрузка превью ссылки)
+        if not payload.guild_id or 'content' not in payload.data:
+            return
+        guild = self.bot.get_guild(payload.guild_id)
+        record = await self.messages.lookup(payload.guild_id, payload.message_id)
+        message = payload.cached_message
+        if guild is None or (message is None and record is None):
+            return
+        if message is not None and message.author.bot:
+            return
+        
+        author_id = message.author.id if message is not None else record.author_id
+        before = record.content if record is not None else message.content
+        after = payload.data['content']
+        if before == after:
             return
+        # В хранилище теперь новый текст, время создания прежнее
+        self.messages.add(payload.message_id, payload.guild_id, payload.channel_id, author_id, after,
+                          record.created_at if record is not None else None)
             
         embed = discord.Embed(
             title="✏️ Изменено сообщение",
             color=0xf39c12,
             timestamp=datetime.now()
         )
-        embed.add_field(name="Автор", value=before.author.mention, inline=True)
-        embed.add_field(name="Канал", value=before.channel.mention, inline=True)
+        embed.add_field(name="Автор", value=f"<@{author_id}>", inline=True)
+        embed.add_field(name="Канал", value=f"<#{payload.channel_id}>", inline=True)
         
-        before_content = before.content[:500] + "..." if len(before.content) > 500 else before.content
-        after_content = after.content[:500] + "..." if len(after.content) > 500 else after.content
+        before_content = before[:500] + "..." if len(before) > 500 else before
+        after_content = after[:500] + "..." if len(after) > 500 else after
         
         embed.add_field(name="До", value=before_content or "*пусто*", inline=False)
         embed.add_field(name="После", value=after_content or "*пусто*", inline=False)
-        embed.add_field(name="Ссылка", value=f"[Перейти]({after.jump_url})", inline=True)
+        jump_url = f"https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}"
+        embed.add_field(name="Ссылка", value=f"[Перейти]({jump_url})", inline=True)
         
-        await self.send_log(before.guild, embed)
+        await self.send_log(guild, embed)
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild, user):
@@ -529,12 +644,11 @@ class Logs(commands.Cog):
         embed.add_field(name="ID", value=user.id, inline=True)
         
         try:
-            async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.ban):
-                if entry.target.id == user.id:
-                    embed.add_field(name="Модератор", value=entry.user.mention, inline=True)
-                    if entry.reason:
-                        embed.add_field(name="Причина", value=entry.reason, inline=False)
-                    break
+            entry = await self.audit.find(guild, discord.AuditLogAction.ban, user.id)
+            if entry:
+                embed.add_field(name="Модератор", value=entry.user.mention, inline=True)
+                if entry.reason:
+                    embed.add_field(name="Причина", value=entry.reason, inline=False)
         except:
             pass
             
@@ -551,12 +665,11 @@ class Logs(commands.Cog):
         embed.add_field(name="ID", value=user.id, inline=True)
         
         try:
-            async for entry in guild.audit_logs(limit=5, action=discord.AuditLogAction.unban):
-                if entry.target.id == user.id:
-                    embed.add_field(name="Модератор", value=entry.user.mention, inline=True)
-                    if entry.reason:
-                        embed.add_field(name="Причина", value=entry.reason, inline=False)
-                    break
+            entry = await self.audit.find(guild, discord.AuditLogAction.unban, user.id)
+            if entry:
+                embed.add_field(name="Модератор", value=entry.user.mention, inline=True)
+                if entry.reason:
+                    embed.add_field(name="Причина", value=entry.reason, inline=False)
         except:
             pass
             
@@ -566,19 +679,18 @@ class Logs(commands.Cog):
     async def on_member_remove(self, member):
         if member.guild:
             try:
-                async for entry in member.guild.audit_logs(limit=5, action=discord.AuditLogAction.kick):
-                    if entry.target.id == member.id:
-                        embed = discord.Embed(
-                            title="👢 Пользователь кикнут",
-                            description=f"{member.mention} ({member})",
-                            color=0xe67e22,
-                            timestamp=datetime.now()
-                        )
-                        embed.add_field(name="Модератор", value=entry.user.mention, inline=True)
-                        if entry.reason:
-                            embed.add_field(name="Причина", value=entry.reason, inline=False)
-                        await self.send_log(member.guild, embed)
-                        break
+                entry = await self.audit.find(member.guild, discord.AuditLogAction.kick, member.id)
+                if entry:
+                    embed = discord.Embed(
+                        title="👢 Пользователь кикнут",
+                        description=f"{member.mention} ({member})",
+                        color=0xe67e22,
+                        timestamp=datetime.now()
+                    )
+                    embed.add_field(name="Модератор", value=entry.user.mention, inline=True)
+                    if entry.reason:
+                        embed.add_field(name="Причина", value=entry.reason, inline=False)
+                    await self.send_log(member.guild, embed)
             except:
                 pass
 
@@ -603,7 +715,13 @@ class Logs(commands.Cog):
                 embed.add_field(name="Из", value=before.channel.name, inline=True)
                 embed.add_field(name="В", value=after.channel.name, inline=True)
             
-            await self.send_log(member.guild, embed)
+            if not before.channel:
+                detail = f"{member.mention} → {after.channel.name}"
+            elif not after.channel:
+                detail = f"{member.mention} ← {before.channel.name}"
+            else:
+                detail = f"{member.mention}: {before.channel.name} → {after.channel.name}"
+            await self.send_log(member.guild, embed, group=('voice', None), detail=detail)
 
     # Логирование команд бота
     async def log_bot_command(self, ctx, command, target=None, amount=None, reason=None):
@@ -1,16 +1,77 @@
 import discord
 from discord.ext import commands
 import asyncio
+import time
 from datetime import datetime, timedelta
+from utils.expiry import ExpiryWorker, gather_limited
+
+# Сколько ролей мута снимать одновременно
+UNMUTE_CONCURRENCY = 5
+# Мут, который не удалось снять, повторяется через 60 с, 120 с... (не реже раза в час)
+UNMUTE_RETRY_DELAY = 60
+UNMUTE_RETRY_MAX_DELAY = 3600
+UNMUTE_MAX_ATTEMPTS = 10
 
 class Moderation(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        from utils.database import Database
-        self.db = Database()
+        from utils.database import get_database, get_async_database
+        self.db = get_database()
+        self.adb = get_async_database()
+        self.mute_expiry = ExpiryWorker('mutes', self.adb.get_next_mute_expiry, self.adb.get_due_mutes, self.expire_mutes)
+
+    async def cog_load(self):
+        self.mute_expiry.start(self.bot.wait_until_ready())
+
+    def cog_unload(self):
+        self.mute_expiry.stop()
+
+    def perf_stats(self):
+        return self.mute_expiry.stats()
+
+    async def expire_mutes(self, mutes):
+        """Снять истекшие муты; из базы удаляются только снятые, остальные повторяются позже"""
+        results = await gather_limited([self.expire_mute(*mute) for mute in mutes], UNMUTE_CONCURRENCY)
+        done = [mute for mute, result in zip(mutes, results) if result is True]
+        failed = [mute for mute, result in zip(mutes, results) if result is not True]
+        
+        if done:
+            await self.adb.delete_expired_mutes(done)
+        if failed:
+            given_up = await self.adb.retry_mutes(failed, time.time(), UNMUTE_RETRY_DELAY, UNMUTE_RETRY_MAX_DELAY, UNMUTE_MAX_ATTEMPTS)
+            print(f"⚠️ Не удалось снять мутов: {len(failed)}, повтор позже" + 
+                  (f"; после {UNMUTE_MAX_ATTEMPTS} попыток удалено: {given_up}" if given_up else ""))
+
+    async def expire_mute(self, guild_id, user_id, role_id, expires_at):
+        """Снять один мут. True - запись можно удалять, False - повторить позже"""
+        guild = self.bot.get_guild(guild_id)
+        if not guild or guild.unavailable:
+            # Сервер недоступен или еще не загружен
+            return False
+        
+        member = guild.get_member(user_id)
+        mute_role = guild.get_role(role_id)
+        if not member or not mute_role or mute_role not in member.roles:
+            return True
+        
+        try:
+            await member.remove_roles(mute_role, reason="Время мута истекло")
+        except Exception as e:
+            print(f"❌ Не удалось снять мут {user_id} на сервере {guild_id}: {e}")
+            return False
+        try:
+            unmute_embed = discord.Embed(
+                title="🔊 Мут снят",
+                description="Время мута истекло",
+                color=0x00ff00
+            )
+            await member.send(embed=unmute_embed)
+        except:
+            pass
+        return True
 
     async def get_log_channel(self, guild_id):
-        settings = self.db.get_server_settings(guild_id)
+        settings = await self.adb.get_server_settings(guild_id)
         if not settings[9]:
             return None
         
@@ -22,6 +83,12 @@ class Moderation(commands.Cog):
         return channel
 
     async def send_log(self, guild, embed):
+        # Логи идут через общую очередь кога Logs
+        logs = self.bot.get_cog('Logs')
+        if logs:
+            await logs.send_log(guild, embed)
+            return
+        
         channel = await self.get_log_channel(guild.id)
         if channel:
             try:
@@ -96,6 +163,11 @@ class Moderation(commands.Cog):
         try:
             await member.add_roles(mute_role, reason=reason)
             
+            # Снятие мута выполнит воркер истечения, даже после перезапуска бота
+            expires_at = (datetime.now() + delta).timestamp()
+            await self.adb.add_mute(ctx.guild.id, member.id, mute_role.id, expires_at)
+            self.mute_expiry.notify(expires_at)
+            
             embed = discord.Embed(title="🔇 Мут выдан", color=0xff0000)
             embed.add_field(name="👤 Пользователь", value=member.mention, inline=True)
             embed.add_field(name="⏰ Время", value=time_display, inline=True)
@@ -129,19 +201,6 @@ class Moderation(commands.Cog):
                 await member.send(embed=user_embed)
             except:
                 pass
-            
-            await asyncio.sleep(delta.total_seconds())
-            if mute_role in member.roles:
-                await member.remove_roles(mute_role)
-                try:
-                    unmute_embed = discord.Embed(
-                        title="🔊 Мут снят",
-                        description="Время мута истекло",
-                        color=0x00ff00
-                    )
-                    await member.send(embed=unmute_embed)
-                except:
-                    pass
                     
         except discord.Forbidden:
             embed = discord.Embed(
@@ -155,6 +214,7 @@ class Moderation(commands.Cog):
     @commands.has_permissions(manage_roles=True)
     async def unmute(self, ctx, member: discord.Member, *, reason="Не указана"):
         mute_role = discord.utils.get(ctx.guild.roles, name="Muted")
+        await self.adb.remove_mute(ctx.guild.id, member.id)
         if mute_role and mute_role in member.roles:
             try:
                 await member.remove_roles(mute_role, reason=reason)
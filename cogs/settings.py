@@ -1,11 +1,12 @@
 import discord
 from discord.ext import commands
-from utils.database import Database
+from utils.database import get_database, get_async_database
 
 class Settings(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db = Database()
+        self.db = get_database()
+        self.adb = get_async_database()
         self.valid_settings = {
             'work_min': 'work_reward_min',
             'work_max': 'work_reward_max', 
@@ -55,8 +56,7 @@ class Settings(commands.Cog):
             await ctx.send("❌ Неверный тип настройки! Используйте `!settings help` для списка команд")
     
     async def show_settings_help(self, ctx):
-        db = Database()
-        settings = db.get_server_settings(ctx.guild.id)
+        settings = await self.adb.get_server_settings(ctx.guild.id)
         prefix = settings[8] if settings else '!'
         
         embed = discord.Embed(title="📖 Помощь по настройкам", color=0x3498db)
@@ -150,7 +150,7 @@ class Settings(commands.Cog):
         await ctx.send(embed=embed)
     
     async def show_settings(self, ctx):
-        settings = self.db.get_server_settings(ctx.guild.id)
+        settings = await self.adb.get_server_settings(ctx.guild.id)
         
         embed = discord.Embed(title="⚙️ Текущие настройки", color=0x00ff00)
         
@@ -171,7 +171,7 @@ Work: {settings[1]}-{settings[2]} монет
 За голосовую активность: {settings[5]} XP/мин
 """, inline=False)
         
-        level_rewards = self.db.get_all_level_rewards(ctx.guild.id)
+        level_rewards = await self.adb.get_all_level_rewards(ctx.guild.id)
         if level_rewards:
             rewards_text = []
             for reward in level_rewards[:5]:
@@ -196,7 +196,7 @@ Work: {settings[1]}-{settings[2]} монет
                 inline=False
             )
         
-        ticket_groups = self.db.get_all_ticket_groups(ctx.guild.id)
+        ticket_groups = await self.adb.get_all_ticket_groups(ctx.guild.id)
         if ticket_groups:
             tickets_text = []
             for group in ticket_groups:
@@ -273,7 +273,7 @@ Work: {settings[1]}-{settings[2]} монет
                 return
         
         # Устанавливаем награду
-        self.db.set_level_reward(
+        await self.adb.set_level_reward(
             ctx.guild.id, 
             level, 
             reward_type, 
@@ -317,7 +317,7 @@ Work: {settings[1]}-{settings[2]} монет
             return
         
         # Устанавливаем группу тикетов
-        self.db.set_ticket_group(ctx.guild.id, group_type, role.id)
+        await self.adb.set_ticket_group(ctx.guild.id, group_type, role.id)
         
         embed = discord.Embed(
             title="✅ Настройки тикетов обновлены!",
@@ -362,12 +362,12 @@ Work: {settings[1]}-{settings[2]} монет
         if setting == 'logs':
             if value.lower() in ['on', 'вкл', '1', 'true', 'yes']:
                 db_setting = self.valid_settings[setting]
-                self.db.update_server_settings(ctx.guild.id, **{db_setting: 1})
+                await self.adb.update_server_settings(ctx.guild.id, **{db_setting: 1})
                 await ctx.send("✅ Логи включены")
                 return
             elif value.lower() in ['off', 'выкл', '0', 'false', 'no']:
                 db_setting = self.valid_settings[setting]
-                self.db.update_server_settings(ctx.guild.id, **{db_setting: 0})
+                await self.adb.update_server_settings(ctx.guild.id, **{db_setting: 0})
                 await ctx.send("✅ Логи выключены")
                 return
             else:
@@ -390,7 +390,7 @@ Work: {settings[1]}-{settings[2]} монет
                 return
             
             db_setting = self.valid_settings[setting]
-            self.db.update_server_settings(ctx.guild.id, **{db_setting: channel.id})
+            await self.adb.update_server_settings(ctx.guild.id, **{db_setting: channel.id})
             await ctx.send(f"✅ Канал для логов установлен: {channel.mention}")
             return
         
@@ -403,7 +403,7 @@ Work: {settings[1]}-{settings[2]} монет
                 return
             
             db_setting = self.valid_settings[setting]
-            self.db.update_server_settings(ctx.guild.id, **{db_setting: value})
+            await self.adb.update_server_settings(ctx.guild.id, **{db_setting: value})
             await ctx.send(f"✅ Префикс команд изменен на `{value}`\nТеперь используйте команды так: `{value}help`")
             return
         
@@ -414,7 +414,7 @@ Work: {settings[1]}-{settings[2]} монет
         int_value = int(value)
         db_setting = self.valid_settings[setting]
         
-        self.db.update_server_settings(ctx.guild.id, **{db_setting: int_value})
+        await self.adb.update_server_settings(ctx.guild.id, **{db_setting: int_value})
         await ctx.send(f"✅ Настройка '{setting}' изменена на {int_value}")
     
     async def handle_role_group(self, ctx, role_group, role_input):
@@ -431,7 +431,7 @@ Work: {settings[1]}-{settings[2]} монет
             await ctx.send("❌ Роль не найдена! Убедитесь, что вы правильно упомянули роль.")
             return
         
-        self.db.set_role_assignment(ctx.guild.id, role_group, role.id)
+        await self.adb.set_role_assignment(ctx.guild.id, role_group, role.id)
         await ctx.send(f"✅ Роль {role.mention} назначена группе '{role_group}'")
     
     async def handle_role_multiplier(self, ctx, multiplier_type, role_input, multiplier_str):
@@ -451,10 +451,10 @@ Work: {settings[1]}-{settings[2]} монет
             return
         
         if multiplier_type == 'economy' or multiplier_type == 'ec':
-            self.db.set_role_multiplier(role.id, multiplier, 1.0)
+            await self.adb.set_role_multiplier(role.id, multiplier, 1.0)
             await ctx.send(f"✅ Для роли {role.mention} установлен множитель экономики: x{multiplier}")
         elif multiplier_type == 'xp':
-            self.db.set_role_multiplier(role.id, 1.0, multiplier)
+            await self.adb.set_role_multiplier(role.id, 1.0, multiplier)
             await ctx.send(f"✅ Для роли {role.mention} установлен множитель опыта: x{multiplier}")
         else:
             await ctx.send("❌ Неверный тип множителя! Используйте 'economy' или 'xp'")
@@ -471,10 +471,10 @@ Work: {settings[1]}-{settings[2]} монет
             return
         
         if multiplier_type.lower() == 'economy':
-            self.db.set_role_multiplier(role.id, value, 1.0)
+            await self.adb.set_role_multiplier(role.id, value, 1.0)
             await ctx.send(f"✅ Для роли {role.mention} установлен множитель экономики: **x{value}**")
         else:
-            self.db.set_role_multiplier(role.id, 1.0, value)
+            await self.adb.set_role_multiplier(role.id, 1.0, value)
             await ctx.send(f"✅ Для роли {role.mention} установлен множитель опыта: **x{value}**")
 
 async def setup(bot):
@@ -1,37 +1,39 @@
 import discord
-from discord.ext import commands, tasks
-from datetime import datetime, timedelta
-import asyncio
+from discord.ext import commands
+from datetime import datetime
+import time
+from utils.expiry import ExpiryWorker, gather_limited
+
+# Сколько ролей за истекшие предметы снимать одновременно
+ROLE_REMOVAL_CONCURRENCY = 5
+# Роль, которую не удалось снять, снимается повторно через 60 с, 120 с... (не реже раза в час)
+ITEM_EXPIRY_RETRY_DELAY = 60
+ITEM_EXPIRY_RETRY_MAX_DELAY = 3600
+ITEM_EXPIRY_MAX_ATTEMPTS = 10
 
 class Shop(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        from utils.database import Database
-        self.db = Database()
-        self.check_expired_items.start()
+        from utils.database import get_database, get_async_database
+        self.db = get_database()
+        self.adb = get_async_database()
+        self.item_expiry = ExpiryWorker('items', self.adb.get_next_item_expiry, self.adb.get_due_items, self.expire_items)
+
+    async def cog_load(self):
+        self.item_expiry.start(self.bot.wait_until_ready())
 
     def cog_unload(self):
-        self.check_expired_items.cancel()
+        self.item_expiry.stop()
+
+    def perf_stats(self):
+        return self.item_expiry.stats()
 
     async def check_permissions(self, ctx):
-        cursor = self.db.conn.cursor()
-        
-        admin_roles = []
-        for group in ['admin', 'high_admin', 'owner']:
-            cursor.execute('SELECT role_id FROM role_assignments WHERE guild_id = ? AND role_group = ?', (ctx.guild.id, group))
-            roles = cursor.fetchall()
-            admin_roles.extend([role[0] for role in roles])
-        
-        user_roles = [role.id for role in ctx.author.roles]
-        has_permission = any(role_id in user_roles for role_id in admin_roles)
-        
-        if not has_permission:
-            has_permission = ctx.author.guild_permissions.manage_guild
-        
-        return has_permission
+        """Проверка прав через систему групп ролей (ctx - команда или взаимодействие)"""
+        return await self.adb.is_admin(ctx)
 
     async def get_log_channel(self, guild_id):
-        settings = self.db.get_server_settings(guild_id)
+        settings = await self.adb.get_server_settings(guild_id)
         if not settings[9]:
             return None
         
@@ -42,6 +44,11 @@ class Shop(commands.Cog):
         return self.bot.get_channel(channel_id)
 
     async def send_shop_log(self, guild, embed):
+        logs = self.bot.get_cog('Logs')
+        if logs:
+            await logs.send_log(guild, embed)
+            return
+        
         channel = await self.get_log_channel(guild.id)
         if channel:
             try:
@@ -49,51 +56,55 @@ class Shop(commands.Cog):
             except:
                 pass
 
-    @tasks.loop(minutes=5)
-    async def check_expired_items(self):
-        try:
-            expired_items = self.db.get_expired_items()
-            for item in expired_items:
-                user_id, guild_id, item_id, purchase_time, expires_at = item
-                
-                guild = self.bot.get_guild(guild_id)
-                if not guild:
-                    continue
-                    
-                user = guild.get_member(user_id)
-                if not user:
-                    continue
-                
-                item_info = self.db.get_shop_item(item_id)
-                if not item_info:
-                    continue
-                
-                if item_info[5] == 'role' and item_info[6]:
-                    role = guild.get_role(item_info[6])
-                    if role and role in user.roles:
-                        try:
-                            await user.remove_roles(role)
-                        except:
-                            pass
-                
-                self.db.remove_inventory_item(user_id, guild_id, item_id)
-                
+    async def expire_items(self, items):
+        """Снять роли за истекшие предметы; из базы удаляются только обработанные, остальные повторяются позже"""
+        results = await gather_limited([self.expire_item(*item) for item in items], ROLE_REMOVAL_CONCURRENCY)
+        done = [item for item, result in zip(items, results) if result is True]
+        failed = [item for item, result in zip(items, results) if result is not True]
+        
+        if done:
+            await self.adb.delete_expired_items(done)
+        if failed:
+            given_up = await self.adb.retry_expired_items(failed, time.time(), ITEM_EXPIRY_RETRY_DELAY, 
+                                                          ITEM_EXPIRY_RETRY_MAX_DELAY, ITEM_EXPIRY_MAX_ATTEMPTS)
+            print(f"⚠️ Не удалось снять роли за предметы: {len(failed)}, повтор позже" + 
+                  (f"; после {ITEM_EXPIRY_MAX_ATTEMPTS} попыток удалено: {given_up}" if given_up else ""))
+
+    async def expire_item(self, user_id, guild_id, item_id, name, item_type, role_id, expires_at):
+        """Обработать один истекший предмет. True - запись можно удалять, False - повторить позже"""
+        guild = self.bot.get_guild(guild_id)
+        if not guild or guild.unavailable:
+            # Сервер недоступен или еще не загружен
+            return False
+            
+        user = guild.get_member(user_id)
+        if not user:
+            return True
+        
+        if item_type == 'role' and role_id:
+            role = guild.get_role(role_id)
+            if role and role in user.roles:
                 try:
-                    embed = discord.Embed(
-                        title="⏰ Срок действия предмета истек",
-                        description=f"Предмет **{item_info[2]}** был удален из вашего инвентаря",
-                        color=0xffa500
-                    )
-                    await user.send(embed=embed)
-                except:
-                    pass
-                    
-        except Exception as e:
-            print(f"❌ Ошибка проверки просроченных предметов: {e}")
+                    await user.remove_roles(role, reason="Срок действия предмета истек")
+                except Exception as e:
+                    print(f"❌ Не удалось снять роль предмета {item_id} у {user_id} на сервере {guild_id}: {e}")
+                    return False
+        
+        if name:
+            try:
+                embed = discord.Embed(
+                    title="⏰ Срок действия предмета истек",
+                    description=f"Предмет **{name}** был удален из вашего инвентаря",
+                    color=0xffa500
+                )
+                await user.send(embed=embed)
+            except:
+                pass
+        return True
 
     @commands.command(name='shop')
     async def shop(self, ctx, page: int = 1):
-        items = self.db.get_shop_items(ctx.guild.id)
+        items = await self.adb.get_shop_items(ctx.guild.id)
         
         if not items:
             embed = discord.Embed(
@@ -151,20 +162,23 @@ class Shop(commands.Cog):
 
     @commands.command(name='buy')
     async def buy(self, ctx, item_id: int):
-        items = self.db.get_shop_items(ctx.guild.id)
+        items = await self.adb.get_shop_items(ctx.guild.id)
         
         if not items:
             await ctx.send("❌ В магазине нет предметов!")
             return
         
-        item = self.db.get_shop_item(item_id)
+        item = await self.adb.get_shop_item(item_id)
         if not item:
             await ctx.send("❌ Предмет с таким ID не найден!")
             return
         
-        success, message = self.db.purchase_item(ctx.author.id, ctx.guild.id, item_id)
+        success, message = await self.adb.purchase_item(ctx.author.id, ctx.guild.id, item_id)
         
         if success:
+            if item[7] > 0:
+                self.item_expiry.notify(int(datetime.now().timestamp()) + item[7])
+            
             embed = discord.Embed(
                 title="✅ Покупка успешна!",
                 description=f"Вы купили **{item[2]}** за {item[4]} монет",
@@ -209,7 +223,7 @@ class Shop(commands.Cog):
     @commands.command(name='inventory', aliases=['inv'])
     async def inventory(self, ctx, member: discord.Member = None):
         member = member or ctx.author
-        inventory = self.db.get_user_inventory(member.id, ctx.guild.id)
+        inventory = await self.adb.get_user_inventory(member.id, ctx.guild.id)
         
         if not inventory:
             embed = discord.Embed(
@@ -276,7 +290,7 @@ class Shop(commands.Cog):
             await ctx.send("❌ Лимит покупок не может быть меньше -1!")
             return
         
-        item_id = self.db.add_shop_item(ctx.guild.id, name, description, price, item_type.lower(), max_purchases=max_purchases)
+        item_id = await self.adb.add_shop_item(ctx.guild.id, name, description, price, item_type.lower(), max_purchases=max_purchases)
         
         embed = discord.Embed(
             title="✅ Предмет добавлен в магазин!",
@@ -433,7 +447,7 @@ class Shop(commands.Cog):
             await ctx.send("❌ Я не могу управлять эту роль! Роль находится выше моей в иерархии.")
             return
         
-        item_id = self.db.add_shop_item(
+        item_id = await self.adb.add_shop_item(
             ctx.guild.id, name, description, price, 'role', 
             role_id=role.id, duration=duration_seconds, max_purchases=max_purchases
         )
@@ -481,12 +495,12 @@ class Shop(commands.Cog):
             await ctx.send(embed=embed)
             return
         
-        item = self.db.get_shop_item(item_id)
+        item = await self.adb.get_shop_item(item_id)
         if not item:
             await ctx.send("❌ Предмет с таким ID не найден!")
             return
         
-        self.db.delete_shop_item(item_id)
+        await self.adb.delete_shop_item(item_id)
         
         embed = discord.Embed(
             title="✅ Предмет удален",
@@ -516,7 +530,7 @@ class Shop(commands.Cog):
             await ctx.send(embed=embed)
             return
         
-        inventory = self.db.get_user_inventory(member.id, ctx.guild.id)
+        inventory = await self.adb.get_user_inventory(member.id, ctx.guild.id)
         for item in inventory:
             if item[7] == 'role' and item[8]:
                 role = ctx.guild.get_role(item[8])
@@ -527,7 +541,7 @@ class Shop(commands.Cog):
                         pass
         
         for item in inventory:
-            self.db.remove_inventory_item(member.id, ctx.guild.id, item[2])
+            await self.adb.remove_inventory_item(member.id, ctx.guild.id, item[2])
         
         embed = discord.Embed(
             title="✅ Инвентарь очищен",
@@ -547,7 +561,7 @@ class Shop(commands.Cog):
 
     @commands.command(name='iteminfo')
     async def item_info(self, ctx, item_id: int):
-        item = self.db.get_shop_item(item_id)
+        item = await self.adb.get_shop_item(item_id)
         
         if not item:
             await ctx.send("❌ Предмет с таким ID не найден!")
@@ -583,7 +597,7 @@ class Shop(commands.Cog):
 
     @commands.group(name='market', invoke_without_command=True)
     async def market(self, ctx, page: int = 1):
-        listings = self.db.get_market_listings(ctx.guild.id)
+        listings = await self.adb.get_market_listings(ctx.guild.id)
         
         if not listings:
             embed = discord.Embed(
@@ -630,7 +644,7 @@ class Shop(commands.Cog):
 
     @market.command(name='sell')
     async def market_sell(self, ctx, item_id: int, price: int):
-        inventory = self.db.get_user_inventory(ctx.author.id, ctx.guild.id)
+        inventory = await self.adb.get_user_inventory(ctx.author.id, ctx.guild.id)
         
         item_in_inventory = any(item[2] == item_id for item in inventory)
         if not item_in_inventory:
@@ -641,12 +655,12 @@ class Shop(commands.Cog):
             await ctx.send("❌ Цена должна быть положительной!")
             return
         
-        item_info = self.db.get_shop_item(item_id)
+        item_info = await self.adb.get_shop_item(item_id)
         if not item_info:
             await ctx.send("❌ Предмет не найден в магазине!")
             return
         
-        listing_id = self.db.add_market_listing(ctx.author.id, ctx.guild.id, item_id, price)
+        listing_id = await self.adb.add_market_listing(ctx.author.id, ctx.guild.id, item_id, price)
         
         embed = discord.Embed(
             title="✅ Предмет выставлен на продажу!",
@@ -672,11 +686,13 @@ class Shop(commands.Cog):
 
     @market.command(name='buy')
     async def market_buy(self, ctx, listing_id: int):
-        success, message = self.db.purchase_market_item(ctx.author.id, ctx.guild.id, listing_id)
+        success, message = await self.adb.purchase_market_item(ctx.author.id, ctx.guild.id, listing_id)
         
         if success:
-            listing = self.db.get_market_listing(listing_id)
-            item_info = self.db.get_shop_item(listing[3])
+            listing = await self.adb.get_market_listing(listing_id)
+            item_info = await self.adb.get_shop_item(listing[3])
+            if item_info[7] > 0:
+                self.item_expiry.notify(int(datetime.now().timestamp()) + item_info[7])
             
             embed = discord.Embed(
                 title="✅ Покупка успешна!",
@@ -711,7 +727,7 @@ class Shop(commands.Cog):
 
     @market.command(name='my')
     async def market_my(self, ctx):
-        listings = self.db.get_user_market_listings(ctx.author.id, ctx.guild.id)
+        listings = await self.adb.get_user_market_listings(ctx.author.id, ctx.guild.id)
         
         if not listings:
             embed = discord.Embed(
@@ -746,7 +762,7 @@ class Shop(commands.Cog):
 
     @market.command(name='remove')
     async def market_remove(self, ctx, listing_id: int):
-        listing = self.db.get_market_listing(listing_id)
+        listing = await self.adb.get_market_listing(listing_id)
         
         if not listing:
             await ctx.send("❌ Предложение не найдено!")
@@ -756,7 +772,7 @@ class Shop(commands.Cog):
             await ctx.send("❌ Вы можете убирать только свои предложения!")
             return
         
-        self.db.remove_market_listing(listing_id)
+        await self.adb.remove_market_listing(listing_id)
         
         embed = discord.Embed(
             title="✅ Предложение убрано с площадки",
@@ -775,7 +791,7 @@ class Shop(commands.Cog):
 
     @commands.command(name='transactions', aliases=['trans'])
     async def transactions(self, ctx, limit: int = 10):
-        transactions = self.db.get_user_transactions(ctx.author.id, ctx.guild.id, limit)
+        transactions = await self.adb.get_user_transactions(ctx.author.id, ctx.guild.id, limit)
         
         if not transactions:
             embed = discord.Embed(
@@ -794,7 +810,7 @@ class Shop(commands.Cog):
         for trans in transactions:
             trans_id, from_user_id, to_user_id, guild_id, item_id, amount, trans_type, created_at = trans
             
-            item_info = self.db.get_shop_item(item_id)
+            item_info = await self.adb.get_shop_item(item_id)
             item_name = item_info[2] if item_info else "Неизвестный предмет"
             
             trans_info = f"**Тип:** {self.get_transaction_type_name(trans_type)}\n"
@@ -806,6 +822,11 @@ class Shop(commands.Cog):
                     trans_info += f"**Детали:** Вы продали {item_name}"
                 else:
                     trans_info += f"**Детали:** Вы купили {item_name}"
+            elif trans_type == 'transfer':
+                if from_user_id == ctx.author.id:
+                    trans_info += f"**Детали:** Перевод <@{to_user_id}>"
+                else:
+                    trans_info += f"**Детали:** Перевод от <@{from_user_id}>"
             else:
                 trans_info += f"**Предмет:** {item_name}"
             
@@ -1,32 +1,24 @@
 import discord
 from discord.ext import commands
-from utils.database import Database
+from utils.database import get_database, get_async_database
+from utils.transcripts import export_transcript, transcript_path, TRANSCRIPT_DIR
 import asyncio
+import os
 
 class Tickets(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db = Database()
+        self.db = get_database()
+        self.adb = get_async_database()
+        # TRANSCRIPT_DIR - каталог архива историй закрытых тикетов
+        self.transcript_dir = os.getenv('TRANSCRIPT_DIR', TRANSCRIPT_DIR)
 
     async def check_permissions(self, ctx):
-        cursor = self.db.conn.cursor()
-        
-        admin_roles = []
-        for group in ['admin', 'high_admin', 'owner']:
-            cursor.execute('SELECT role_id FROM role_assignments WHERE guild_id = ? AND role_group = ?', (ctx.guild.id, group))
-            roles = cursor.fetchall()
-            admin_roles.extend([role[0] for role in roles])
-        
-        user_roles = [role.id for role in ctx.author.roles]
-        has_permission = any(role_id in user_roles for role_id in admin_roles)
-        
-        if not has_permission:
-            has_permission = ctx.author.guild_permissions.manage_guild
-        
-        return has_permission
+        """Проверка прав через систему групп ролей (ctx - команда или взаимодействие)"""
+        return await self.adb.is_admin(ctx)
 
     async def get_log_channel(self, guild_id):
-        settings = self.db.get_server_settings(guild_id)
+        settings = await self.adb.get_server_settings(guild_id)
         if not settings[9]:
             return None
         
@@ -71,6 +63,50 @@ class Tickets(commands.Cog):
         
         return category
 
+    async def save_transcript(self, channel, guild_id):
+        """Выгрузить историю тикета в архив; при ошибке тикет все равно закрывается"""
+        path = transcript_path(self.transcript_dir, guild_id, channel.id)
+        try:
+            count, size, last_lines = await export_transcript(channel, path)
+            return count, size, last_lines, path
+        except Exception as e:
+            print(f"❌ Ошибка сохранения истории тикета {channel.id}: {e}")
+            return 0, 0, [], None
+
+    async def finish_ticket(self, channel, ticket, closed_by, delay=0):
+        """Сохранить историю, убрать тикет в архив, удалить канал и записать лог"""
+        channel_id, guild_id, user_id, ticket_type, created_at = ticket
+        guild = channel.guild
+        user = guild.get_member(user_id)
+        
+        # Выгрузка идет во время паузы перед закрытием
+        (count, size, last_lines, path), _ = await asyncio.gather(
+            self.save_transcript(channel, guild_id),
+            asyncio.sleep(delay)
+        )
+        
+        await self.adb.archive_ticket(channel_id, closed_by.id, count, size, path)
+        await channel.delete()
+        
+        log_embed = discord.Embed(
+            title="🎫 Тикет закрыт",
+            color=0xff0000,
+            timestamp=discord.utils.utcnow()
+        )
+        log_embed.add_field(name="👤 Пользователь", value=user.mention if user else "Неизвестный", inline=True)
+        log_embed.add_field(name="📋 Тип", value=ticket_type, inline=True)
+        log_embed.add_field(name="🔒 Закрыл", value=closed_by.mention, inline=True)
+        if path:
+            log_embed.add_field(name="🗂️ История", value=f"{count} сообщений, {size / 1024:.0f} КБ\n`{path}`", inline=False)
+        
+        log_content = "\n".join(last_lines)
+        if len(log_content) > 0:
+            if len(log_content) > 1000:
+                log_content = log_content[:1000] + "..."
+            log_embed.add_field(name="💬 Последние сообщения", value=f"```{log_content}```", inline=False)
+        
+        await self.send_ticket_log(guild, log_embed)
+
     @commands.group(name='ticket', invoke_without_command=True)
     async def ticket(self, ctx):
         """Система тикетов"""
@@ -95,7 +131,7 @@ class Tickets(commands.Cog):
             return
         
         # Проверяем есть ли уже активные тикеты у пользователя
-        user_tickets = self.db.get_user_tickets(ctx.author.id, ctx.guild.id)
+        user_tickets = await self.adb.get_user_tickets(ctx.author.id, ctx.guild.id)
         if user_tickets:
             embed = discord.Embed(
                 title="❌ У вас уже есть активный тикет!",
@@ -106,7 +142,7 @@ class Tickets(commands.Cog):
             return
         
         # Получаем роль для этого типа тикетов
-        support_role_id = self.db.get_ticket_group(ctx.guild.id, ticket_type)
+        support_role_id = await self.adb.get_ticket_group(ctx.guild.id, ticket_type)
         if not support_role_id:
             embed = discord.Embed(
                 title="❌ Система тикетов не настроена!",
@@ -147,7 +183,7 @@ class Tickets(commands.Cog):
         
         try:
             # Создаем уникальное имя канала
-            ticket_number = len(self.db.get_all_tickets(ctx.guild.id)) + 1
+            ticket_number = len(await self.adb.get_all_tickets(ctx.guild.id)) + 1
             channel_name = f"{ticket_type}-{ctx.author.name}-{ticket_number}"
             
             # Ограничиваем длину имени канала (максимум 100 символов)
@@ -169,7 +205,7 @@ class Tickets(commands.Cog):
             return
         
         # Сохраняем тикет в базу
-        self.db.create_ticket(ticket_channel.id, ctx.guild.id, ctx.author.id, ticket_type)
+        await self.adb.create_ticket(ticket_channel.id, ctx.guild.id, ctx.author.id, ticket_type)
         
         # Отправляем приветственное сообщение в тикет
         embed = discord.Embed(
@@ -190,7 +226,7 @@ class Tickets(commands.Cog):
             
             @discord.ui.button(label="Закрыть тикет", style=discord.ButtonStyle.danger, emoji="🔒")
             async def close_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-                ticket = self.cog.db.get_ticket(interaction.channel.id)
+                ticket = await self.cog.adb.get_ticket(interaction.channel.id)
                 if not ticket:
                     await interaction.response.send_message("❌ Этот канал не является тикетом!", ephemeral=True)
                     return
@@ -207,12 +243,7 @@ class Tickets(commands.Cog):
                 
                 # Закрываем тикет
                 await interaction.response.send_message("🔒 Закрытие тикета...")
-                
-                # Удаляем тикет из базы
-                self.cog.db.delete_ticket(interaction.channel.id)
-                
-                # Удаляем канал
-                await interaction.channel.delete()
+                await self.cog.finish_ticket(interaction.channel, ticket, interaction.user)
         
         view = CloseTicketView(self)
         
@@ -243,7 +274,7 @@ class Tickets(commands.Cog):
     async def close_ticket(self, ctx):
         """Закрыть тикет"""
         # Проверяем что команда вызвана в канале тикета
-        ticket = self.db.get_ticket(ctx.channel.id)
+        ticket = await self.adb.get_ticket(ctx.channel.id)
         if not ticket:
             embed = discord.Embed(
                 title="❌ Эта команда работает только в каналах тикетов!",
@@ -267,55 +298,20 @@ class Tickets(commands.Cog):
             await ctx.send(embed=embed)
             return
         
-        # Получаем информацию о тикете
-        user = ctx.guild.get_member(user_id)
-        username = user.display_name if user else "Неизвестный пользователь"
-        
-        # Создаем лог перед удалением
-        messages = []
-        async for message in ctx.channel.history(limit=100, oldest_first=True):
-            if message.content and not message.author.bot:
-                messages.append(f"{message.author.display_name}: {message.content}")
-        
-        log_content = "\n".join(messages[-20:])  # Последние 20 сообщений
-        
         # Отправляем подтверждение закрытия
         embed = discord.Embed(
             title="🔒 Закрытие тикета",
-            description="Тикет будет закрыт через 5 секунд...",
+            description="История сохраняется, тикет будет закрыт через 5 секунд...",
             color=0xffa500
         )
         await ctx.send(embed=embed)
         
-        await asyncio.sleep(5)
-        
-        # Удаляем тикет из базы
-        self.db.delete_ticket(ctx.channel.id)
-        
-        # Удаляем канал
-        await ctx.channel.delete()
-        
-        # Логирование закрытия тикета
-        log_embed = discord.Embed(
-            title="🎫 Тикет закрыт",
-            color=0xff0000,
-            timestamp=discord.utils.utcnow()
-        )
-        log_embed.add_field(name="👤 Пользователь", value=user.mention if user else "Неизвестный", inline=True)
-        log_embed.add_field(name="📋 Тип", value=ticket_type, inline=True)
-        log_embed.add_field(name="🔒 Закрыл", value=ctx.author.mention, inline=True)
-        
-        if len(log_content) > 0:
-            if len(log_content) > 1000:
-                log_content = log_content[:1000] + "..."
-            log_embed.add_field(name="💬 Последние сообщения", value=f"```{log_content}```", inline=False)
-        
-        await self.send_ticket_log(ctx.guild, log_embed)
+        await self.finish_ticket(ctx.channel, ticket, ctx.author, delay=5)
 
     @ticket.command(name='add')
     async def add_user(self, ctx, member: discord.Member):
         """Добавить пользователя в тикет"""
-        ticket = self.db.get_ticket(ctx.channel.id)
+        ticket = await self.adb.get_ticket(ctx.channel.id)
         if not ticket:
             embed = discord.Embed(
                 title="❌ Эта команда работает только в каналах тикетов!",
@@ -352,7 +348,7 @@ class Tickets(commands.Cog):
     @ticket.command(name='remove')
     async def remove_user(self, ctx, member: discord.Member):
         """Удалить пользователя из тикета"""
-        ticket = self.db.get_ticket(ctx.channel.id)
+        ticket = await self.adb.get_ticket(ctx.channel.id)
         if not ticket:
             embed = discord.Embed(
                 title="❌ Эта команда работает только в каналах тикетов!",
@@ -399,7 +395,7 @@ class Tickets(commands.Cog):
     @commands.has_permissions(administrator=True)
     async def list_tickets(self, ctx):
         """Список активных тикетов (админ)"""
-        tickets = self.db.get_all_tickets(ctx.guild.id)
+        tickets = await self.adb.get_all_tickets(ctx.guild.id)
         
         if not tickets:
             embed = discord.Embed(
@@ -431,11 +427,33 @@ class Tickets(commands.Cog):
         
         await ctx.send(embed=embed)
 
+    @ticket.command(name='transcripts')
+    @commands.has_permissions(administrator=True)
+    async def list_transcripts(self, ctx):
+        """Последние сохраненные истории тикетов (админ)"""
+        transcripts = await self.adb.get_ticket_transcripts(ctx.guild.id)
+        
+        embed = discord.Embed(
+            title="🗂️ Архив тикетов",
+            color=0x3498db
+        )
+        if not transcripts:
+            embed.description = "Закрытых тикетов с историей нет"
+        
+        for channel_id, guild_id, user_id, ticket_type, created_at, closed_at, closed_by, message_count, size_bytes, path in transcripts:
+            embed.add_field(
+                name=f"{ticket_type} - <t:{closed_at}:d>",
+                value=f"Автор: <@{user_id}>, закрыл: <@{closed_by}>\n{message_count} сообщений, {size_bytes / 1024:.0f} КБ\n`{path or 'не сохранена'}`",
+                inline=False
+            )
+        
+        await ctx.send(embed=embed)
+
     @ticket.command(name='cleanup')
     @commands.has_permissions(administrator=True)
     async def cleanup_tickets(self, ctx):
         """Очистка несуществующих тикетов из базы данных (админ)"""
-        tickets = self.db.get_all_tickets(ctx.guild.id)
+        tickets = await self.adb.get_all_tickets(ctx.guild.id)
         deleted_count = 0
         
         for ticket in tickets:
@@ -444,7 +462,7 @@ class Tickets(commands.Cog):
             channel = ctx.guild.get_channel(channel_id)
             if not channel:
                 # Канал не существует, удаляем из базы
-                self.db.delete_ticket(channel_id)
+                await self.adb.delete_ticket(channel_id)
                 deleted_count += 1
         
         embed = discord.Embed(
@@ -460,9 +478,9 @@ class Tickets(commands.Cog):
         if not isinstance(channel, discord.TextChannel):
             return
         
-        ticket = self.db.get_ticket(channel.id)
+        ticket = await self.adb.get_ticket(channel.id)
         if ticket:
-            self.db.delete_ticket(channel.id)
+            await self.adb.delete_ticket(channel.id)
 
 async def setup(bot):
     await bot.add_cog(Tickets(bot))
\ No newline at end of file
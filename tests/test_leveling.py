@@ -0,0 +1,31 @@
+import math
+
+from utils.leveling import (
+    RewardTable, calculate_level, calculate_levels, level_progress, summarize_rewards, xp_for_level
+)
+
+def old_level(xp):
+    return int((xp / 50) ** 0.5) + 1
+
+def test_level_curve_matches_old_formula():
+    for xp in range(0, 200_000):
+        assert calculate_level(xp) == old_level(xp), xp
+    for level in range(1, 20_000):
+        for xp in (xp_for_level(level) - 1, xp_for_level(level), xp_for_level(level) + 1):
+            if xp >= 0:
+                assert calculate_level(xp) == old_level(xp), xp
+
+def test_level_curve_edges():
+    assert calculate_level(10 ** 30) == math.isqrt(10 ** 30 // 50) + 1
+    assert all(calculate_level(xp_for_level(level)) == level for level in range(1, 100_000))
+    edge = [0, 49, 50, 199, 200, xp_for_level(10_000) - 1, xp_for_level(10_000), 10 ** 12, 10 ** 30]
+    assert calculate_levels(edge) == [calculate_level(xp) for xp in edge]
+    assert level_progress(260) == (3, 60, 250)
+
+def test_reward_table():
+    table = RewardTable([(1, 10, 'role', 5, 0), (1, 5, 'currency', None, 100), (1, 20, 'both', 6, 50)])
+    assert table.get(10)[1] == 10 and table.get(11) is None
+    assert [row[1] for row in table.up_to(15)] == [5, 10]
+    # Прыжок с 4 на 25 уровень проходит все три награды, с 5 на 9 - ни одной
+    assert summarize_rewards(table.between(4, 25)) == (150, [5, 6])
+    assert table.between(5, 9) == []
\ No newline at end of file
@@ -0,0 +1,49 @@
+import asyncio
+
+from utils.message_store import MessageStore, RECORD_SIZE
+
+def test_eviction_spill_edit_retention_and_guild_drop(tmp_path):
+    now = [1000.0]
+    store = MessageStore(max_bytes=RECORD_SIZE * 10, retention=100, spill_path=str(tmp_path / 'messages.db'), clock=lambda: now[0])
+
+    for message_id in range(30):
+        store.add(message_id, 1, 5, 7, 'x')
+    assert store.stats()['message_store_messages'] < 30
+    assert store.evicted and len(store._pending) == store.evicted
+
+    async def run():
+        await store.maintain()
+        assert not store._pending
+        # Вытесненное сообщение находится в файле
+        record = await store.pop(1, 0)
+        assert record and record.content == 'x' and store.spill_hits == 1
+        assert await store.pop(1, 0) is None
+
+        store.add(29, 1, 5, 7, 'изменено', (await store.lookup(1, 29)).created_at)
+        assert (await store.lookup(1, 29)).content == 'изменено'
+
+        # После срока хранения сообщения не отдаются и удаляются
+        now[0] += 200
+        assert await store.lookup(1, 29) is None
+        await store.maintain()
+        assert store.stats()['message_store_messages'] == 0
+        assert await store.lookup(1, 1) is None
+
+        # Уход с сервера: память, очередь на запись и файл
+        for message_id in range(100, 130):
+            store.add(message_id, 2, 5, 7, 'y')
+        store.add(200, 3, 5, 7, 'z')
+        await store.maintain()
+        store.add(130, 2, 5, 7, 'y')
+        store.add(131, 2, 5, 7, 'y')
+        assert store._pending
+        store.drop_guild(2)
+        assert not store._pending and await store.lookup(2, 100) is None
+        await store.maintain()
+        assert store._spill.execute('SELECT COUNT(*) FROM messages WHERE guild_id = 2').fetchone()[0] == 0
+        assert (await store.lookup(3, 200)).content == 'z'
+
+    try:
+        asyncio.run(run())
+    finally:
+        store.close()
\ No newline at end of file
@@ -0,0 +1,21 @@
+import sqlite3
+
+from utils import migrations
+
+def migrated():
+    conn = sqlite3.connect(':memory:')
+    migrations.migrate(conn)
+    return conn
+
+def test_hot_queries_use_indexes():
+    assert migrations.check_query_plans(migrated()) == []
+
+def test_migrations_reach_latest_version_once():
+    conn = migrated()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == migrations.MIGRATIONS[-1][0]
+    assert migrations.migrate(conn) == []
+
+def test_full_scan_is_reported():
+    conn = migrated()
+    conn.execute('DROP INDEX idx_ticket_transcripts_guild')
+    assert [name for name, detail in migrations.check_query_plans(conn)] == ['get_ticket_transcripts', 'purge_ticket_transcripts']
\ No newline at end of file
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from utils.database import Database, AsyncDatabase
+from utils.scheduler import Scheduler, SCHEDULER_RETRY_DELAY
+
+class FakeClock:
+    """Ручные часы для проверки планировщика"""
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def adb(tmp_path):
+    adb = AsyncDatabase(Database(str(tmp_path / 'scheduler.db')))
+    yield adb
+    adb.executor.shutdown()
+    adb.db.pool.close()
+
+def test_jobs_fire_on_time(adb):
+    async def run():
+        clock = FakeClock(1000)
+        scheduler = Scheduler(adb, clock)
+        fired = []
+        
+        async def handler(payload):
+            fired.append((payload['id'], clock()))
+        
+        scheduler.register('test', handler)
+        await scheduler.schedule('a', 'test', 1010, {'id': 'a'})
+        await scheduler.schedule('b', 'test', 1005, {'id': 'b'})
+        await scheduler.schedule('c', 'test', 1020, {'id': 'c'})
+        await scheduler.cancel('c')
+        await scheduler.schedule('a', 'test', 1030, {'id': 'a'})  # перенос
+        
+        assert await scheduler.run_due() == 0
+        clock.now = 1005
+        await scheduler.run_due()
+        assert fired == [('b', 1005)]
+        # Отмененная и перенесенная задачи не срабатывают
+        clock.now = 1025
+        await scheduler.run_due()
+        assert fired == [('b', 1005)]
+        assert scheduler.next_due() == 1030
+    
+    asyncio.run(run())
+
+def test_jobs_survive_restart(adb):
+    async def run():
+        clock = FakeClock(1000)
+        fired = []
+        
+        async def handler(payload):
+            fired.append((payload['id'], clock()))
+        
+        scheduler = Scheduler(adb, clock)
+        scheduler.register('test', handler)
+        await scheduler.schedule('a', 'test', 1030, {'id': 'a'})
+        
+        # Новый планировщик поднимает задачи из базы, просроченная срабатывает сразу
+        restarted = Scheduler(adb, clock)
+        restarted.register('test', handler)
+        await restarted.start()
+        await restarted.stop()
+        assert list(restarted._jobs) == ['a']
+        clock.now = 1100
+        await restarted.run_due()
+        assert fired == [('a', 1100)]
+        assert await adb.get_scheduled_jobs() == []
+    
+    asyncio.run(run())
+
+def test_failed_job_is_kept_and_retried_with_backoff(adb):
+    async def run():
+        clock = FakeClock(1100)
+        scheduler = Scheduler(adb, clock)
+        fired = []
+        failures = [2]
+        
+        async def flaky(payload):
+            if failures[0]:
+                failures[0] -= 1
+                raise RuntimeError('сервер недоступен')
+            fired.append((payload['id'], clock()))
+        
+        scheduler.register('flaky', flaky)
+        await scheduler.schedule('f', 'flaky', 1100, {'id': 'f'}, guild_id=7)
+        await scheduler.run_due()
+        saved = await adb.get_scheduled_jobs()
+        assert [job[:3] for job in saved] == [('f', 'flaky', 1100 + SCHEDULER_RETRY_DELAY)]
+        
+        clock.now = 1100 + SCHEDULER_RETRY_DELAY
+        await scheduler.run_due()
+        assert scheduler.next_due() == clock.now + 2 * SCHEDULER_RETRY_DELAY
+        
+        clock.now = scheduler.next_due()
+        await scheduler.run_due()
+        assert fired == [('f', clock.now)]
+        assert await adb.get_scheduled_jobs() == []
+    
+    asyncio.run(run())
\ No newline at end of file
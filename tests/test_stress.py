@@ -0,0 +1,138 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.database import Database, AsyncDatabase
+from utils.leveling import calculate_level
+
+# Нагрузочные проверки базы на временном файле
+GUILD_ID = 1
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'stress.db'))
+    yield db
+    db.pool.close()
+
+def seed_users(db, users, balance):
+    with db.transaction() as cursor:
+        cursor.executemany('INSERT INTO users (user_id, guild_id, balance) VALUES (?, ?, ?)', 
+                          [(user_id, GUILD_ID, balance) for user_id in range(users)])
+
+def balances(db):
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT user_id, balance FROM users WHERE guild_id = ?', (GUILD_ID,))
+    return dict(cursor.fetchall())
+
+def test_concurrent_transfers(db, users=50, balance=100, transfers=5000, threads=8):
+    """Тысячи одновременных переводов: через групповую фиксацию и напрямую из потоков"""
+    adb = AsyncDatabase(db, workers=2)
+    seed_users(db, users, balance)
+    
+    def random_transfer():
+        from_user_id, to_user_id = random.sample(range(users), 2)
+        return from_user_id, to_user_id, GUILD_ID, random.randint(1, balance)
+    
+    async def grouped():
+        return await asyncio.gather(*(adb.transfer(*random_transfer()) for _ in range(transfers)))
+    
+    results = asyncio.run(grouped())
+    assert db.transfer_batches < transfers
+    
+    # Те же переводы без группировки: каждый поток берет свое соединение
+    def worker(count):
+        done = []
+        for _ in range(count):
+            done.append(db.transfer(*random_transfer()))
+        db.pool.release()
+        return done
+    
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for done in executor.map(worker, [transfers // threads] * threads):
+            results.extend(done)
+    adb.executor.shutdown()
+    
+    current = balances(db)
+    cursor = db.conn.cursor()
+    cursor.execute("SELECT from_user_id, to_user_id, amount FROM transactions WHERE transaction_type = 'transfer'")
+    ledger = cursor.fetchall()
+    replayed = {user_id: balance for user_id in range(users)}
+    for from_user_id, to_user_id, amount in ledger:
+        replayed[from_user_id] -= amount
+        replayed[to_user_id] += amount
+    
+    assert sum(current.values()) == users * balance
+    assert min(current.values()) >= 0
+    assert len(ledger) == results.count(True)
+    assert replayed == current
+    # Часть переводов отклонена из-за баланса
+    assert results.count(False) > 0
+
+def test_flash_sale_purchases(db, buyers=200, threads=16, limit=3):
+    """Распродажа: много покупателей на одно предложение и на товар с лимитом"""
+    seed_users(db, buyers + 1, 1000)
+    seller_id = buyers
+    item_id = db.add_shop_item(GUILD_ID, 'Флеш', 'Товар распродажи', 100, 'other', max_purchases=limit)
+    listing_id = db.add_market_listing(seller_id, GUILD_ID, item_id, 500)
+    
+    def buy_listing(buyer_id):
+        try:
+            return db.purchase_market_item(buyer_id, GUILD_ID, listing_id)
+        finally:
+            db.pool.release()
+    
+    def buy_item(buyer_id):
+        try:
+            # Каждый пытается купить больше лимита
+            return [db.purchase_item(buyer_id, GUILD_ID, item_id) for _ in range(limit + 2)]
+        finally:
+            db.pool.release()
+    
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        listing_results = list(executor.map(buy_listing, range(buyers)))
+        item_results = [result for results in executor.map(buy_item, range(buyers)) for result in results]
+    
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT MAX(purchase_count), SUM(purchase_count) FROM item_purchases WHERE item_id = ?', (item_id,))
+    max_count, total_count = cursor.fetchone()
+    cursor.execute('SELECT status FROM marketplace WHERE listing_id = ?', (listing_id,))
+    status = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM transactions WHERE transaction_type = 'shop_purchase'")
+    shop_rows = cursor.fetchone()[0]
+    item_successes = sum(1 for success, message in item_results if success)
+    
+    assert sum(1 for success, message in listing_results if success) == 1
+    assert status == 'sold'
+    assert max_count == limit and total_count == buyers * limit == item_successes
+    assert shop_rows == item_successes
+    assert sum(balances(db).values()) == (buyers + 1) * 1000 - item_successes * 100
+
+def test_recompute_levels(db, users=200_000, drifted=0.1):
+    """Пересчет уровней большого сервера, часть уровней устарела"""
+    rows = []
+    expected_changes = 0
+    for user_id in range(users):
+        xp = random.randrange(0, 5_000_000)
+        level = calculate_level(xp)
+        if random.random() < drifted:
+            level += 1 if level == 1 else random.choice((-1, 1))
+            expected_changes += 1
+        rows.append((user_id, GUILD_ID, xp, level))
+    with db.transaction() as cursor:
+        cursor.executemany('INSERT INTO users (user_id, guild_id, xp, level) VALUES (?, ?, ?, ?)', rows)
+        # Участники другого сервера не должны затрагиваться
+        cursor.executemany('INSERT INTO users (user_id, guild_id, xp, level) VALUES (?, ?, ?, ?)', 
+                          [(user_id, GUILD_ID + 1, 0, 99) for user_id in range(1000)])
+    
+    scanned, changed, elapsed = db.recompute_levels(GUILD_ID)
+    assert scanned == users
+    assert changed == expected_changes
+    
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT xp, level FROM users WHERE guild_id = ?', (GUILD_ID,))
+    assert all(level == calculate_level(xp) for xp, level in cursor)
+    cursor.execute('SELECT COUNT(*) FROM users WHERE guild_id = ? AND level = 99', (GUILD_ID + 1,))
+    assert cursor.fetchone()[0] == 1000
+    assert db.recompute_levels(GUILD_ID)[1] == 0
\ No newline at end of file
@@ -0,0 +1,45 @@
+import asyncio
+import tracemalloc
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from utils.transcripts import export_transcript, read_transcript, transcript_path, TRANSCRIPT_TAIL
+
+author = SimpleNamespace(id=1, display_name='Пользователь', bot=False)
+
+class FakeChannel:
+    def __init__(self, messages):
+        self.messages = messages
+        self.created = datetime.now(timezone.utc)
+
+    async def history(self, limit=None, oldest_first=True):
+        for message_id in range(self.messages):
+            yield SimpleNamespace(
+                id=message_id, author=author, created_at=self.created, edited_at=None,
+                content=f'сообщение номер {message_id} ' * 5,
+                attachments=[SimpleNamespace(url=f'https://cdn.example/{message_id}.png')] if message_id % 10 == 0 else [],
+                embeds=[]
+            )
+
+def export(tmp_path, messages):
+    path = transcript_path(str(tmp_path / str(messages)), 1, 2)
+    tracemalloc.start()
+    try:
+        result = asyncio.run(export_transcript(FakeChannel(messages), path))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return path, result, peak
+
+def test_export_writes_every_message_and_keeps_tail(tmp_path, messages=10_000):
+    path, (count, size, last_lines), peak = export(tmp_path, messages)
+    assert count == messages and size > 0
+    assert len(last_lines) == TRANSCRIPT_TAIL
+    assert last_lines[-1].startswith(f'Пользователь: сообщение номер {messages - 1}')
+    assert sum(1 for _ in read_transcript(path)) == messages
+
+def test_export_memory_does_not_grow_with_history(tmp_path):
+    # История пишется в файл пачками, пик памяти не зависит от длины тикета
+    small_peak = export(tmp_path, 5_000)[2]
+    large_peak = export(tmp_path, 40_000)[2]
+    assert large_peak < small_peak * 2
\ No newline at end of file
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+# Сколько секунд загруженный журнал аудита считается свежим
+AUDIT_TTL = 5.0
+# Сколько последних записей журнала загружать за один запрос
+AUDIT_FETCH_LIMIT = 50
+
+class AuditLogCache:
+    """Кэш журнала аудита по серверам.
+
+    Журнал сервера загружается одним запросом и AUDIT_TTL секунд отвечает
+    на вопрос "кто сделал действие X с объектом Y" из памяти. Одновременные
+    запросы к одному серверу ждут одну общую загрузку.
+    """
+    def __init__(self, ttl=AUDIT_TTL, limit=AUDIT_FETCH_LIMIT, clock=time.monotonic):
+        self.ttl = ttl
+        self.limit = limit
+        self.clock = clock
+        self._entries = {}   # guild_id -> (fetched_at, [entry])
+        self._inflight = {}  # guild_id -> task загрузки
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.hits = 0
+        self.shared = 0
+        self.refetches = 0
+
+    def _fetch(self, guild):
+        """Общая загрузка журнала; повторный вызов во время загрузки ждет ту же задачу"""
+        task = self._inflight.get(guild.id)
+        if task is not None:
+            self.shared += 1
+            return task
+        task = self._inflight[guild.id] = asyncio.create_task(self._load(guild))
+        return task
+
+    async def _load(self, guild):
+        # Время начала: все записи, созданные до него, попадут в ответ
+        started = self.clock()
+        try:
+            entries = [entry async for entry in guild.audit_logs(limit=self.limit)]
+            self.fetches += 1
+            self._entries[guild.id] = (started, entries)
+            return started, entries
+        except Exception:
+            self.fetch_errors += 1
+            raise
+        finally:
+            self._inflight.pop(guild.id, None)
+
+    async def _get(self, guild):
+        cached = self._entries.get(guild.id)
+        if cached and self.clock() - cached[0] < self.ttl:
+            self.hits += 1
+            return cached
+        # shield: отмена одного слушателя не отменяет загрузку для остальных
+        return await asyncio.shield(self._fetch(guild))
+
+    @staticmethod
+    def _match(entries, action, target_id):
+        for entry in entries:
+            if entry.action == action and entry.target and entry.target.id == target_id:
+                return entry
+        return None
+
+    async def find(self, guild, action, target_id):
+        """Последняя запись журнала о действии action над target_id или None"""
+        requested_at = self.clock()
+        fetched_at, entries = await self._get(guild)
+        entry = self._match(entries, action, target_id)
+
+        # Журнал загружен до события - запись могла еще не попасть в него
+        if entry is None and fetched_at < requested_at:
+            self.refetches += 1
+            fetched_at, entries = await asyncio.shield(self._fetch(guild))
+            entry = self._match(entries, action, target_id)
+        return entry
+
+    def drop(self, guild_id):
+        self._entries.pop(guild_id, None)
+
+    def stats(self):
+        return {
+            'audit_fetches': self.fetches,
+            'audit_fetch_errors': self.fetch_errors,
+            'audit_cache_hits': self.hits,
+            'audit_shared_waits': self.shared,
+            'audit_refetches': self.refetches,
+            'audit_cached_guilds': len(self._entries)
+        }
\ No newline at end of file
@@ -1,205 +1,262 @@
 import sqlite3
-import json
+import threading
+import asyncio
+import traceback
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
+import time
 
-class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect('economy.db')
-        self.create_tables()
-    
-    def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        # Основная таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER,
-                guild_id INTEGER,
-                balance INTEGER DEFAULT 0,
-                xp INTEGER DEFAULT 0,
-                level INTEGER DEFAULT 1,
-                warnings INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, guild_id)
-            )
-        ''')
+from utils import migrations
+from utils import queries
+from utils.queries import GUILD_TABLES
+from utils.ranking import Rankings
+from utils.prefixes import PrefixResolver
+from utils.permissions import PermissionResolver, actor
+from utils.leveling import RewardTables, calculate_levels
+
+DB_PATH = 'economy.db'
+DEFAULT_POOL_SIZE = 4
+DEFAULT_DB_WORKERS = 2
+# Сколько секунд ждать свободное соединение, прежде чем сообщить об ошибке
+POOL_TIMEOUT = 30
+# Сколько разных наборов ролей помнить в кэше множителей
+MULTIPLIER_MEMO_SIZE = 4096
+# Сколько переводов записывать одной транзакцией при групповой фиксации
+TRANSFER_BATCH_SIZE = 256
+# Очистка сервера: сколько строк удалять за транзакцию и пауза между пачками
+PURGE_CHUNK_SIZE = 2000
+PURGE_PAUSE = 0.05
+PURGE_REPORT_EVERY = 20
+# Сколько участников читать за раз при пересчете уровней
+RECOMPUTE_CHUNK_SIZE = 5000
+
+# Профили хранения: настройки SQLite, которые применяются к каждому соединению.
+# durable - как раньше (rollback-журнал, fsync на каждый commit),
+# balanced - WAL, читатели не ждут писателей, fsync только на checkpoint,
+# throughput - WAL без fsync: быстрее всего, но при сбое ОС теряются последние транзакции
+STORAGE_PROFILES = {
+    'durable': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000
+    },
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000
+    },
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000
+    }
+}
+DEFAULT_STORAGE_PROFILE = 'balanced'
+
+# Строка server_settings; поддерживает и индексы (settings[8]), и имена полей
+ServerSettings = namedtuple('ServerSettings', [
+    'guild_id', 'work_reward_min', 'work_reward_max', 'work_cooldown', 'xp_per_message',
+    'xp_per_voice_minute', 'slot_min_bet', 'slot_max_bet', 'prefix', 'logs_enabled', 'log_channel_id'
+])
+
+class PurchaseDeclined(Exception):
+    """Покупка отклонена - транзакция откатывается, текст показывается пользователю"""
+
+class PoolExhausted(Exception):
+    """Свободное соединение не появилось за POOL_TIMEOUT секунд"""
+
+class ConnectionPool:
+    """Общий пул соединений SQLite.
+
+    Каждый поток получает свое соединение из пула и держит его, пока не вернет
+    через release(). Повторные обращения из того же потока считаются попаданиями.
+    Потоки AsyncDatabase возвращают соединение после каждого вызова, постоянно
+    держит свое только поток event loop.
+    """
+    def __init__(self, path=DB_PATH, size=DEFAULT_POOL_SIZE, profile=DEFAULT_STORAGE_PROFILE, timeout=POOL_TIMEOUT):
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Неизвестный профиль хранения: {profile} (доступны: {', '.join(STORAGE_PROFILES)})")
         
-        # Множители ролей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS role_multipliers (
-                role_id INTEGER PRIMARY KEY,
-                economy_multiplier REAL DEFAULT 1.0,
-                xp_multiplier REAL DEFAULT 1.0
-            )
-        ''')
+        self.path = path
+        self.size = max(1, size)
+        self.profile = profile
+        self.timeout = timeout
+        self._local = threading.local()
+        self._idle = []
+        self._opened = 0
+        self._cond = threading.Condition()
+        self.pool_hits = 0
+        self.connections_opened = 0
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma, value in STORAGE_PROFILES[self.profile].items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        self.connections_opened += 1
+        return conn
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self.pool_hits += 1
+            return conn
         
-        # Настройки серверов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS server_settings (
-                guild_id INTEGER PRIMARY KEY,
-                work_reward_min INTEGER DEFAULT 10,
-                work_reward_max INTEGER DEFAULT 50,
-                work_cooldown INTEGER DEFAULT 3600,
-                xp_per_message INTEGER DEFAULT 5,
-                xp_per_voice_minute INTEGER DEFAULT 2,
-                slot_min_bet INTEGER DEFAULT 1,
-                slot_max_bet INTEGER DEFAULT 1000,
-                prefix TEXT DEFAULT '!',
-                logs_enabled BOOLEAN DEFAULT 0,
-                log_channel_id INTEGER DEFAULT NULL
-            )
-        ''')
+        with self._cond:
+            deadline = time.monotonic() + self.timeout
+            while not self._idle and self._opened >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if self._idle or self._opened < self.size:
+                        break
+                    raise PoolExhausted(f"Нет свободного соединения с базой за {self.timeout} с (размер пула {self.size})")
+            
+            if self._idle:
+                conn = self._idle.pop()
+                self.pool_hits += 1
+            else:
+                conn = self._open()
+                self._opened += 1
         
-        # Кулдауны
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cooldowns (
-                user_id INTEGER,
-                guild_id INTEGER,
-                command TEXT,
-                last_used INTEGER,
-                PRIMARY KEY (user_id, guild_id, command)
-            )
-        ''')
-
-        # Права команд
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS command_permissions (
-                guild_id INTEGER,
-                role_group TEXT,
-                command_name TEXT,
-                PRIMARY KEY (guild_id, role_group, command_name)
-            )
-        ''')
-
-        # Назначения ролей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS role_assignments (
-                guild_id INTEGER,
-                role_group TEXT,
-                role_id INTEGER,
-                PRIMARY KEY (guild_id, role_group, role_id)
-            )
-        ''')
-
-        # Розыгрыши
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS giveaways (
-                message_id INTEGER PRIMARY KEY,
-                guild_id INTEGER,
-                channel_id INTEGER,
-                prize TEXT,
-                winners_count INTEGER,
-                end_time INTEGER,
-                ended BOOLEAN DEFAULT 0
-            )
-        ''')
+        self._local.conn = conn
+        return conn
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS giveaway_entries (
-                message_id INTEGER,
-                user_id INTEGER,
-                PRIMARY KEY (message_id, user_id)
-            )
-        ''')
-
-        # Магазин
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS shop_items (
-                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER,
-                name TEXT,
-                description TEXT,
-                price INTEGER,
-                item_type TEXT,
-                role_id INTEGER DEFAULT NULL,
-                duration INTEGER DEFAULT 0,
-                max_purchases INTEGER DEFAULT -1,
-                created_at INTEGER
-            )
-        ''')
+    def release(self):
+        """Вернуть соединение текущего потока в пул"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_inventory (
-                user_id INTEGER,
-                guild_id INTEGER,
-                item_id INTEGER,
-                purchase_time INTEGER,
-                expires_at INTEGER DEFAULT NULL,
-                PRIMARY KEY (user_id, guild_id, item_id)
-            )
-        ''')
+    def close(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._opened -= len(self._idle)
+            self._idle.clear()
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS item_purchases (
-                user_id INTEGER,
-                guild_id INTEGER,
-                item_id INTEGER,
-                purchase_count INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, guild_id, item_id)
-            )
-        ''')
-
-        # Торговая площадка
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS marketplace (
-                listing_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                seller_id INTEGER,
-                guild_id INTEGER,
-                item_id INTEGER,
-                price INTEGER,
-                created_at INTEGER,
-                status TEXT DEFAULT 'active'
-            )
-        ''')
-
-        # Транзакции
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS transactions (
-                transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id INTEGER,
-                to_user_id INTEGER,
-                guild_id INTEGER,
-                item_id INTEGER,
-                amount INTEGER,
-                transaction_type TEXT,
-                created_at INTEGER
-            )
-        ''')
-
-        # Награды за уровни
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS level_rewards (
-                guild_id INTEGER,
-                level INTEGER,
-                reward_type TEXT,
-                role_id INTEGER DEFAULT NULL,
-                currency_amount INTEGER DEFAULT 0,
-                PRIMARY KEY (guild_id, level)
-            )
-        ''')
-
-        # Тикет-группы
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ticket_groups (
-                guild_id INTEGER,
-                group_type TEXT,
-                role_id INTEGER,
-                PRIMARY KEY (guild_id, group_type)
-            )
-        ''')
-
-        # Активные тикеты
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS active_tickets (
-                channel_id INTEGER PRIMARY KEY,
-                guild_id INTEGER,
-                user_id INTEGER,
-                ticket_type TEXT,
-                created_at INTEGER
-            )
-        ''')
+    def stats(self):
+        return {
+            'storage_profile': self.profile,
+            'pool_size': self.size,
+            'pool_hits': self.pool_hits,
+            'connections_opened': self.connections_opened,
+            'connections_in_use': self._opened - len(self._idle)
+        }
 
-        self.conn.commit()
+class Database:
+    def __init__(self, path=DB_PATH, pool_size=DEFAULT_POOL_SIZE, profile=DEFAULT_STORAGE_PROFILE):
+        self.pool = ConnectionPool(path, pool_size, profile)
+        # Строгий режим: сообщать о синхронных запросах из потока event loop
+        self.strict = False
+        self.loop_thread_calls = 0
+        self._reported_call_sites = set()
+        # Кэш настроек серверов
+        self._settings_cache = {}
+        self._settings_generation = 0
+        self.settings_hits = 0
+        self.settings_misses = 0
+        # Индекс множителей ролей: role_id -> (economy, xp)
+        self._role_multipliers = {}
+        self._member_multipliers = {}
+        self.multiplier_hits = 0
+        self.multiplier_misses = 0
+        # Рейтинги серверов по балансу и уровню
+        self.rankings = Rankings(self._load_ranking_rows)
+        # Награды за уровни, отсортированные по уровню
+        self.reward_tables = RewardTables(self.get_all_level_rewards)
+        self.transfers = 0
+        self.transfers_declined = 0
+        self.transfer_batches = 0
+        self.purchases = 0
+        self.purchases_declined = 0
+        self.purge_rows_deleted = 0
+        # Префиксы команд всех серверов
+        self.prefixes = PrefixResolver()
+        # Группы ролей для проверки прав
+        self.permissions = PermissionResolver(self._load_role_groups)
+        self.migrate()
+        self.load_role_multipliers()
+        self.load_prefixes()
+    
+    @property
+    def conn(self):
+        if self.strict:
+            self._check_loop_thread()
+        return self.pool.get()
+    
+    def _check_loop_thread(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        
+        self.loop_thread_calls += 1
+        
+        # Ищем первый кадр стека вне этого модуля - это и есть место вызова
+        for frame in reversed(traceback.extract_stack()[:-2]):
+            if frame.filename != __file__:
+                call_site = (frame.filename, frame.lineno)
+                if call_site not in self._reported_call_sites:
+                    self._reported_call_sites.add(call_site)
+                    print(f"⚠️ Синхронный запрос к БД в потоке event loop: {frame.filename}:{frame.lineno} ({frame.name})")
+                break
+    
+    def stats(self):
+        stats = self.pool.stats()
+        stats['loop_thread_calls'] = self.loop_thread_calls
+        stats['settings_hits'] = self.settings_hits
+        stats['settings_misses'] = self.settings_misses
+        stats['settings_cached'] = len(self._settings_cache)
+        stats['multiplier_roles'] = len(self._role_multipliers)
+        stats['multiplier_hits'] = self.multiplier_hits
+        stats['multiplier_misses'] = self.multiplier_misses
+        stats.update(self.rankings.stats())
+        stats['transfers'] = self.transfers
+        stats['transfers_declined'] = self.transfers_declined
+        stats['transfer_batches'] = self.transfer_batches
+        stats['purchases'] = self.purchases
+        stats['purchases_declined'] = self.purchases_declined
+        stats['purge_rows_deleted'] = self.purge_rows_deleted
+        stats.update(self.prefixes.stats())
+        stats.update(self.permissions.stats())
+        stats.update(self.reward_tables.stats())
+        return stats
+    
+    @contextmanager
+    def transaction(self):
+        """Транзакция BEGIN IMMEDIATE: блокировка записи берется сразу,
+        поэтому проверки внутри не устаревают до фиксации"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    
+    def migrate(self):
+        """Привести схему базы к последней версии"""
+        return migrations.migrate(self.conn)
     
     def get_user(self, user_id, guild_id):
         cursor = self.conn.cursor()
@@ -208,9 +265,29 @@ class Database:
         if not result:
             cursor.execute('INSERT INTO users (user_id, guild_id) VALUES (?, ?)', (user_id, guild_id))
             self.conn.commit()
+            self._touch_ranking(guild_id, [user_id])
             return (user_id, guild_id, 0, 0, 1, 0)
         return result
     
+    def _load_ranking_rows(self, guild_id):
+        cursor = self.conn.cursor()
+        cursor.execute(queries.LOAD_RANKING_ROWS, (guild_id,))
+        return cursor.fetchall()
+    
+    def _touch_ranking(self, guild_id, user_ids):
+        """Перечитать измененных пользователей в рейтинг сервера, если он загружен"""
+        def fetch():
+            cursor = self.conn.cursor()
+            rows = []
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                cursor.execute(f'SELECT user_id, balance, level, xp FROM users WHERE guild_id = ? AND user_id IN ({",".join("?" * len(chunk))})', 
+                              (guild_id, *chunk))
+                rows.extend(cursor.fetchall())
+            return rows
+        
+        self.rankings.touch(guild_id, fetch)
+    
     def set_command_permission(self, guild_id, role_group, command_name):
         cursor = self.conn.cursor()
         cursor.execute('INSERT OR REPLACE INTO command_permissions (guild_id, role_group, command_name) VALUES (?, ?, ?)', 
@@ -227,6 +304,12 @@ class Database:
         cursor.execute('INSERT OR REPLACE INTO role_assignments (guild_id, role_group, role_id) VALUES (?, ?, ?)', 
                   (guild_id, role_group, role_id))
         self.conn.commit()
+        self.permissions.invalidate(guild_id)
+
+    def _load_role_groups(self, guild_id):
+        cursor = self.conn.cursor()
+        cursor.execute(queries.LOAD_ROLE_GROUPS, (guild_id,))
+        return cursor.fetchall()
 
     def get_role_assignments(self, guild_id, role_group):
         cursor = self.conn.cursor()
@@ -237,56 +320,219 @@ class Database:
         cursor = self.conn.cursor()
         cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? AND guild_id = ?', (amount, user_id, guild_id))
         self.conn.commit()
+        self._touch_ranking(guild_id, [user_id])
     
     def update_xp(self, user_id, guild_id, amount):
         cursor = self.conn.cursor()
         cursor.execute('UPDATE users SET xp = xp + ? WHERE user_id = ? AND guild_id = ?', (amount, user_id, guild_id))
         self.conn.commit()
+        self._touch_ranking(guild_id, [user_id])
+    
+    def apply_xp_deltas(self, rows):
+        """Пакетная запись опыта одной транзакцией.
+
+        rows - кортежи (прирост xp, новый уровень или None, user_id, guild_id)
+        """
+        cursor = self.conn.cursor()
+        cursor.executemany('UPDATE users SET xp = xp + ?, level = COALESCE(?, level) WHERE user_id = ? AND guild_id = ?', rows)
+        self.conn.commit()
+        
+        by_guild = {}
+        for xp, level, user_id, guild_id in rows:
+            by_guild.setdefault(guild_id, []).append(user_id)
+        for guild_id, user_ids in by_guild.items():
+            self._touch_ranking(guild_id, user_ids)
+    
+    def transfer_many(self, transfers):
+        """Выполнить переводы одной транзакцией.
+
+        transfers - кортежи (from_user_id, to_user_id, guild_id, amount). Каждый
+        перевод списывает деньги только при достаточном балансе и пишет строку
+        в transactions. Возвращает список флагов успеха в том же порядке.
+        """
+        results = []
+        touched = {}
+        
+        with self.transaction() as cursor:
+            for from_user_id, to_user_id, guild_id, amount in transfers:
+                cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ? AND guild_id = ? AND balance >= ?', 
+                              (amount, from_user_id, guild_id, amount))
+                if cursor.rowcount != 1:
+                    results.append(False)
+                    continue
+                
+                cursor.execute('INSERT OR IGNORE INTO users (user_id, guild_id) VALUES (?, ?)', (to_user_id, guild_id))
+                cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? AND guild_id = ?', 
+                              (amount, to_user_id, guild_id))
+                self._insert_transaction(cursor, from_user_id, to_user_id, guild_id, None, amount, 'transfer')
+                touched.setdefault(guild_id, set()).update((from_user_id, to_user_id))
+                results.append(True)
+        
+        self.transfer_batches += 1
+        self.transfers += results.count(True)
+        self.transfers_declined += results.count(False)
+        for guild_id, user_ids in touched.items():
+            self._touch_ranking(guild_id, list(user_ids))
+        return results
+    
+    def transfer(self, from_user_id, to_user_id, guild_id, amount):
+        return self.transfer_many([(from_user_id, to_user_id, guild_id, amount)])[0]
     
     def set_balance(self, user_id, guild_id, amount):
         cursor = self.conn.cursor()
         cursor.execute('UPDATE users SET balance = ? WHERE user_id = ? AND guild_id = ?', (amount, user_id, guild_id))
         self.conn.commit()
+        self._touch_ranking(guild_id, [user_id])
     
     def set_xp(self, user_id, guild_id, amount):
         cursor = self.conn.cursor()
         cursor.execute('UPDATE users SET xp = ? WHERE user_id = ? AND guild_id = ?', (amount, user_id, guild_id))
         self.conn.commit()
+        self._touch_ranking(guild_id, [user_id])
     
     def set_level(self, user_id, guild_id, level):
         cursor = self.conn.cursor()
         cursor.execute('UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?', (level, user_id, guild_id))
         self.conn.commit()
+        self._touch_ranking(guild_id, [user_id])
+    
+    def recompute_levels(self, guild_id, chunk_size=RECOMPUTE_CHUNK_SIZE):
+        """Привести users.level всего сервера к текущей кривой уровней.
+
+        Участники читаются пачками по user_id, уровни пачки считаются одним
+        вызовом, исправления пишутся executemany в одной транзакции.
+        Возвращает (проверено, изменено, секунд).
+        """
+        started = time.perf_counter()
+        scanned = changed = 0
+        last_user_id = -1
+        with self.transaction() as cursor:
+            while True:
+                cursor.execute(queries.RECOMPUTE_LEVELS_CHUNK, (guild_id, last_user_id, chunk_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                
+                levels = calculate_levels([row[1] for row in rows])
+                updates = [(level, user_id, guild_id) for (user_id, xp, old_level), level in zip(rows, levels) if level != old_level]
+                if updates:
+                    cursor.executemany('UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?', updates)
+                
+                scanned += len(rows)
+                changed += len(updates)
+                last_user_id = rows[-1][0]
+        
+        # Рейтинг по уровням перестроится при следующем запросе
+        if changed:
+            self.rankings.drop(guild_id)
+        return scanned, changed, time.perf_counter() - started
     
     def get_leaderboard_ec(self, guild_id, limit=10):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT user_id, balance FROM users WHERE guild_id = ? ORDER BY balance DESC LIMIT ?', (guild_id, limit))
-        return cursor.fetchall()
+        return self.rankings.read(guild_id, lambda ranking: ranking.top_balance(limit))
     
     def get_leaderboard_lv(self, guild_id, limit=10):
+        return self.rankings.read(guild_id, lambda ranking: ranking.top_level(limit))
+    
+    def get_balance_rank(self, guild_id, user_id):
+        """Место пользователя по балансу (с 1) или None"""
+        return self.rankings.read(guild_id, lambda ranking: ranking.balance_rank(user_id))
+    
+    def get_level_rank(self, guild_id, user_id):
+        return self.rankings.read(guild_id, lambda ranking: ranking.level_rank(user_id))
+    
+    def get_level_around(self, guild_id, user_id, radius=2):
+        """Соседи по уровню: список (место, user_id, level, xp)"""
+        return self.rankings.read(guild_id, lambda ranking: ranking.level_around(user_id, radius))
+    
+    def load_prefixes(self):
+        """Загрузить префиксы всех серверов одним запросом"""
         cursor = self.conn.cursor()
-        cursor.execute('SELECT user_id, level, xp FROM users WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT ?', (guild_id, limit))
-        return cursor.fetchall()
+        cursor.execute('SELECT guild_id, prefix FROM server_settings')
+        self.prefixes.load(cursor.fetchall())
     
-    def get_role_multiplier(self, role_id):
+    def load_role_multipliers(self):
+        """Загрузить все множители ролей в память"""
         cursor = self.conn.cursor()
-        cursor.execute('SELECT economy_multiplier, xp_multiplier FROM role_multipliers WHERE role_id = ?', (role_id,))
-        return cursor.fetchone()
+        cursor.execute('SELECT role_id, economy_multiplier, xp_multiplier FROM role_multipliers')
+        self._role_multipliers = {role_id: (eco_mult, xp_mult) for role_id, eco_mult, xp_mult in cursor.fetchall()}
+        self._member_multipliers = {}
+    
+    def get_role_multiplier(self, role_id):
+        return self._role_multipliers.get(role_id)
+    
+    def get_member_multipliers(self, role_ids):
+        """Итоговые множители (economy, xp) для набора ролей участника"""
+        key = frozenset(role_ids)
+        result = self._member_multipliers.get(key)
+        if result is not None:
+            self.multiplier_hits += 1
+            return result
+        
+        self.multiplier_misses += 1
+        eco_mult = 1.0
+        xp_mult = 1.0
+        for role_id in key:
+            role_mult = self._role_multipliers.get(role_id)
+            if role_mult:
+                eco_mult = max(eco_mult, role_mult[0])
+                xp_mult = max(xp_mult, role_mult[1])
+        
+        result = (eco_mult, xp_mult)
+        if len(self._member_multipliers) >= MULTIPLIER_MEMO_SIZE:
+            self._member_multipliers = {}
+        self._member_multipliers[key] = result
+        return result
     
     def set_role_multiplier(self, role_id, eco_mult, xp_mult):
         cursor = self.conn.cursor()
         cursor.execute('INSERT OR REPLACE INTO role_multipliers (role_id, economy_multiplier, xp_multiplier) VALUES (?, ?, ?)', (role_id, eco_mult, xp_mult))
         self.conn.commit()
+        self._role_multipliers[role_id] = (eco_mult, xp_mult)
+        self._member_multipliers = {}
+    
+    def cached_server_settings(self, guild_id):
+        """Настройки из кэша без обращения к базе или None"""
+        settings = self._settings_cache.get(guild_id)
+        if settings is not None:
+            self.settings_hits += 1
+        return settings
     
     def get_server_settings(self, guild_id):
+        settings = self.cached_server_settings(guild_id)
+        if settings is not None:
+            return settings
+        
+        self.settings_misses += 1
+        generation = self._settings_generation
+        
         cursor = self.conn.cursor()
         cursor.execute('SELECT * FROM server_settings WHERE guild_id = ?', (guild_id,))
         result = cursor.fetchone()
         if not result:
             cursor.execute('INSERT INTO server_settings (guild_id) VALUES (?)', (guild_id,))
             self.conn.commit()
-            return (guild_id, 10, 50, 3600, 5, 2, 1, 1000, '!', 0, None)
-        return result
+            result = (guild_id, 10, 50, 3600, 5, 2, 1, 1000, '!', 0, None)
+        
+        settings = ServerSettings(*result)
+        # Не кэшируем, если настройки успели измениться, пока шел запрос
+        if generation == self._settings_generation:
+            self._settings_cache[guild_id] = settings
+        return settings
+    
+    def warm_settings(self):
+        """Загрузить настройки всех серверов в кэш одним запросом"""
+        generation = self._settings_generation
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM server_settings')
+        rows = cursor.fetchall()
+        if generation == self._settings_generation:
+            for row in rows:
+                self._settings_cache.setdefault(row[0], ServerSettings(*row))
+        return len(rows)
+    
+    def invalidate_settings(self, guild_id):
+        self._settings_generation += 1
+        self._settings_cache.pop(guild_id, None)
     
     def update_server_settings(self, guild_id, **kwargs):
         cursor = self.conn.cursor()
@@ -306,6 +552,9 @@ class Database:
             values.append(guild_id)
             cursor.execute(f'UPDATE server_settings SET {", ".join(updates)} WHERE guild_id = ?', values)
             self.conn.commit()
+            self.invalidate_settings(guild_id)
+            if 'prefix' in kwargs:
+                self.prefixes.set(guild_id, kwargs['prefix'])
     
     def set_cooldown(self, user_id, guild_id, command):
         cursor = self.conn.cursor()
@@ -335,9 +584,147 @@ class Database:
         self.conn.commit()
         return cursor.lastrowid
 
+    # Розыгрыши
+    def get_giveaway(self, message_id, active_only=False):
+        cursor = self.conn.cursor()
+        if active_only:
+            cursor.execute('SELECT * FROM giveaways WHERE message_id = ? AND ended = 0', (message_id,))
+        else:
+            cursor.execute('SELECT * FROM giveaways WHERE message_id = ?', (message_id,))
+        return cursor.fetchone()
+
+    def add_giveaway_entry(self, message_id, user_id):
+        """Возвращает False, если пользователь уже участвует"""
+        cursor = self.conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO giveaway_entries (message_id, user_id) VALUES (?, ?)', 
+                      (message_id, user_id))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
+    def get_active_giveaways(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM giveaways WHERE ended = 0')
+        return cursor.fetchall()
+
+    def get_guild_giveaways(self, guild_id):
+        """Активные розыгрыши сервера, ближайшие первыми"""
+        cursor = self.conn.cursor()
+        cursor.execute(queries.GET_GUILD_GIVEAWAYS, (guild_id,))
+        return cursor.fetchall()
+
+    def create_giveaway(self, message_id, guild_id, channel_id, prize, winners_count, end_time):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT INTO giveaways (message_id, guild_id, channel_id, prize, winners_count, end_time)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (message_id, guild_id, channel_id, prize, winners_count, end_time))
+        self.conn.commit()
+
+    def set_giveaway_end_time(self, message_id, end_time):
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE giveaways SET end_time = ? WHERE message_id = ?', (end_time, message_id))
+        self.conn.commit()
+
+    def finish_giveaway(self, message_id):
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE giveaways SET ended = 1 WHERE message_id = ?', (message_id,))
+        self.conn.commit()
+
+    def get_giveaway_entries(self, message_id):
+        """id всех участников розыгрыша"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT user_id FROM giveaway_entries WHERE message_id = ?', (message_id,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def count_giveaway_entries(self, message_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM giveaway_entries WHERE message_id = ?', (message_id,))
+        return cursor.fetchone()[0]
+
+    # Планировщик
+    def save_scheduled_job(self, job_id, kind, due_at, payload, guild_id=None):
+        cursor = self.conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO scheduled_jobs (job_id, kind, due_at, payload, guild_id) VALUES (?, ?, ?, ?, ?)', 
+                      (job_id, kind, due_at, payload, guild_id))
+        self.conn.commit()
+
+    def postpone_scheduled_job(self, job_id, due_at):
+        """Перенести задачу, не трогая остальные поля (повтор после ошибки)"""
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE scheduled_jobs SET due_at = ? WHERE job_id = ?', (due_at, job_id))
+        self.conn.commit()
+
+    def delete_scheduled_job(self, job_id):
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM scheduled_jobs WHERE job_id = ?', (job_id,))
+        self.conn.commit()
+
+    def get_scheduled_jobs(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT job_id, kind, due_at, payload FROM scheduled_jobs')
+        return cursor.fetchall()
+
+    # Муты
+    def add_mute(self, guild_id, user_id, role_id, expires_at):
+        cursor = self.conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO mutes (guild_id, user_id, role_id, expires_at) VALUES (?, ?, ?, ?)', 
+                      (guild_id, user_id, role_id, expires_at))
+        self.conn.commit()
+
+    def remove_mute(self, guild_id, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM mutes WHERE guild_id = ? AND user_id = ?', (guild_id, user_id))
+        self.conn.commit()
+
+    def get_next_mute_expiry(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT MIN(expires_at) FROM mutes')
+        return cursor.fetchone()[0]
+
+    def get_due_mutes(self, now, limit):
+        cursor = self.conn.cursor()
+        cursor.execute(queries.GET_DUE_MUTES, 
+                      (now, limit))
+        return cursor.fetchall()
+
+    def delete_expired_mutes(self, mutes):
+        """Удалить истекшие муты одной транзакцией (продленные за это время не трогаем)"""
+        cursor = self.conn.cursor()
+        cursor.executemany('DELETE FROM mutes WHERE guild_id = ? AND user_id = ? AND expires_at <= ?', 
+                          [(guild_id, user_id, expires_at) for guild_id, user_id, role_id, expires_at in mutes])
+        self.conn.commit()
+
+    def retry_mutes(self, mutes, now, delay, max_delay, max_attempts):
+        """Отложить муты, которые не удалось снять: срок переносится на delay * 2^попытка
+        (не больше max_delay). После max_attempts попыток мут удаляется.
+        Возвращает число удаленных мутов."""
+        keys = [(guild_id, user_id, expires_at) for guild_id, user_id, role_id, expires_at in mutes]
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE mutes SET attempts = attempts + 1, expires_at = ? + MIN(? << attempts, ?)
+                WHERE guild_id = ? AND user_id = ? AND expires_at = ?
+            ''', [(now, delay, max_delay, guild_id, user_id, expires_at) for guild_id, user_id, expires_at in keys])
+            cursor.executemany('DELETE FROM mutes WHERE guild_id = ? AND user_id = ? AND attempts >= ?', 
+                              [(guild_id, user_id, max_attempts) for guild_id, user_id, expires_at in keys])
+            return cursor.rowcount
+
+    # Голосовые сессии
+    def get_voice_sessions(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT guild_id, user_id, started_at, credited_at FROM voice_sessions')
+        return cursor.fetchall()
+
+    def save_voice_sessions(self, sessions, ended):
+        """Сохранить открытые и удалить закрытые сессии одной транзакцией"""
+        cursor = self.conn.cursor()
+        cursor.executemany('INSERT OR REPLACE INTO voice_sessions (guild_id, user_id, started_at, credited_at) VALUES (?, ?, ?, ?)', 
+                          sessions)
+        cursor.executemany('DELETE FROM voice_sessions WHERE guild_id = ? AND user_id = ?', ended)
+        self.conn.commit()
+
     def get_shop_items(self, guild_id):
         cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM shop_items WHERE guild_id = ? ORDER BY price ASC', (guild_id,))
+        cursor.execute(queries.GET_SHOP_ITEMS, (guild_id,))
         return cursor.fetchall()
 
     def get_shop_item(self, item_id):
@@ -351,41 +738,47 @@ class Database:
         self.conn.commit()
 
     def purchase_item(self, user_id, guild_id, item_id):
-        cursor = self.conn.cursor()
-        
-        item = self.get_shop_item(item_id)
-        if not item:
-            return False, "Предмет не найден"
-        
-        if item[8] != -1:
-            cursor.execute('SELECT purchase_count FROM item_purchases WHERE user_id = ? AND guild_id = ? AND item_id = ?', 
-                         (user_id, guild_id, item_id))
-            purchase_data = cursor.fetchone()
-            if purchase_data and purchase_data[0] >= item[8]:
-                return False, f"Вы уже купили максимальное количество этого предмета ({item[8]})"
-        
-        user_data = self.get_user(user_id, guild_id)
-        if user_data[2] < item[4]:
-            return False, "Недостаточно монет"
-        
-        expires_at = None
-        if item[7] > 0:
-            expires_at = int(datetime.now().timestamp()) + item[7]
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_inventory (user_id, guild_id, item_id, purchase_time, expires_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, guild_id, item_id, int(datetime.now().timestamp()), expires_at))
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO item_purchases (user_id, guild_id, item_id, purchase_count)
-            VALUES (?, ?, ?, COALESCE((SELECT purchase_count FROM item_purchases WHERE user_id = ? AND guild_id = ? AND item_id = ?), 0) + 1)
-        ''', (user_id, guild_id, item_id, user_id, guild_id, item_id))
-        
-        cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ? AND guild_id = ?', 
-                     (item[4], user_id, guild_id))
+        """Покупка в магазине одной транзакцией.
+
+        Лимит покупок и баланс проверяются условными UPDATE внутри BEGIN IMMEDIATE,
+        поэтому одновременные покупки не превышают лимит и не уводят баланс в минус.
+        """
+        now = int(datetime.now().timestamp())
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('SELECT * FROM shop_items WHERE item_id = ?', (item_id,))
+                item = cursor.fetchone()
+                if not item:
+                    raise PurchaseDeclined("Предмет не найден")
+                
+                # Счетчик покупок растет, только пока лимит не достигнут
+                cursor.execute('''
+                    INSERT INTO item_purchases (user_id, guild_id, item_id, purchase_count) VALUES (?, ?, ?, 1)
+                    ON CONFLICT (user_id, guild_id, item_id) DO UPDATE SET purchase_count = purchase_count + 1
+                    WHERE ? = -1 OR purchase_count < ?
+                ''', (user_id, guild_id, item_id, item[8], item[8]))
+                if cursor.rowcount != 1:
+                    raise PurchaseDeclined(f"Вы уже купили максимальное количество этого предмета ({item[8]})")
+                
+                cursor.execute('INSERT OR IGNORE INTO users (user_id, guild_id) VALUES (?, ?)', (user_id, guild_id))
+                cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ? AND guild_id = ? AND balance >= ?', 
+                             (item[4], user_id, guild_id, item[4]))
+                if cursor.rowcount != 1:
+                    raise PurchaseDeclined("Недостаточно монет")
+                
+                expires_at = now + item[7] if item[7] > 0 else None
+                cursor.execute('''
+                    INSERT OR REPLACE INTO user_inventory (user_id, guild_id, item_id, purchase_time, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, guild_id, item_id, now, expires_at))
+                
+                self._insert_transaction(cursor, user_id, None, guild_id, item_id, item[4], 'shop_purchase')
+        except PurchaseDeclined as e:
+            self.purchases_declined += 1
+            return False, str(e)
         
-        self.conn.commit()
+        self.purchases += 1
+        self._touch_ranking(guild_id, [user_id])
         return True, "Покупка успешна"
 
     def get_user_inventory(self, user_id, guild_id):
@@ -407,6 +800,38 @@ class Database:
         ''', (int(datetime.now().timestamp()),))
         return cursor.fetchall()
 
+    def get_next_item_expiry(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT MIN(expires_at) FROM user_inventory WHERE expires_at IS NOT NULL')
+        return cursor.fetchone()[0]
+
+    def get_due_items(self, now, limit):
+        """Истекшие предметы вместе с данными из магазина, по порядку истечения"""
+        cursor = self.conn.cursor()
+        cursor.execute(queries.GET_DUE_ITEMS, (now, limit))
+        return cursor.fetchall()
+
+    def delete_expired_items(self, items):
+        """Удалить истекшие предметы одной транзакцией (продленные за это время не трогаем)"""
+        cursor = self.conn.cursor()
+        cursor.executemany('DELETE FROM user_inventory WHERE user_id = ? AND guild_id = ? AND item_id = ? AND expires_at <= ?', 
+                          [(item[0], item[1], item[2], item[-1]) for item in items])
+        self.conn.commit()
+
+    def retry_expired_items(self, items, now, delay, max_delay, max_attempts):
+        """Отложить предметы, роль за которые не удалось снять: срок переносится на
+        delay * 2^попытка (не больше max_delay). После max_attempts попыток предмет удаляется.
+        Возвращает число удаленных предметов."""
+        keys = [(item[0], item[1], item[2], item[-1]) for item in items]
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                UPDATE user_inventory SET attempts = attempts + 1, expires_at = ? + MIN(? << attempts, ?)
+                WHERE user_id = ? AND guild_id = ? AND item_id = ? AND expires_at = ?
+            ''', [(now, delay, max_delay, user_id, guild_id, item_id, expires_at) for user_id, guild_id, item_id, expires_at in keys])
+            cursor.executemany('DELETE FROM user_inventory WHERE user_id = ? AND guild_id = ? AND item_id = ? AND attempts >= ?', 
+                              [(user_id, guild_id, item_id, max_attempts) for user_id, guild_id, item_id, expires_at in keys])
+            return cursor.rowcount
+
     def remove_inventory_item(self, user_id, guild_id, item_id):
         cursor = self.conn.cursor()
         cursor.execute('DELETE FROM user_inventory WHERE user_id = ? AND guild_id = ? AND item_id = ?', 
@@ -427,14 +852,7 @@ class Database:
 
     def get_market_listings(self, guild_id, status='active'):
         cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT m.*, si.name, si.description, si.item_type, u.balance as seller_balance
-            FROM marketplace m
-            JOIN shop_items si ON m.item_id = si.item_id
-            JOIN users u ON m.seller_id = u.user_id AND m.guild_id = u.guild_id
-            WHERE m.guild_id = ? AND m.status = ?
-            ORDER BY m.created_at DESC
-        ''', (guild_id, status))
+        cursor.execute(queries.GET_MARKET_LISTINGS, (guild_id, status))
         return cursor.fetchall()
 
     def get_market_listing(self, listing_id):
@@ -448,49 +866,57 @@ class Database:
         return cursor.fetchone()
 
     def purchase_market_item(self, buyer_id, guild_id, listing_id):
-        cursor = self.conn.cursor()
-        
-        listing = self.get_market_listing(listing_id)
-        if not listing:
-            return False, "Предложение не найдено"
-        
-        if listing[6] != 'active':
-            return False, "Это предложение уже продано или отменено"
-        
-        buyer_data = self.get_user(buyer_id, guild_id)
-        if buyer_data[2] < listing[4]:
-            return False, "Недостаточно монет"
-        
-        seller_id = listing[1]
-        
-        if buyer_id == seller_id:
-            return False, "Нельзя купить свой же предмет"
-        
-        item_info = self.get_shop_item(listing[3])
-        if not item_info:
-            return False, "Предмет не найден в магазине"
-        
-        expires_at = None
-        if item_info[7] > 0:
-            expires_at = int(datetime.now().timestamp()) + item_info[7]
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_inventory (user_id, guild_id, item_id, purchase_time, expires_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (buyer_id, guild_id, listing[3], int(datetime.now().timestamp()), expires_at))
-        
-        cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ? AND guild_id = ?', 
-                     (listing[4], buyer_id, guild_id))
-        
-        cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? AND guild_id = ?', 
-                     (listing[4], seller_id, guild_id))
-        
-        cursor.execute('UPDATE marketplace SET status = ? WHERE listing_id = ?', 
-                     ('sold', listing_id))
-        
-        self.add_transaction(seller_id, buyer_id, guild_id, listing[3], listing[4], 'market_sale')
+        """Покупка на торговой площадке одной транзакцией.
+
+        Предложение переводится из active в sold условным UPDATE: из нескольких
+        одновременных покупателей его получает только первый.
+        """
+        now = int(datetime.now().timestamp())
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    SELECT m.seller_id, m.item_id, m.price, si.duration
+                    FROM marketplace m
+                    LEFT JOIN shop_items si ON m.item_id = si.item_id
+                    WHERE m.listing_id = ? AND m.guild_id = ?
+                ''', (listing_id, guild_id))
+                listing = cursor.fetchone()
+                if not listing:
+                    raise PurchaseDeclined("Предложение не найдено")
+                
+                seller_id, item_id, price, duration = listing
+                if buyer_id == seller_id:
+                    raise PurchaseDeclined("Нельзя купить свой же предмет")
+                if duration is None:
+                    raise PurchaseDeclined("Предмет не найден в магазине")
+                
+                cursor.execute("UPDATE marketplace SET status = 'sold' WHERE listing_id = ? AND status = 'active'", (listing_id,))
+                if cursor.rowcount != 1:
+                    raise PurchaseDeclined("Это предложение уже продано или отменено")
+                
+                cursor.execute('INSERT OR IGNORE INTO users (user_id, guild_id) VALUES (?, ?)', (buyer_id, guild_id))
+                cursor.execute('UPDATE users SET balance = balance - ? WHERE user_id = ? AND guild_id = ? AND balance >= ?', 
+                             (price, buyer_id, guild_id, price))
+                if cursor.rowcount != 1:
+                    raise PurchaseDeclined("Недостаточно монет")
+                
+                cursor.execute('INSERT OR IGNORE INTO users (user_id, guild_id) VALUES (?, ?)', (seller_id, guild_id))
+                cursor.execute('UPDATE users SET balance = balance + ? WHERE user_id = ? AND guild_id = ?', 
+                             (price, seller_id, guild_id))
+                
+                expires_at = now + duration if duration > 0 else None
+                cursor.execute('''
+                    INSERT OR REPLACE INTO user_inventory (user_id, guild_id, item_id, purchase_time, expires_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (buyer_id, guild_id, item_id, now, expires_at))
+                
+                self._insert_transaction(cursor, seller_id, buyer_id, guild_id, item_id, price, 'market_sale')
+        except PurchaseDeclined as e:
+            self.purchases_declined += 1
+            return False, str(e)
         
-        self.conn.commit()
+        self.purchases += 1
+        self._touch_ranking(guild_id, [buyer_id, seller_id])
         return True, "Покупка успешна"
 
     def remove_market_listing(self, listing_id):
@@ -511,21 +937,19 @@ class Database:
 
     # Транзакции
     def add_transaction(self, from_user_id, to_user_id, guild_id, item_id, amount, transaction_type):
-        cursor = self.conn.cursor()
+        self._insert_transaction(self.conn.cursor(), from_user_id, to_user_id, guild_id, item_id, amount, transaction_type)
+        self.conn.commit()
+
+    def _insert_transaction(self, cursor, from_user_id, to_user_id, guild_id, item_id, amount, transaction_type):
+        """Запись в журнал транзакций без фиксации - для использования внутри transaction()"""
         cursor.execute('''
             INSERT INTO transactions (from_user_id, to_user_id, guild_id, item_id, amount, transaction_type, created_at)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (from_user_id, to_user_id, guild_id, item_id, amount, transaction_type, int(datetime.now().timestamp())))
-        self.conn.commit()
 
     def get_user_transactions(self, user_id, guild_id, limit=10):
         cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT * FROM transactions 
-            WHERE (from_user_id = ? OR to_user_id = ?) AND guild_id = ?
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (user_id, user_id, guild_id, limit))
+        cursor.execute(queries.GET_USER_TRANSACTIONS, (user_id, user_id, guild_id, limit))
         return cursor.fetchall()
 
     # Награды за уровни
@@ -536,11 +960,18 @@ class Database:
             VALUES (?, ?, ?, ?, ?)
         ''', (guild_id, level, reward_type, role_id, currency_amount))
         self.conn.commit()
+        self.reward_tables.rebuild(guild_id)
 
     def get_level_reward(self, guild_id, level):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM level_rewards WHERE guild_id = ? AND level = ?', (guild_id, level))
-        return cursor.fetchone()
+        return self.reward_tables.guild(guild_id).get(level)
+
+    def get_rewards_up_to(self, guild_id, level):
+        """Награды за все уровни не выше level"""
+        return self.reward_tables.guild(guild_id).up_to(level)
+
+    def get_rewards_between(self, guild_id, old_level, new_level):
+        """Награды за уровни от old_level (не включая) до new_level"""
+        return self.reward_tables.guild(guild_id).between(old_level, new_level)
 
     def get_all_level_rewards(self, guild_id):
         cursor = self.conn.cursor()
@@ -551,6 +982,7 @@ class Database:
         cursor = self.conn.cursor()
         cursor.execute('DELETE FROM level_rewards WHERE guild_id = ? AND level = ?', (guild_id, level))
         self.conn.commit()
+        self.reward_tables.rebuild(guild_id)
 
     # Тикеты
     def set_ticket_group(self, guild_id, group_type, role_id):
@@ -597,50 +1029,250 @@ class Database:
 
     def get_all_tickets(self, guild_id):
         cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM active_tickets WHERE guild_id = ?', (guild_id,))
+        cursor.execute(queries.GET_GUILD_TICKETS, (guild_id,))
+        return cursor.fetchall()
+
+    def archive_ticket(self, channel_id, closed_by, message_count, size_bytes, path):
+        """Закрыть тикет: запись в архиве и удаление из активных одной транзакцией"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO ticket_transcripts
+                    (channel_id, guild_id, user_id, ticket_type, created_at, closed_at, closed_by, message_count, size_bytes, path)
+                SELECT channel_id, guild_id, user_id, ticket_type, created_at, ?, ?, ?, ?, ?
+                FROM active_tickets WHERE channel_id = ?
+            ''', (int(datetime.now().timestamp()), closed_by, message_count, size_bytes, path, channel_id))
+            cursor.execute('DELETE FROM active_tickets WHERE channel_id = ?', (channel_id,))
+
+    def get_ticket_transcripts(self, guild_id, limit=10):
+        cursor = self.conn.cursor()
+        cursor.execute(queries.GET_TICKET_TRANSCRIPTS, (guild_id, limit))
         return cursor.fetchall()
 
     # Очистка данных сервера при выходе бота
     def cleanup_guild_data(self, guild_id):
+        """Удалить все данные сервера сразу (для фона - start_guild_purge и purge_guild_chunk)"""
+        self.start_guild_purge(guild_id)
+        while not self.purge_guild_chunk(guild_id)[0]:
+            pass
+
+    def start_guild_purge(self, guild_id):
+        """Поставить сервер в очередь на очистку; кэши сбрасываются сразу"""
         cursor = self.conn.cursor()
+        cursor.execute('INSERT OR IGNORE INTO guild_purges (guild_id, started_at) VALUES (?, ?)', 
+                      (guild_id, int(datetime.now().timestamp())))
+        self.conn.commit()
+        self.invalidate_settings(guild_id)
+        self.rankings.drop(guild_id)
+        self.reward_tables.drop(guild_id)
+        self.prefixes.drop(guild_id)
+        self.permissions.invalidate(guild_id)
+
+    def get_pending_purges(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT guild_id FROM guild_purges')
+        return [row[0] for row in cursor.fetchall()]
+
+    def purge_guild_chunk(self, guild_id, chunk_size=PURGE_CHUNK_SIZE):
+        """Удалить одну пачку строк сервера.
+
+        Возвращает (завершено, таблица, всего удалено). Позиция хранится в
+        guild_purges в той же транзакции, поэтому очистка продолжается после перезапуска.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('SELECT table_index, rows_deleted FROM guild_purges WHERE guild_id = ?', (guild_id,))
+            state = cursor.fetchone()
+            if state is None:
+                return True, None, 0
+            
+            table_index, rows_deleted = state
+            if table_index >= len(GUILD_TABLES):
+                cursor.execute('DELETE FROM guild_purges WHERE guild_id = ?', (guild_id,))
+                return True, None, rows_deleted
+            
+            table = GUILD_TABLES[table_index]
+            cursor.execute(f'DELETE FROM {table} WHERE rowid IN ({queries.purge_select(table)})'
+                          f'{" RETURNING path" if table == "ticket_transcripts" else ""}', 
+                          (guild_id, chunk_size))
+            # Файлы историй тикетов удаляются после фиксации, вместе со строками архива
+            transcript_files = [row[0] for row in cursor.fetchall() if row[0]] if table == 'ticket_transcripts' else []
+            deleted = cursor.rowcount
+            if deleted < chunk_size:
+                table_index += 1
+            cursor.execute('UPDATE guild_purges SET table_index = ?, rows_deleted = ? WHERE guild_id = ?', 
+                          (table_index, rows_deleted + deleted, guild_id))
         
-        # Удаляем данные пользователей этого сервера
-        cursor.execute('DELETE FROM users WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем настройки сервера
-        cursor.execute('DELETE FROM server_settings WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем кулдауны
-        cursor.execute('DELETE FROM cooldowns WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем права команд
-        cursor.execute('DELETE FROM command_permissions WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем назначения ролей
-        cursor.execute('DELETE FROM role_assignments WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем предметы магазина
-        cursor.execute('DELETE FROM shop_items WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем инвентари
-        cursor.execute('DELETE FROM user_inventory WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем покупки
-        cursor.execute('DELETE FROM item_purchases WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем предложения торговой площадки
-        cursor.execute('DELETE FROM marketplace WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем транзакции
-        cursor.execute('DELETE FROM transactions WHERE guild_id = ?', (guild_id,))
-        
-        # Удаляем награды за уровни
-        cursor.execute('DELETE FROM level_rewards WHERE guild_id = ?', (guild_id,))
+        for path in transcript_files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠️ Не удалось удалить историю тикета {path}: {e}")
         
-        # Удаляем группы тикетов
-        cursor.execute('DELETE FROM ticket_groups WHERE guild_id = ?', (guild_id,))
+        self.purge_rows_deleted += deleted
+        return False, table, rows_deleted + deleted
+
+    def incremental_vacuum(self):
+        """Вернуть свободные страницы файлу (auto_vacuum = INCREMENTAL включается миграцией 10).
+
+        Возвращает число освобожденных страниц или None, если режим выключен.
+        """
+        conn = self.conn
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return None
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # execute() делает один шаг прагмы - это одна страница; executescript проходит до конца
+        conn.executescript('PRAGMA incremental_vacuum')
+        return free_pages
+
+class AsyncDatabase:
+    """Асинхронный фасад над Database.
+
+    Любой метод Database можно вызвать через await - запрос выполнится в
+    отдельном потоке БД и не заблокирует event loop.
+    """
+    def __init__(self, db, workers=DEFAULT_DB_WORKERS):
+        # Одно соединение постоянно у event loop, остальные делят потоки БД
+        if db.pool.size < 2:
+            raise ValueError("Пулу соединений нужно минимум 2 соединения: для event loop и для потоков БД")
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        self._transfers = []
+        self._transfer_task = None
+        self._purges = {}
+
+    def _call(self, func, args, kwargs):
+        # Соединение возвращается в пул сразу после вызова, иначе каждый
+        # поток исполнителя держал бы свое соединение навсегда
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.db.pool.release()
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._call, func, args, kwargs)
+
+    async def get_server_settings(self, guild_id):
+        # При попадании в кэш поток БД не нужен
+        settings = self.db.cached_server_settings(guild_id)
+        if settings is not None:
+            return settings
+        return await self.run(self.db.get_server_settings, guild_id)
+
+    async def is_admin(self, ctx):
+        """Проверка прав администратора; группы ролей сервера при промахе загружаются в потоке БД"""
+        permissions = self.db.permissions
+        guild_id = actor(ctx).guild.id
+        # Группы могут сбросить из потока БД между загрузкой и проверкой - тогда грузим снова
+        while not permissions.loaded(guild_id):
+            await self.run(permissions.groups, guild_id)
+        return permissions.is_admin(ctx)
+
+    async def transfer(self, from_user_id, to_user_id, guild_id, amount):
+        """Перевод с групповой фиксацией.
+
+        Переводы, пришедшие пока записывается предыдущая пачка, уходят в базу
+        следующей пачкой одной транзакцией. Возвращает True, если перевод прошел.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._transfers.append(((from_user_id, to_user_id, guild_id, amount), future))
+        if self._transfer_task is None or self._transfer_task.done():
+            self._transfer_task = asyncio.create_task(self._commit_transfers())
+        return await future
+
+    async def _commit_transfers(self):
+        while self._transfers:
+            batch = self._transfers[:TRANSFER_BATCH_SIZE]
+            del self._transfers[:TRANSFER_BATCH_SIZE]
+            
+            try:
+                results = await self.run(self.db.transfer_many, [transfer for transfer, future in batch])
+            except Exception as e:
+                for transfer, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (transfer, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def purge_guild(self, guild_id):
+        """Запустить фоновую очистку сервера (или вернуть уже идущую)"""
+        task = self._purges.get(guild_id)
+        if task is None or task.done():
+            task = self._purges[guild_id] = asyncio.create_task(self._purge_guild(guild_id))
+        return task
+
+    async def _purge_guild(self, guild_id):
+        started = time.perf_counter()
+        chunks = 0
+        try:
+            while True:
+                done, table, deleted = await self.run(self.db.purge_guild_chunk, guild_id)
+                if done:
+                    break
+                chunks += 1
+                if chunks % PURGE_REPORT_EVERY == 0:
+                    print(f"🧹 Очистка сервера {guild_id}: {table}, удалено строк: {deleted}")
+                # Между пачками даем записать остальным
+                await asyncio.sleep(PURGE_PAUSE)
+            
+            free_pages = await self.run(self.db.incremental_vacuum)
+            vacuum_info = f", освобождено страниц: {free_pages}" if free_pages else ""
+            print(f"✅ Данные сервера {guild_id} очищены: {deleted} строк за {time.perf_counter() - started:.1f} с{vacuum_info}")
+        except Exception as e:
+            print(f"❌ Ошибка очистки сервера {guild_id}: {e}")
+        finally:
+            self._purges.pop(guild_id, None)
+
+    async def wait_purge(self, guild_id):
+        task = self._purges.get(guild_id)
+        if task is not None:
+            await task
+
+    async def resume_purges(self):
+        """Продолжить очистки, прерванные перезапуском"""
+        for guild_id in await self.run(self.db.get_pending_purges):
+            self.purge_guild(guild_id)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
         
-        # Удаляем активные тикеты
-        cursor.execute('DELETE FROM active_tickets WHERE guild_id = ?', (guild_id,))
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
         
-        self.conn.commit()
\ No newline at end of file
+        method.__name__ = name
+        return method
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+_database = None
+_async_database = None
+_database_lock = threading.RLock()
+
+def get_database(path=DB_PATH, pool_size=DEFAULT_POOL_SIZE, profile=DEFAULT_STORAGE_PROFILE):
+    """Общий для всего процесса экземпляр Database.
+
+    Создается один раз при первом вызове (в bot.py при запуске), остальные
+    вызовы возвращают тот же объект, аргументы при этом игнорируются.
+    """
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database(path, pool_size, profile)
+    return _database
+
+def get_async_database(workers=DEFAULT_DB_WORKERS):
+    """Общий асинхронный фасад поверх get_database()"""
+    global _async_database
+    if _async_database is None:
+        with _database_lock:
+            if _async_database is None:
+                _async_database = AsyncDatabase(get_database(), workers)
+    return _async_database
\ No newline at end of file
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+# Сколько истекших записей обрабатывать за один проход
+EXPIRY_BATCH_SIZE = 100
+# Даже без новых записей просыпаться не реже раза в час
+EXPIRY_MAX_SLEEP = 3600
+# Пауза после неудачного прохода; удваивается до EXPIRY_MAX_RETRY_DELAY
+EXPIRY_RETRY_DELAY = 5
+EXPIRY_MAX_RETRY_DELAY = 300
+
+class ExpiryWorker:
+    """Обработчик истекающих записей.
+
+    Источник истины - таблица с индексом по времени истечения: в памяти
+    хранится только ближайший срок. Воркер спит до него, забирает из базы
+    все истекшие записи пачками (так же догоняет просроченное после простоя)
+    и передает их в process. notify() будит воркер, если появился более
+    ранний срок.
+    """
+    def __init__(self, name, next_expiry, fetch_due, process, batch_size=EXPIRY_BATCH_SIZE, clock=time.time):
+        self.name = name
+        self.next_expiry = next_expiry    # async () -> ближайший срок или None
+        self.fetch_due = fetch_due        # async (now, limit) -> строки, последний столбец - срок
+        self.process = process            # async (rows) -> обработать и удалить строки
+        self.batch_size = batch_size
+        self.clock = clock
+        self._wake_at = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.processed = 0
+        self.batches = 0
+        self.failed = 0
+        self.last_lag = 0
+        self.max_lag = 0
+        self.retry_delay = 0
+
+    def notify(self, expires_at):
+        """Сообщить о новой записи со сроком expires_at"""
+        if self._wake_at is None or expires_at < self._wake_at:
+            self._wake_at = expires_at
+            self._wakeup.set()
+
+    async def run_due(self):
+        """Обработать все истекшие записи. Возвращает их число"""
+        total = 0
+        while True:
+            now = self.clock()
+            try:
+                rows = await self.fetch_due(now, self.batch_size)
+                if not rows:
+                    break
+                
+                lag = max(0, now - rows[0][-1])
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                
+                await self.process(rows)
+            except Exception as e:
+                # Строки остались в базе - повторим после паузы, растущей с каждой неудачей
+                self.failed += 1
+                self.retry_delay = min(self.retry_delay * 2 or EXPIRY_RETRY_DELAY, EXPIRY_MAX_RETRY_DELAY)
+                print(f"❌ Ошибка обработки истекших записей ({self.name}), повтор через {self.retry_delay} с: {e}")
+                break
+            
+            self.retry_delay = 0
+            self.batches += 1
+            self.processed += len(rows)
+            total += len(rows)
+            if len(rows) < self.batch_size:
+                break
+        return total
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            await self.run_due()
+            
+            self._wake_at = await self.next_expiry()
+            timeout = EXPIRY_MAX_SLEEP
+            if self._wake_at is not None:
+                timeout = min(timeout, max(0, self._wake_at - self.clock()))
+            if self.retry_delay:
+                # Просроченные записи не дают уснуть - без паузы воркер крутился бы вхолостую
+                timeout = max(timeout, self.retry_delay)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, ready=None):
+        """Запустить воркер; ready - корутина, которую нужно дождаться перед первым проходом"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._start(ready))
+
+    async def _start(self, ready):
+        if ready is not None:
+            await ready
+        await self.run()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            f'{self.name}_processed': self.processed,
+            f'{self.name}_batches': self.batches,
+            f'{self.name}_failed': self.failed,
+            f'{self.name}_retry_delay': self.retry_delay,
+            f'{self.name}_last_lag': round(self.last_lag, 2),
+            f'{self.name}_max_lag': round(self.max_lag, 2),
+            f'{self.name}_next_in': round(self._wake_at - self.clock(), 1) if self._wake_at is not None else None
+        }
+
+async def gather_limited(coros, limit):
+    """Выполнить корутины параллельно, но не больше limit одновременно"""
+    semaphore = asyncio.Semaphore(limit)
+    
+    async def run(coro):
+        async with semaphore:
+            return await coro
+    
+    return await asyncio.gather(*(run(coro) for coro in coros), return_exceptions=True)
\ No newline at end of file
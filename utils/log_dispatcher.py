@@ -0,0 +1,134 @@
+import asyncio
+from collections import deque
+
+# Как часто очередь логов отправляется в каналы (мс)
+LOG_FLUSH_MS = 2000
+# Сколько логов держать в очереди одного канала; старые сверх лимита отбрасываются
+LOG_MAX_QUEUE = 500
+# Ограничения Discord на одно сообщение
+EMBEDS_PER_MESSAGE = 10
+EMBED_CHARS_PER_MESSAGE = 6000
+# Сколько однотипных событий за один сброс сворачивать в сводку
+COALESCE_THRESHOLD = 5
+
+class LogDispatcher:
+    """Очередь логов по каналам с пакетной отправкой.
+
+    Логи копятся в очереди канала и раз в LOG_FLUSH_MS уходят сообщениями
+    по 10 embed. События с общей группой (например, удаления в одном канале)
+    при всплеске сворачиваются в одну сводку через summarize(group, details).
+    """
+    def __init__(self, summarize=None, flush_ms=LOG_FLUSH_MS, max_queue=LOG_MAX_QUEUE):
+        self.summarize = summarize
+        self.flush_ms = flush_ms
+        self.max_queue = max_queue
+        self._queues = {}    # channel_id -> (channel, deque[(embed, group, detail)])
+        self._task = None
+        self.submitted = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.messages_sent = 0
+        self.embeds_sent = 0
+        self.send_errors = 0
+        self.max_depth = 0
+
+    def submit(self, channel, embed, group=None, detail=None):
+        entry = self._queues.get(channel.id)
+        if entry is None:
+            entry = self._queues[channel.id] = (channel, deque())
+        queue = entry[1]
+        
+        queue.append((embed, group, detail))
+        self.submitted += 1
+        if len(queue) > self.max_queue:
+            queue.popleft()
+            self.dropped += 1
+        self.max_depth = max(self.max_depth, len(queue))
+
+    def depth(self):
+        return sum(len(queue) for channel, queue in self._queues.values())
+
+    def _coalesce(self, items):
+        """Свернуть группы с большим числом событий в сводки, сохраняя порядок"""
+        if self.summarize is None:
+            return [embed for embed, group, detail in items]
+        
+        counts = {}
+        for embed, group, detail in items:
+            if group is not None:
+                counts[group] = counts.get(group, 0) + 1
+        
+        embeds = []
+        groups = {}
+        for embed, group, detail in items:
+            if group is None or counts[group] < COALESCE_THRESHOLD:
+                embeds.append(embed)
+                continue
+            details = groups.get(group)
+            if details is None:
+                # Сводка встает на место первого события группы
+                details = groups[group] = []
+                embeds.append((group, details))
+            details.append(detail)
+        
+        for i, embed in enumerate(embeds):
+            if isinstance(embed, tuple):
+                group, details = embed
+                embeds[i] = self.summarize(group, details)
+                self.coalesced += len(details) - 1
+        return embeds
+
+    def _pack(self, embeds):
+        """Разложить embed по сообщениям с учетом лимитов Discord"""
+        batch = []
+        size = 0
+        for embed in embeds:
+            length = len(embed)
+            if batch and (len(batch) == EMBEDS_PER_MESSAGE or size + length > EMBED_CHARS_PER_MESSAGE):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(embed)
+            size += length
+        if batch:
+            yield batch
+
+    async def _flush_channel(self, channel, items):
+        for batch in self._pack(self._coalesce(items)):
+            try:
+                await channel.send(embeds=batch)
+                self.messages_sent += 1
+                self.embeds_sent += len(batch)
+            except Exception:
+                self.send_errors += 1
+
+    async def flush(self):
+        queues, self._queues = self._queues, {}
+        await asyncio.gather(*(self._flush_channel(channel, list(queue)) for channel, queue in queues.values()))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_ms / 1000)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            'log_queue_depth': self.depth(),
+            'log_max_depth': self.max_depth,
+            'log_submitted': self.submitted,
+            'log_dropped': self.dropped,
+            'log_coalesced': self.coalesced,
+            'log_messages_sent': self.messages_sent,
+            'log_embeds_sent': self.embeds_sent,
+            'log_send_errors': self.send_errors
+        }
\ No newline at end of file
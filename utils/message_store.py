@@ -0,0 +1,275 @@
+import asyncio
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Сколько байт текста сообщений держать в памяти на один сервер
+MESSAGE_STORE_GUILD_BYTES = 2 * 1024 * 1024
+# Сколько секунд хранить сообщение (в памяти и в файле вытеснения)
+MESSAGE_RETENTION = 3 * 24 * 3600
+# Сколько вытесненных сообщений писать в файл за один раз
+SPILL_BATCH_SIZE = 500
+# Накладные расходы словаря на одну запись: узел OrderedDict и ключ
+ENTRY_OVERHEAD = 100
+
+class MessageRecord:
+    """Компактная запись сообщения: только то, что нужно логам"""
+    __slots__ = ('message_id', 'guild_id', 'channel_id', 'author_id', 'created_at', 'content')
+
+    def __init__(self, message_id, guild_id, channel_id, author_id, created_at, content):
+        self.message_id = message_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.created_at = created_at
+        self.content = content
+
+    def size(self):
+        """Оценка памяти записи в байтах"""
+        return RECORD_SIZE + sys.getsizeof(self.content)
+
+# Размер пустой записи вместе с ее числовыми полями
+RECORD_SIZE = (
+    sys.getsizeof(MessageRecord(0, 0, 0, 0, 0.0, ''))
+    + 4 * sys.getsizeof(2 ** 62) + sys.getsizeof(0.0)
+    + ENTRY_OVERHEAD
+)
+
+class MessageStore:
+    """Ограниченный кэш содержимого сообщений для логов удаления и изменения.
+
+    На каждый сервер отводится max_bytes памяти; при превышении вытесняются
+    давно не использованные сообщения (LRU). Если задан spill_path, вытесненные
+    сообщения пишутся в отдельный файл SQLite и находятся там до конца срока
+    хранения. Синхронные методы работают только с памятью.
+    """
+    def __init__(self, max_bytes=MESSAGE_STORE_GUILD_BYTES, retention=MESSAGE_RETENTION, spill_path=None, clock=time.time):
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.clock = clock
+        self._guilds = {}       # guild_id -> OrderedDict[message_id -> MessageRecord]
+        self._bytes = {}        # guild_id -> байт в памяти
+        self._pending = {}      # message_id -> MessageRecord, ждут записи в файл
+        self._dropped = set()   # серверы, чьи строки нужно удалить из файла
+        self._spill = None
+        self._spill_lock = threading.Lock()
+        if spill_path:
+            self._open_spill(spill_path)
+        self.stored = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+        self.spilled = 0
+        self.spill_hits = 0
+
+    def _open_spill(self, path):
+        # Файл вытеснения - только кэш: надежность записи не нужна
+        self._spill = sqlite3.connect(path, check_same_thread=False)
+        self._spill.execute('PRAGMA journal_mode=WAL')
+        self._spill.execute('PRAGMA synchronous=OFF')
+        self._spill.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id INTEGER PRIMARY KEY,
+                guild_id INTEGER,
+                channel_id INTEGER,
+                author_id INTEGER,
+                created_at REAL,
+                content TEXT
+            )
+        ''')
+        self._spill.execute('CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)')
+        self._spill.commit()
+
+    def add(self, message_id, guild_id, channel_id, author_id, content, created_at=None):
+        records = self._guilds.get(guild_id)
+        if records is None:
+            records = self._guilds[guild_id] = OrderedDict()
+            self._bytes[guild_id] = 0
+
+        old = records.pop(message_id, None)
+        if old is not None:
+            self._bytes[guild_id] -= old.size()
+
+        record = MessageRecord(message_id, guild_id, channel_id, author_id,
+                               created_at if created_at is not None else self.clock(), content)
+        records[message_id] = record
+        self._bytes[guild_id] += record.size()
+        self.stored += 1
+        self._evict(guild_id)
+        return record
+
+    def _evict(self, guild_id):
+        records = self._guilds[guild_id]
+        while self._bytes[guild_id] > self.max_bytes and records:
+            message_id, record = records.popitem(last=False)
+            self._bytes[guild_id] -= record.size()
+            self.evicted += 1
+            if self._spill is not None:
+                self._pending[message_id] = record
+
+    def _take(self, guild_id, message_id, remove):
+        records = self._guilds.get(guild_id)
+        record = records.get(message_id) if records else None
+        if record is not None:
+            if remove:
+                del records[message_id]
+                self._bytes[guild_id] -= record.size()
+            else:
+                records.move_to_end(message_id)
+            return record
+
+        # flush_spill забирает записи из другого потока - только атомарный pop
+        if remove:
+            return self._pending.pop(message_id, None)
+        return self._pending.get(message_id)
+
+    async def lookup(self, guild_id, message_id, remove=False):
+        """Запись из памяти или файла вытеснения; remove - забрать ее из кэша"""
+        record = self._take(guild_id, message_id, remove)
+        if record is None and self._spill is not None:
+            record = await asyncio.to_thread(self._spill_get, message_id, remove)
+            if record is not None:
+                self.spill_hits += 1
+
+        if record is None or record.guild_id in self._dropped or self.clock() - record.created_at > self.retention:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record
+
+    async def pop(self, guild_id, message_id):
+        return await self.lookup(guild_id, message_id, remove=True)
+
+    def _forget(self, guild_id):
+        self._guilds.pop(guild_id, None)
+        self._bytes.pop(guild_id, None)
+
+    def drop_guild(self, guild_id):
+        """Забыть все сообщения сервера; строки в файле удалит следующий flush_spill"""
+        self._forget(guild_id)
+        for message_id, record in list(self._pending.items()):
+            if record.guild_id == guild_id:
+                self._pending.pop(message_id, None)
+        if self._spill is not None:
+            self._dropped.add(guild_id)
+
+    def prune(self):
+        """Удалить из памяти сообщения старше срока хранения"""
+        cutoff = self.clock() - self.retention
+        for guild_id, records in self._guilds.items():
+            stale = [message_id for message_id, record in records.items() if record.created_at < cutoff]
+            for message_id in stale:
+                self._bytes[guild_id] -= records.pop(message_id).size()
+            self.expired += len(stale)
+
+        # list() снимает копию сразу: flush_spill в это время может забирать записи
+        for message_id, record in list(self._pending.items()):
+            if record.created_at < cutoff:
+                self._pending.pop(message_id, None)
+
+        # Пустые серверы не держим
+        for guild_id in [guild_id for guild_id, records in self._guilds.items() if not records]:
+            self._forget(guild_id)
+        return cutoff
+
+    def _spill_get(self, message_id, remove):
+        with self._spill_lock:
+            row = self._spill.execute(
+                'SELECT message_id, guild_id, channel_id, author_id, created_at, content FROM messages WHERE message_id = ?',
+                (message_id,)
+            ).fetchone()
+            if row and remove:
+                self._spill.execute('DELETE FROM messages WHERE message_id = ?', (message_id,))
+                self._spill.commit()
+        return MessageRecord(*row) if row else None
+
+    def flush_spill(self, cutoff=None):
+        """Записать вытесненные сообщения в файл и удалить устаревшие (вызывать не из event loop)"""
+        if self._spill is None:
+            return 0
+
+        written = 0
+        while self._pending:
+            batch = []
+            for message_id in list(self._pending)[:SPILL_BATCH_SIZE]:
+                # Событие в event loop могло уже забрать запись
+                record = self._pending.pop(message_id, None)
+                if record is None:
+                    continue
+                batch.append((record.message_id, record.guild_id, record.channel_id,
+                              record.author_id, record.created_at, record.content))
+            with self._spill_lock:
+                self._spill.executemany('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)', batch)
+                self._spill.commit()
+            written += len(batch)
+
+        if cutoff is not None:
+            with self._spill_lock:
+                self._spill.execute('DELETE FROM messages WHERE created_at < ?', (cutoff,))
+                self._spill.commit()
+
+        # После записи пачек: строки ушедшего сервера, забранные выше до drop_guild, тоже удалятся
+        dropped = list(self._dropped)
+        if dropped:
+            with self._spill_lock:
+                self._spill.executemany('DELETE FROM messages WHERE guild_id = ?', [(guild_id,) for guild_id in dropped])
+                self._spill.commit()
+            self._dropped.difference_update(dropped)
+        self.spilled += written
+        return written
+
+    async def maintain(self):
+        """Периодическое обслуживание: срок хранения в памяти и запись в файл"""
+        cutoff = self.prune()
+        if self._spill is not None:
+            await asyncio.to_thread(self.flush_spill, cutoff)
+
+    def close(self):
+        if self._spill is not None:
+            self.flush_spill()
+            self._spill.close()
+            self._spill = None
+
+    def stats(self):
+        messages = sum(len(records) for records in self._guilds.values())
+        total = sum(self._bytes.values())
+        return {
+            'message_store_messages': messages,
+            'message_store_bytes': total,
+            'message_store_bytes_per_message': total // messages if messages else 0,
+            'message_store_guilds': len(self._guilds),
+            'message_store_hits': self.hits,
+            'message_store_misses': self.misses,
+            'message_store_evicted': self.evicted,
+            'message_store_expired': self.expired,
+            'message_store_spilled': self.spilled,
+            'message_store_spill_hits': self.spill_hits,
+            'message_store_spill_pending': len(self._pending)
+        }
+
+def _measure(messages=100_000, guilds=10):
+    """Сравнение оценки памяти с реальной (tracemalloc)"""
+    import random
+    import tracemalloc
+
+    words = ['привет', 'как', 'дела', 'hello', 'бот', 'сервер', 'сегодня', 'игра', '👍', 'ok']
+    texts = [' '.join(random.choice(words) for _ in range(random.randint(1, 20))) for _ in range(1000)]
+    store = MessageStore(max_bytes=1 << 40)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for message_id in range(messages):
+        store.add(10 ** 17 + message_id, message_id % guilds, 10 ** 17, 10 ** 17 + message_id % 500, texts[message_id % len(texts)][:] + ' ')
+    actual = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    stats = store.stats()
+    print(f"📦 {messages} сообщений: оценка {stats['message_store_bytes_per_message']} байт/сообщение, "
+          f"tracemalloc {actual // messages} байт/сообщение")
+
+if __name__ == '__main__':
+    # Замер памяти: python -m utils.message_store
+    _measure()
\ No newline at end of file
@@ -0,0 +1,348 @@
+from utils.queries import HOT_QUERIES
+
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция - номер,
+# описание и список SQL-запросов; применяются по порядку, каждая в своей транзакции.
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        # Основная таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER,
+            guild_id INTEGER,
+            balance INTEGER DEFAULT 0,
+            xp INTEGER DEFAULT 0,
+            level INTEGER DEFAULT 1,
+            warnings INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id)
+        )
+        ''',
+        # Множители ролей
+        '''
+        CREATE TABLE IF NOT EXISTS role_multipliers (
+            role_id INTEGER PRIMARY KEY,
+            economy_multiplier REAL DEFAULT 1.0,
+            xp_multiplier REAL DEFAULT 1.0
+        )
+        ''',
+        # Настройки серверов
+        '''
+        CREATE TABLE IF NOT EXISTS server_settings (
+            guild_id INTEGER PRIMARY KEY,
+            work_reward_min INTEGER DEFAULT 10,
+            work_reward_max INTEGER DEFAULT 50,
+            work_cooldown INTEGER DEFAULT 3600,
+            xp_per_message INTEGER DEFAULT 5,
+            xp_per_voice_minute INTEGER DEFAULT 2,
+            slot_min_bet INTEGER DEFAULT 1,
+            slot_max_bet INTEGER DEFAULT 1000,
+            prefix TEXT DEFAULT '!',
+            logs_enabled BOOLEAN DEFAULT 0,
+            log_channel_id INTEGER DEFAULT NULL
+        )
+        ''',
+        # Кулдауны
+        '''
+        CREATE TABLE IF NOT EXISTS cooldowns (
+            user_id INTEGER,
+            guild_id INTEGER,
+            command TEXT,
+            last_used INTEGER,
+            PRIMARY KEY (user_id, guild_id, command)
+        )
+        ''',
+        # Права команд
+        '''
+        CREATE TABLE IF NOT EXISTS command_permissions (
+            guild_id INTEGER,
+            role_group TEXT,
+            command_name TEXT,
+            PRIMARY KEY (guild_id, role_group, command_name)
+        )
+        ''',
+        # Назначения ролей
+        '''
+        CREATE TABLE IF NOT EXISTS role_assignments (
+            guild_id INTEGER,
+            role_group TEXT,
+            role_id INTEGER,
+            PRIMARY KEY (guild_id, role_group, role_id)
+        )
+        ''',
+        # Розыгрыши
+        '''
+        CREATE TABLE IF NOT EXISTS giveaways (
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            channel_id INTEGER,
+            prize TEXT,
+            winners_count INTEGER,
+            end_time INTEGER,
+            ended BOOLEAN DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS giveaway_entries (
+            message_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (message_id, user_id)
+        )
+        ''',
+        # Магазин
+        '''
+        CREATE TABLE IF NOT EXISTS shop_items (
+            item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            name TEXT,
+            description TEXT,
+            price INTEGER,
+            item_type TEXT,
+            role_id INTEGER DEFAULT NULL,
+            duration INTEGER DEFAULT 0,
+            max_purchases INTEGER DEFAULT -1,
+            created_at INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_inventory (
+            user_id INTEGER,
+            guild_id INTEGER,
+            item_id INTEGER,
+            purchase_time INTEGER,
+            expires_at INTEGER DEFAULT NULL,
+            PRIMARY KEY (user_id, guild_id, item_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS item_purchases (
+            user_id INTEGER,
+            guild_id INTEGER,
+            item_id INTEGER,
+            purchase_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, guild_id, item_id)
+        )
+        ''',
+        # Торговая площадка
+        '''
+        CREATE TABLE IF NOT EXISTS marketplace (
+            listing_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seller_id INTEGER,
+            guild_id INTEGER,
+            item_id INTEGER,
+            price INTEGER,
+            created_at INTEGER,
+            status TEXT DEFAULT 'active'
+        )
+        ''',
+        # Транзакции
+        '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER,
+            to_user_id INTEGER,
+            guild_id INTEGER,
+            item_id INTEGER,
+            amount INTEGER,
+            transaction_type TEXT,
+            created_at INTEGER
+        )
+        ''',
+        # Награды за уровни
+        '''
+        CREATE TABLE IF NOT EXISTS level_rewards (
+            guild_id INTEGER,
+            level INTEGER,
+            reward_type TEXT,
+            role_id INTEGER DEFAULT NULL,
+            currency_amount INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, level)
+        )
+        ''',
+        # Тикет-группы
+        '''
+        CREATE TABLE IF NOT EXISTS ticket_groups (
+            guild_id INTEGER,
+            group_type TEXT,
+            role_id INTEGER,
+            PRIMARY KEY (guild_id, group_type)
+        )
+        ''',
+        # Активные тикеты
+        '''
+        CREATE TABLE IF NOT EXISTS active_tickets (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            user_id INTEGER,
+            ticket_type TEXT,
+            created_at INTEGER
+        )
+        '''
+    ]),
+    (2, 'Индексы для лидербордов, транзакций, истечения предметов, площадки и розыгрышей', [
+        # Лидерборды: сортировка по индексу внутри сервера без прохода по всем строкам
+        'CREATE INDEX IF NOT EXISTS idx_users_guild_balance ON users (guild_id, balance DESC, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_users_guild_level ON users (guild_id, level DESC, xp DESC, user_id)',
+        
+        # История транзакций: отдельные индексы для отправителя и получателя (OR по двум индексам)
+        'CREATE INDEX IF NOT EXISTS idx_transactions_from ON transactions (from_user_id, guild_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_transactions_to ON transactions (to_user_id, guild_id, created_at)',
+        
+        # Истекающие предметы: частичный индекс только по строкам со сроком действия
+        'CREATE INDEX IF NOT EXISTS idx_inventory_expires ON user_inventory (expires_at) WHERE expires_at IS NOT NULL',
+        
+        # Торговая площадка
+        'CREATE INDEX IF NOT EXISTS idx_marketplace_guild_status ON marketplace (guild_id, status, created_at)',
+        
+        # Розыгрыши: поиск завершившихся и список активных на сервере
+        'CREATE INDEX IF NOT EXISTS idx_giveaways_pending ON giveaways (ended, end_time)',
+        'CREATE INDEX IF NOT EXISTS idx_giveaways_guild ON giveaways (guild_id, ended, end_time)'
+    ]),
+    (3, 'Отложенные задачи планировщика', [
+        '''
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            job_id TEXT PRIMARY KEY,
+            kind TEXT,
+            due_at REAL,
+            payload TEXT
+        )
+        '''
+    ]),
+    (4, 'Активные муты', [
+        '''
+        CREATE TABLE IF NOT EXISTS mutes (
+            guild_id INTEGER,
+            user_id INTEGER,
+            role_id INTEGER,
+            expires_at REAL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_mutes_expires ON mutes (expires_at)'
+    ]),
+    (5, 'Открытые голосовые сессии', [
+        '''
+        CREATE TABLE IF NOT EXISTS voice_sessions (
+            guild_id INTEGER,
+            user_id INTEGER,
+            started_at REAL,
+            credited_at REAL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+        '''
+    ]),
+    (6, 'Фоновая очистка серверов', [
+        # Состояние очистки: с какой таблицы продолжить после перезапуска
+        '''
+        CREATE TABLE IF NOT EXISTS guild_purges (
+            guild_id INTEGER PRIMARY KEY,
+            started_at INTEGER,
+            table_index INTEGER DEFAULT 0,
+            rows_deleted INTEGER DEFAULT 0
+        )
+        ''',
+        # Удаление пачками по guild_id без прохода по всей таблице
+        'CREATE INDEX IF NOT EXISTS idx_transactions_guild ON transactions (guild_id)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_guild ON user_inventory (guild_id)',
+        'CREATE INDEX IF NOT EXISTS idx_item_purchases_guild ON item_purchases (guild_id)',
+        'CREATE INDEX IF NOT EXISTS idx_cooldowns_guild ON cooldowns (guild_id)',
+        'CREATE INDEX IF NOT EXISTS idx_shop_items_guild ON shop_items (guild_id, price)'
+    ]),
+    (7, 'Архив историй тикетов', [
+        # Сама история лежит в сжатом файле, здесь - только индекс
+        '''
+        CREATE TABLE IF NOT EXISTS ticket_transcripts (
+            channel_id INTEGER PRIMARY KEY,
+            guild_id INTEGER,
+            user_id INTEGER,
+            ticket_type TEXT,
+            created_at INTEGER,
+            closed_at INTEGER,
+            closed_by INTEGER,
+            message_count INTEGER,
+            size_bytes INTEGER,
+            path TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ticket_transcripts_guild ON ticket_transcripts (guild_id, closed_at)'
+    ]),
+    (8, 'Обход участников сервера по user_id', [
+        # Пересчет уровней читает сервер пачками: guild_id = ? AND user_id > ?
+        'CREATE INDEX IF NOT EXISTS idx_users_guild_user ON users (guild_id, user_id)'
+    ]),
+    (9, 'Счетчик попыток снять мут', [
+        'ALTER TABLE mutes ADD COLUMN attempts INTEGER DEFAULT 0'
+    ]),
+    (10, 'Постепенное сжатие файла базы', [
+        # Режим меняется только полной пересборкой файла: VACUUM один раз,
+        # дальше очистка сервера возвращает место через PRAGMA incremental_vacuum
+        'PRAGMA auto_vacuum = INCREMENTAL',
+        'VACUUM'
+    ]),
+    (11, 'Сервер отложенной задачи', [
+        # Очистка сервера удаляет и его задачи планировщика
+        'ALTER TABLE scheduled_jobs ADD COLUMN guild_id INTEGER',
+        '''
+        UPDATE scheduled_jobs SET guild_id = (
+            SELECT guild_id FROM giveaways WHERE 'giveaway:' || giveaways.message_id = scheduled_jobs.job_id
+        ) WHERE kind = 'giveaway_end'
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_guild ON scheduled_jobs (guild_id)'
+    ]),
+    (12, 'Счетчик попыток снять роль истекшего предмета', [
+        'ALTER TABLE user_inventory ADD COLUMN attempts INTEGER DEFAULT 0'
+    ]),
+    (13, 'Тикеты сервера по индексу', [
+        # Список тикетов и очистка сервера читали active_tickets целиком
+        'CREATE INDEX IF NOT EXISTS idx_active_tickets_guild ON active_tickets (guild_id, user_id)'
+    ])
+]
+
+# Команды, которые SQLite не выполняет внутри транзакции
+NO_TRANSACTION = ('VACUUM',)
+
+def migrate(conn):
+    """Применить недостающие миграции. Возвращает список примененных версий"""
+    current = conn.execute('PRAGMA user_version').fetchone()[0]
+    applied = []
+    
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        if any(statement in NO_TRANSACTION for statement in statements):
+            # Такие миграции идемпотентны: при сбое просто повторятся
+            print(f"🗄️ Миграция {version} ({description}) пересобирает файл базы, это может занять время...")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            print(f"🗄️ Применена миграция {version}: {description}")
+            applied.append(version)
+            continue
+        
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        print(f"🗄️ Применена миграция {version}: {description}")
+        applied.append(version)
+    
+    return applied
+
+def check_query_plans(conn):
+    """Найти горячие запросы, которые читают таблицу целиком.
+
+    Возвращает список (название запроса, строка плана) для каждого полного скана.
+    """
+    problems = []
+    for name, query, params in HOT_QUERIES:
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params):
+            detail = row[3]
+            if detail.startswith('SCAN ') and 'INDEX' not in detail:
+                problems.append((name, detail))
+    return problems
\ No newline at end of file
@@ -0,0 +1,113 @@
+import threading
+
+# Группы ролей с доступом к командам администрирования
+ADMIN_GROUPS = ('admin', 'high_admin', 'owner')
+
+def actor(ctx):
+    """Участник, вызвавший команду: ctx.author у команд, .user у взаимодействий"""
+    return getattr(ctx, 'author', None) or ctx.user
+
+class PermissionResolver:
+    """Группы ролей серверов в памяти.
+
+    Назначения сервера загружаются из базы одним запросом при первой проверке
+    и сбрасываются при изменении. Для каждого набора групп хранится готовое
+    множество ролей, поэтому проверка участника - одно пересечение множеств.
+    """
+    def __init__(self, load_rows):
+        self.load_rows = load_rows    # guild_id -> строки (role_group, role_id)
+        self._groups = {}             # guild_id -> {role_group: frozenset(role_id)}
+        self._unions = {}             # (guild_id, groups) -> frozenset(role_id)
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.checks = 0
+        self.invalidations = 0
+
+    def groups(self, guild_id):
+        with self._lock:
+            groups = self._groups.get(guild_id)
+            if groups is None:
+                collected = {}
+                for role_group, role_id in self.load_rows(guild_id):
+                    collected.setdefault(role_group, set()).add(role_id)
+                groups = self._groups[guild_id] = {group: frozenset(roles) for group, roles in collected.items()}
+                self.loads += 1
+            return groups
+
+    def loaded(self, guild_id):
+        """Загружены ли группы сервера (проверка без запроса к базе)"""
+        return guild_id in self._groups
+
+    def roles(self, guild_id, groups=ADMIN_GROUPS):
+        """Все роли, входящие в любую из групп"""
+        key = (guild_id, groups)
+        roles = self._unions.get(key)
+        if roles is None:
+            with self._lock:
+                guild_groups = self.groups(guild_id)
+                roles = self._unions[key] = frozenset().union(*(guild_groups.get(group, ()) for group in groups))
+        return roles
+
+    def member_in(self, member, groups=ADMIN_GROUPS):
+        """Есть ли у участника роль хотя бы одной из групп"""
+        self.checks += 1
+        roles = self.roles(member.guild.id, groups)
+        return bool(roles) and not roles.isdisjoint(role.id for role in member.roles)
+
+    def is_admin(self, ctx):
+        """Роль из групп администрации или право управления сервером"""
+        member = actor(ctx)
+        return self.member_in(member) or member.guild_permissions.manage_guild
+
+    def invalidate(self, guild_id):
+        with self._lock:
+            self._groups.pop(guild_id, None)
+            for key in [key for key in self._unions if key[0] == guild_id]:
+                del self._unions[key]
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            'permission_guilds': len(self._groups),
+            'permission_loads': self.loads,
+            'permission_checks': self.checks,
+            'permission_invalidations': self.invalidations
+        }
+
+def _benchmark(admin_roles=500, member_roles=50, checks=100_000):
+    import random
+    import time
+    from types import SimpleNamespace
+
+    guild = SimpleNamespace(id=1)
+    rows = [(random.choice(ADMIN_GROUPS), 10 ** 17 + role_id) for role_id in range(admin_roles)]
+    # Участник без ролей администрации - худший случай для обоих способов
+    member = SimpleNamespace(guild=guild, roles=[SimpleNamespace(id=2 * 10 ** 17 + role_id) for role_id in range(member_roles)])
+
+    def old_check():
+        admin_role_ids = []
+        for group in ADMIN_GROUPS:
+            admin_role_ids.extend(role_id for role_group, role_id in rows if role_group == group)
+        user_roles = [role.id for role in member.roles]
+        return any(role_id in user_roles for role_id in admin_role_ids)
+
+    resolver = PermissionResolver(lambda guild_id: rows)
+    assert resolver.member_in(member) == old_check()
+
+    started = time.perf_counter()
+    for _ in range(checks // 100):
+        old_check()
+    old_rate = (checks // 100) / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(checks):
+        resolver.member_in(member)
+    new_rate = checks / (time.perf_counter() - started)
+
+    print(f"🔐 {admin_roles} ролей администрации, {member_roles} ролей у участника:")
+    print(f"   перебор списков (без учета SQL): {old_rate:,.0f} проверок/с")
+    print(f"   пересечение множеств: {new_rate:,.0f} проверок/с (x{new_rate / old_rate:,.0f})")
+
+if __name__ == '__main__':
+    # Бенчмарк проверки прав: python -m utils.permissions
+    _benchmark()
\ No newline at end of file
@@ -0,0 +1,74 @@
+DEFAULT_PREFIX = '!'
+
+class PrefixResolver:
+    """Префиксы команд серверов в памяти.
+
+    Все префиксы загружаются из базы одним запросом и обновляются при смене
+    настройки, поэтому разбор сообщения - один поиск в словаре без обращения
+    к базе. Для серверов без записи действует префикс по умолчанию.
+    """
+    __slots__ = ('default', '_prefixes', 'updates')
+
+    def __init__(self, default=DEFAULT_PREFIX):
+        self.default = default
+        self._prefixes = {}
+        self.updates = 0
+
+    def load(self, rows):
+        """Массовая загрузка пар (guild_id, prefix)"""
+        self._prefixes = {guild_id: prefix for guild_id, prefix in rows if prefix and prefix != self.default}
+
+    def set(self, guild_id, prefix):
+        # Храним только нестандартные префиксы - словарь остается маленьким
+        if prefix and prefix != self.default:
+            self._prefixes[guild_id] = prefix
+        else:
+            self._prefixes.pop(guild_id, None)
+        self.updates += 1
+
+    def drop(self, guild_id):
+        self._prefixes.pop(guild_id, None)
+
+    def get(self, guild_id):
+        return self._prefixes.get(guild_id, self.default)
+
+    def matches(self, guild_id, content):
+        """Может ли сообщение быть командой (startswith не создает новых объектов)"""
+        return content.startswith(self._prefixes.get(guild_id, self.default))
+
+    def stats(self):
+        return {
+            'prefix_custom_guilds': len(self._prefixes),
+            'prefix_updates': self.updates
+        }
+
+def _benchmark(guilds=10_000, messages=1_000_000):
+    import random
+    import time
+    
+    resolver = PrefixResolver()
+    resolver.load((guild_id, random.choice(['!', '?', '$', 'bot.'])) for guild_id in range(guilds))
+    
+    # Большинство сообщений - обычный текст, примерно каждое двадцатое - команда
+    stream = []
+    for _ in range(10_000):
+        guild_id = random.randrange(guilds)
+        if random.random() < 0.05:
+            stream.append((guild_id, resolver.get(guild_id) + 'balance'))
+        else:
+            stream.append((guild_id, 'привет, как дела?'))
+    stream = stream * (messages // len(stream))
+    
+    matches = resolver.matches
+    started = time.perf_counter()
+    commands = 0
+    for guild_id, content in stream:
+        if matches(guild_id, content):
+            commands += 1
+    elapsed = time.perf_counter() - started
+    
+    print(f"⚡ {len(stream) / elapsed:,.0f} сообщений/с через разбор префикса ({commands} команд из {len(stream)})")
+
+if __name__ == '__main__':
+    # Бенчмарк разбора префиксов: python -m utils.prefixes
+    _benchmark()
\ No newline at end of file
@@ -0,0 +1,76 @@
+# Горячие запросы базы. Database выполняет именно эти строки, а проверка
+# планов (tests/test_query_plans.py) прогоняет их же через EXPLAIN QUERY PLAN
+
+# Таблицы с данными сервера в порядке очистки. Новые таблицы - только в конец:
+# номер текущей таблицы хранится в guild_purges
+GUILD_TABLES = [
+    'users', 'server_settings', 'cooldowns', 'command_permissions', 'role_assignments',
+    'shop_items', 'user_inventory', 'item_purchases', 'marketplace', 'transactions',
+    'level_rewards', 'ticket_groups', 'active_tickets', 'mutes', 'voice_sessions',
+    'ticket_transcripts', 'scheduled_jobs', 'giveaway_entries', 'giveaways'
+]
+# Условие отбора строк сервера для таблиц без guild_id (по умолчанию guild_id = ?)
+GUILD_TABLE_FILTERS = {
+    # Участники розыгрышей удаляются раньше самих розыгрышей
+    'giveaway_entries': 'message_id IN (SELECT message_id FROM giveaways WHERE guild_id = ?)'
+}
+
+def purge_select(table):
+    """Пачка строк сервера в таблице: (guild_id, размер пачки) -> rowid"""
+    return f'SELECT rowid FROM {table} WHERE {GUILD_TABLE_FILTERS.get(table, "guild_id = ?")} LIMIT ?'
+
+LOAD_RANKING_ROWS = 'SELECT user_id, balance, level, xp FROM users WHERE guild_id = ?'
+
+LOAD_ROLE_GROUPS = 'SELECT role_group, role_id FROM role_assignments WHERE guild_id = ?'
+
+RECOMPUTE_LEVELS_CHUNK = 'SELECT user_id, xp, level FROM users WHERE guild_id = ? AND user_id > ? ORDER BY user_id LIMIT ?'
+
+GET_USER_TRANSACTIONS = '''
+    SELECT * FROM transactions 
+    WHERE (from_user_id = ? OR to_user_id = ?) AND guild_id = ?
+    ORDER BY created_at DESC 
+    LIMIT ?
+'''
+
+GET_SHOP_ITEMS = 'SELECT * FROM shop_items WHERE guild_id = ? ORDER BY price ASC'
+
+GET_DUE_ITEMS = '''
+    SELECT ui.user_id, ui.guild_id, ui.item_id, si.name, si.item_type, si.role_id, ui.expires_at
+    FROM user_inventory ui
+    LEFT JOIN shop_items si ON ui.item_id = si.item_id
+    WHERE ui.expires_at IS NOT NULL AND ui.expires_at <= ?
+    ORDER BY ui.expires_at LIMIT ?
+'''
+
+GET_MARKET_LISTINGS = '''
+    SELECT m.*, si.name, si.description, si.item_type, u.balance as seller_balance
+    FROM marketplace m
+    JOIN shop_items si ON m.item_id = si.item_id
+    JOIN users u ON m.seller_id = u.user_id AND m.guild_id = u.guild_id
+    WHERE m.guild_id = ? AND m.status = ?
+    ORDER BY m.created_at DESC
+'''
+
+GET_DUE_MUTES = 'SELECT guild_id, user_id, role_id, expires_at FROM mutes WHERE expires_at <= ? ORDER BY expires_at LIMIT ?'
+
+GET_GUILD_GIVEAWAYS = 'SELECT * FROM giveaways WHERE guild_id = ? AND ended = 0 ORDER BY end_time ASC'
+
+GET_GUILD_TICKETS = 'SELECT * FROM active_tickets WHERE guild_id = ?'
+
+GET_TICKET_TRANSCRIPTS = 'SELECT * FROM ticket_transcripts WHERE guild_id = ? ORDER BY closed_at DESC LIMIT ?'
+
+# Запросы, которые не должны читать таблицу целиком.
+# (название, SQL, параметры для EXPLAIN QUERY PLAN)
+HOT_QUERIES = [
+    ('load_ranking_rows', LOAD_RANKING_ROWS, (0,)),
+    ('load_role_groups', LOAD_ROLE_GROUPS, (0,)),
+    ('recompute_levels', RECOMPUTE_LEVELS_CHUNK, (0, 0, 5000)),
+    ('get_user_transactions', GET_USER_TRANSACTIONS, (0, 0, 0, 10)),
+    ('get_shop_items', GET_SHOP_ITEMS, (0,)),
+    ('get_due_items', GET_DUE_ITEMS, (0, 100)),
+    ('get_market_listings', GET_MARKET_LISTINGS, (0, 'active')),
+    ('get_due_mutes', GET_DUE_MUTES, (0, 100)),
+    ('get_guild_giveaways', GET_GUILD_GIVEAWAYS, (0,)),
+    ('get_all_tickets', GET_GUILD_TICKETS, (0,)),
+    ('get_ticket_transcripts', GET_TICKET_TRANSCRIPTS, (0, 10))
+] + [(f'purge_{table}', purge_select(table), (0, 2000)) for table in GUILD_TABLES]
\ No newline at end of file
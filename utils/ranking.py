@@ -0,0 +1,280 @@
+import threading
+from bisect import bisect_left, insort
+
+# Размер корзины упорядоченного списка
+RANK_BUCKET_SIZE = 512
+
+class RankIndex:
+    """Упорядоченный набор ключей с доступом по позиции.
+
+    Ключи лежат в отсортированных корзинах ограниченного размера, а дерево
+    Фенвика над размерами корзин дает позицию ключа и ключ по позиции
+    за O(log n). Вставка и удаление - бинарный поиск плюс сдвиг внутри одной
+    корзины.
+    """
+    def __init__(self, keys=(), load=RANK_BUCKET_SIZE):
+        self._load = load
+        keys = sorted(keys)
+        self._buckets = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+        self._rebuild_tree()
+
+    def __len__(self):
+        return self._len
+
+    def _rebuild_tree(self):
+        count = len(self._buckets)
+        tree = [0] * (count + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent <= count:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, bucket_index, delta):
+        i = bucket_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket_index):
+        """Сколько ключей в корзинах до bucket_index"""
+        total = 0
+        i = bucket_index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position):
+        """Номер корзины и смещение в ней для позиции position"""
+        count = len(self._buckets)
+        index = 0
+        step = 1 << count.bit_length()
+        while step:
+            next_index = index + step
+            if next_index <= count and self._tree[next_index] <= position:
+                index = next_index
+                position -= self._tree[next_index]
+            step >>= 1
+        return index, position
+
+    def add(self, key):
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._rebuild_tree()
+            return
+        
+        i = bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            i -= 1
+        bucket = self._buckets[i]
+        insort(bucket, key)
+        self._maxes[i] = bucket[-1]
+        self._len += 1
+        
+        if len(bucket) > self._load * 2:
+            # Делим переполненную корзину, дерево перестраивается целиком
+            self._buckets[i:i + 1] = [bucket[:self._load], bucket[self._load:]]
+            self._maxes[i:i + 1] = [bucket[self._load - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            return False
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return False
+        
+        del bucket[j]
+        self._len -= 1
+        if bucket:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+        else:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+        return True
+
+    def index(self, key):
+        """Сколько ключей меньше key"""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            return self._len
+        return self._prefix(i) + bisect_left(self._buckets[i], key)
+
+    def slice(self, start, stop):
+        """Ключи с позиции start до stop (не включая)"""
+        start = max(0, start)
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        
+        i, offset = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            bucket = self._buckets[i]
+            result.extend(bucket[offset:offset + stop - start - len(result)])
+            i += 1
+            offset = 0
+        return result
+
+class GuildRanking:
+    """Рейтинги одного сервера: по балансу и по (уровень, опыт)"""
+    def __init__(self, rows):
+        self._balance_keys = {}
+        self._level_keys = {}
+        for user_id, balance, level, xp in rows:
+            self._balance_keys[user_id] = (-balance, user_id)
+            self._level_keys[user_id] = (-level, -xp, user_id)
+        self.by_balance = RankIndex(self._balance_keys.values())
+        self.by_level = RankIndex(self._level_keys.values())
+
+    def update(self, user_id, balance, level, xp):
+        self.remove(user_id)
+        self._balance_keys[user_id] = key = (-balance, user_id)
+        self.by_balance.add(key)
+        self._level_keys[user_id] = key = (-level, -xp, user_id)
+        self.by_level.add(key)
+
+    def remove(self, user_id):
+        key = self._balance_keys.pop(user_id, None)
+        if key is not None:
+            self.by_balance.remove(key)
+        key = self._level_keys.pop(user_id, None)
+        if key is not None:
+            self.by_level.remove(key)
+
+    def top_balance(self, limit):
+        return [(user_id, -balance) for balance, user_id in self.by_balance.slice(0, limit)]
+
+    def top_level(self, limit):
+        return [(user_id, -level, -xp) for level, xp, user_id in self.by_level.slice(0, limit)]
+
+    def balance_rank(self, user_id):
+        """Место пользователя по балансу (с 1) или None"""
+        key = self._balance_keys.get(user_id)
+        return self.by_balance.index(key) + 1 if key is not None else None
+
+    def level_rank(self, user_id):
+        key = self._level_keys.get(user_id)
+        return self.by_level.index(key) + 1 if key is not None else None
+
+    def level_around(self, user_id, radius):
+        """Соседи пользователя по уровню: список (место, user_id, level, xp)"""
+        rank = self.level_rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        keys = self.by_level.slice(start, rank + radius)
+        return [(start + i + 1, user, -level, -xp) for i, (level, xp, user) in enumerate(keys)]
+
+    def balance_around(self, user_id, radius):
+        rank = self.balance_rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        keys = self.by_balance.slice(start, rank + radius)
+        return [(start + i + 1, user, -balance) for i, (balance, user) in enumerate(keys)]
+
+    def __len__(self):
+        return len(self._balance_keys)
+
+class Rankings:
+    """Рейтинги всех серверов; сервер загружается из базы при первом запросе"""
+    def __init__(self, load_rows):
+        self.load_rows = load_rows    # guild_id -> строки (user_id, balance, level, xp)
+        self._guilds = {}
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.updates = 0
+
+    def guild(self, guild_id):
+        with self._lock:
+            ranking = self._guilds.get(guild_id)
+            if ranking is None:
+                ranking = self._guilds[guild_id] = GuildRanking(self.load_rows(guild_id))
+                self.loads += 1
+            return ranking
+
+    def read(self, guild_id, reader):
+        """reader(рейтинг сервера) под блокировкой.
+
+        touch меняет рейтинги из потоков БД, а чтение корзин посреди
+        вставки или разделения вернет неверные места.
+        """
+        with self._lock:
+            return reader(self.guild(guild_id))
+
+    def touch(self, guild_id, fetch_rows):
+        """Обновить рейтинг загруженного сервера строками из fetch_rows().
+
+        Строки читаются под блокировкой, поэтому запись не потеряется, даже если
+        сервер загружается в этот момент в другом потоке.
+        """
+        with self._lock:
+            ranking = self._guilds.get(guild_id)
+            if ranking is None:
+                return
+            for row in fetch_rows():
+                ranking.update(*row)
+                self.updates += 1
+
+    def drop(self, guild_id):
+        with self._lock:
+            self._guilds.pop(guild_id, None)
+
+    def stats(self):
+        return {
+            'rank_guilds': len(self._guilds),
+            'rank_members': sum(len(ranking) for ranking in self._guilds.values()),
+            'rank_loads': self.loads,
+            'rank_updates': self.updates
+        }
+
+def _benchmark(members=100_000, operations=10_000):
+    import random
+    import time
+    
+    rows = [(user_id, random.randint(0, 10**6), random.randint(1, 100), random.randint(0, 10**6)) for user_id in range(members)]
+    
+    started = time.perf_counter()
+    ranking = GuildRanking(rows)
+    print(f"📦 Загрузка {members} участников: {(time.perf_counter() - started) * 1000:.1f} мс")
+    
+    started = time.perf_counter()
+    for _ in range(operations):
+        ranking.update(random.randrange(members), random.randint(0, 10**6), random.randint(1, 100), random.randint(0, 10**6))
+    print(f"✏️ Обновление: {(time.perf_counter() - started) / operations * 10**6:.1f} мкс")
+    
+    for name, query in [
+        ('top 10', lambda: ranking.top_balance(10)),
+        ('место по балансу', lambda: ranking.balance_rank(random.randrange(members))),
+        ('место по уровню', lambda: ranking.level_rank(random.randrange(members))),
+        ('соседи ±5', lambda: ranking.level_around(random.randrange(members), 5))
+    ]:
+        started = time.perf_counter()
+        for _ in range(operations):
+            query()
+        print(f"🔎 {name}: {(time.perf_counter() - started) / operations * 10**6:.1f} мкс")
+    
+    # Сверка с полной сортировкой
+    current = sorted(ranking._balance_keys.values())
+    ok = ranking.by_balance.slice(0, members) == current and all(
+        ranking.balance_rank(user_id) == position for position, (balance, user_id) in enumerate(current[:1000], 1))
+    print("✅ Порядок совпадает с сортировкой" if ok else "❌ Порядок не совпадает с сортировкой")
+    return ok
+
+if __name__ == '__main__':
+    # Бенчмарк на 100 тысячах участников: python -m utils.ranking
+    import sys
+    sys.exit(0 if _benchmark() else 1)
\ No newline at end of file
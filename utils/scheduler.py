@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+
+from utils.database import get_async_database
+
+# Повтор задачи, обработчик которой упал: через 30 с, дальше вдвое дольше, но не реже раза в час
+SCHEDULER_RETRY_DELAY = 30
+SCHEDULER_MAX_RETRY_DELAY = 3600
+
+class Scheduler:
+    """Общий планировщик отложенных задач.
+
+    Задачи хранятся в таблице scheduled_jobs, а в памяти - в куче по времени
+    срабатывания. Планировщик спит до ближайшей задачи и будится, когда
+    появляется более ранняя. Коги регистрируют обработчики по типу задачи.
+    """
+    def __init__(self, adb, clock=time.time):
+        self.adb = adb
+        self.clock = clock
+        self._heap = []   # (due_at, seq, job_id)
+        self._jobs = {}   # job_id -> (kind, due_at, payload)
+        self._attempts = {}   # job_id -> число неудачных запусков подряд
+        self._handlers = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.fired = 0
+        self.failed = 0
+
+    def register(self, kind, handler):
+        """Обработчик - корутина, принимающая payload задачи"""
+        self._handlers[kind] = handler
+        # Задачи этого типа, пропущенные без обработчика, возвращаем в очередь
+        for job_id, (job_kind, due_at, payload) in self._jobs.items():
+            if job_kind == kind:
+                heapq.heappush(self._heap, (due_at, next(self._seq), job_id))
+        self._wakeup.set()
+
+    def unregister(self, kind):
+        self._handlers.pop(kind, None)
+
+    def _push(self, job_id, kind, due_at, payload):
+        self._jobs[job_id] = (kind, due_at, payload)
+        heapq.heappush(self._heap, (due_at, next(self._seq), job_id))
+        if self._heap[0][2] == job_id:
+            self._wakeup.set()
+
+    async def schedule(self, job_id, kind, due_at, payload=None, guild_id=None):
+        """Запланировать задачу (повторный вызов с тем же job_id переносит ее).
+        guild_id - сервер задачи: при очистке сервера она удаляется из базы"""
+        await self.adb.save_scheduled_job(job_id, kind, due_at, json.dumps(payload), guild_id)
+        self._attempts.pop(job_id, None)
+        self._push(job_id, kind, due_at, payload)
+
+    async def cancel(self, job_id):
+        # Запись в куче остается и будет пропущена при срабатывании
+        self._jobs.pop(job_id, None)
+        self._attempts.pop(job_id, None)
+        await self.adb.delete_scheduled_job(job_id)
+
+    def next_due(self):
+        """Время ближайшей актуальной задачи или None"""
+        while self._heap:
+            due_at, seq, job_id = self._heap[0]
+            job = self._jobs.get(job_id)
+            if job is not None and job[1] == due_at:
+                return due_at
+            heapq.heappop(self._heap)
+        return None
+
+    async def run_due(self):
+        """Запустить все задачи, время которых наступило. Возвращает их число"""
+        now = self.clock()
+        started = []
+        
+        while self._heap and self._heap[0][0] <= now:
+            due_at, seq, job_id = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            if job is None or job[1] != due_at:
+                continue
+            
+            kind, due_at, payload = job
+            handler = self._handlers.get(kind)
+            if handler is None:
+                # Останется в базе и в _jobs до регистрации обработчика
+                print(f"⚠️ Нет обработчика для задачи {job_id} ({kind})")
+                continue
+            
+            del self._jobs[job_id]
+            started.append(asyncio.create_task(self._fire(job_id, kind, handler, payload)))
+        
+        if started:
+            await asyncio.gather(*started)
+        return len(started)
+
+    async def _fire(self, job_id, kind, handler, payload):
+        try:
+            await handler(payload)
+        except Exception as e:
+            self.failed += 1
+            # Задачу могли перенести, пока выполнялся обработчик - тогда она уже в очереди
+            if job_id in self._jobs:
+                return
+            attempts = self._attempts[job_id] = self._attempts.get(job_id, 0) + 1
+            delay = min(SCHEDULER_RETRY_DELAY << (attempts - 1), SCHEDULER_MAX_RETRY_DELAY)
+            print(f"❌ Ошибка выполнения задачи {job_id} ({kind}), попытка {attempts}, повтор через {delay} с: {e}")
+            due_at = self.clock() + delay
+            await self.adb.postpone_scheduled_job(job_id, due_at)
+            self._push(job_id, kind, due_at, payload)
+            return
+        
+        self.fired += 1
+        if job_id not in self._jobs:
+            self._attempts.pop(job_id, None)
+            await self.adb.delete_scheduled_job(job_id)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            await self.run_due()
+            
+            due_at = self.next_due()
+            timeout = None if due_at is None else max(0, due_at - self.clock())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        """Загрузить сохраненные задачи и запустить цикл (повторные вызовы ничего не делают)"""
+        if self._task is not None:
+            return
+        
+        for job_id, kind, due_at, payload in await self.adb.get_scheduled_jobs():
+            self._push(job_id, kind, due_at, json.loads(payload) if payload else None)
+        
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        next_due = self.next_due()
+        return {
+            'scheduler_jobs': len(self._jobs),
+            'scheduler_fired': self.fired,
+            'scheduler_failed': self.failed,
+            'scheduler_retrying': len(self._attempts),
+            'scheduler_next_in': round(next_due - self.clock(), 1) if next_due is not None else None
+        }
+
+_scheduler = None
+
+def get_scheduler():
+    """Общий для всего процесса планировщик"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(get_async_database())
+    return _scheduler
\ No newline at end of file
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.database import Database, AsyncDatabase, STORAGE_PROFILES
+
+# Бенчмарки базы на временном файле (проверки корректности - в tests/test_stress.py):
+#   python -m utils.stress multipliers
+#   python -m utils.stress profiles
+
+GUILD_ID = 1
+
+def _report(checks):
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+    return all(ok for name, ok in checks)
+
+def _seed_users(db, users, balance):
+    with db.transaction() as cursor:
+        cursor.executemany('INSERT INTO users (user_id, guild_id, balance) VALUES (?, ?, ?)', 
+                          [(user_id, GUILD_ID, balance) for user_id in range(users)])
+
+def _balances(db):
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT user_id, balance FROM users WHERE guild_id = ?', (GUILD_ID,))
+    return dict(cursor.fetchall())
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+async def stress_multipliers(path, role_counts=(1, 10, 50), roles=200, boosted=50, members=200, messages=2000):
+    """Множители участника: запрос на каждую роль (как раньше) против индекса в памяти"""
+    db = Database(path)
+    adb = AsyncDatabase(db, workers=2)
+    role_ids = [10 ** 17 + role_id for role_id in range(roles)]
+    for role_id in random.sample(role_ids, boosted):
+        db.set_role_multiplier(role_id, round(random.uniform(1, 3), 2), round(random.uniform(1, 3), 2))
+    
+    def query_role(role_id):
+        cursor = db.conn.cursor()
+        cursor.execute('SELECT economy_multiplier, xp_multiplier FROM role_multipliers WHERE role_id = ?', (role_id,))
+        return cursor.fetchone()
+    
+    async def old_multipliers(member_roles):
+        # Прежний путь из on_message и work: отдельный запрос в потоке БД на каждую роль
+        eco_mult = xp_mult = 1.0
+        for role_id in member_roles:
+            role_mult = await adb.run(query_role, role_id)
+            if role_mult:
+                eco_mult = max(eco_mult, role_mult[0])
+                xp_mult = max(xp_mult, role_mult[1])
+        return eco_mult, xp_mult
+    
+    checks = []
+    for count in role_counts:
+        # Сообщения пишут members разных участников, у каждого свой набор ролей
+        member_roles = [random.sample(role_ids, count) for _ in range(members)]
+        authors = [random.choice(member_roles) for _ in range(messages)]
+        
+        started = time.perf_counter()
+        old_results = [await old_multipliers(author_roles) for author_roles in authors]
+        old_time = time.perf_counter() - started
+        
+        db.load_role_multipliers()
+        started = time.perf_counter()
+        new_results = [db.get_member_multipliers(author_roles) for author_roles in authors]
+        new_time = time.perf_counter() - started
+        
+        print(f"🎭 {count} ролей: по запросу на роль {old_time / messages * 10 ** 6:.0f} мкс/сообщение, "
+              f"индекс {new_time / messages * 10 ** 6:.1f} мкс/сообщение (x{old_time / new_time:,.0f})")
+        checks.append((f'{count} ролей: множители совпадают с запросами к базе', old_results == new_results))
+    
+    adb.executor.shutdown()
+    db.pool.close()
+    return checks
+
+async def stress_profiles(path, users=1000, writers=4, readers=4, duration=3.0):
+    """Профили хранения: коммиты в секунду и задержка чтения рейтинга при одновременной записи"""
+    checks = []
+    for profile in STORAGE_PROFILES:
+        db = Database(os.path.join(os.path.dirname(path), f'{profile}.db'), pool_size=writers + readers + 1, profile=profile)
+        _seed_users(db, users, 0)
+        stop = threading.Event()
+        
+        def write():
+            commits = 0
+            try:
+                while not stop.is_set():
+                    with db.transaction() as cursor:
+                        cursor.execute('UPDATE users SET balance = balance + 1 WHERE user_id = ? AND guild_id = ?', 
+                                      (random.randrange(users), GUILD_ID))
+                    commits += 1
+            finally:
+                db.pool.release()
+            return commits
+        
+        def read():
+            latencies = []
+            try:
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    cursor = db.conn.cursor()
+                    # Настоящий запрос к таблице, а не рейтинг в памяти
+                    cursor.execute('SELECT user_id, balance FROM users WHERE guild_id = ? ORDER BY balance DESC LIMIT 10', (GUILD_ID,))
+                    cursor.fetchall()
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                db.pool.release()
+            return latencies
+        
+        with ThreadPoolExecutor(max_workers=writers + readers) as executor:
+            write_futures = [executor.submit(write) for _ in range(writers)]
+            read_futures = [executor.submit(read) for _ in range(readers)]
+            await asyncio.sleep(duration)
+            stop.set()
+            commits = sum(future.result() for future in write_futures)
+            latencies = [latency * 1000 for future in read_futures for latency in future.result()]
+        
+        print(f"💾 {profile}: {commits / duration:,.0f} коммитов/с, чтение p50 {_percentile(latencies, 50):.2f} мс, "
+              f"p99 {_percentile(latencies, 99):.2f} мс, max {max(latencies):.2f} мс ({len(latencies)} чтений)")
+        checks.append((f'{profile}: все коммиты видны в базе', sum(_balances(db).values()) == commits))
+        db.pool.close()
+    return checks
+
+STRESS_TESTS = {
+    'multipliers': stress_multipliers,
+    'profiles': stress_profiles
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(STRESS_TESTS)
+    ok = True
+    for name in names:
+        print(f"🔥 {name}")
+        with tempfile.TemporaryDirectory() as tmp:
+            checks = asyncio.run(STRESS_TESTS[name](os.path.join(tmp, 'stress.db')))
+        ok = _report(checks) and ok
+    sys.exit(0 if ok else 1)
\ No newline at end of file
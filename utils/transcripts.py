@@ -0,0 +1,73 @@
+import asyncio
+import gzip
+import json
+import os
+from collections import deque
+
+# Каталог архива историй закрытых тикетов
+TRANSCRIPT_DIR = 'transcripts'
+# Сколько строк копить перед записью в файл
+TRANSCRIPT_WRITE_BATCH = 200
+# Сколько последних сообщений показывать в логе закрытия
+TRANSCRIPT_TAIL = 20
+
+def transcript_path(base_dir, guild_id, channel_id):
+    return os.path.join(base_dir, str(guild_id), f'{channel_id}.jsonl.gz')
+
+def message_record(message):
+    """Одна строка истории: сообщение с вложениями и числом embed"""
+    return {
+        'id': message.id,
+        'author_id': message.author.id,
+        'author': message.author.display_name,
+        'bot': message.author.bot,
+        'created_at': message.created_at.isoformat(),
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+        'content': message.content,
+        'attachments': [attachment.url for attachment in message.attachments],
+        'embeds': len(message.embeds)
+    }
+
+def _open(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return gzip.open(path + '.part', 'wt', encoding='utf-8')
+
+async def export_transcript(channel, path, tail=TRANSCRIPT_TAIL, batch_size=TRANSCRIPT_WRITE_BATCH):
+    """Выгрузить всю историю канала в сжатый JSONL.
+
+    История читается постранично, строки пишутся в файл пачками из отдельного
+    потока, поэтому память не зависит от длины тикета. Файл появляется под
+    итоговым именем только после полной выгрузки.
+    Возвращает (число сообщений, размер файла, последние tail строк текста).
+    """
+    handle = await asyncio.to_thread(_open, path)
+    last_lines = deque(maxlen=tail)
+    count = 0
+    batch = []
+    try:
+        async for message in channel.history(limit=None, oldest_first=True):
+            batch.append(json.dumps(message_record(message), ensure_ascii=False))
+            count += 1
+            if message.content and not message.author.bot:
+                last_lines.append(f"{message.author.display_name}: {message.content}")
+
+            if len(batch) >= batch_size:
+                await asyncio.to_thread(handle.write, '\n'.join(batch) + '\n')
+                batch = []
+
+        if batch:
+            await asyncio.to_thread(handle.write, '\n'.join(batch) + '\n')
+        await asyncio.to_thread(handle.close)
+    except BaseException:
+        await asyncio.to_thread(handle.close)
+        await asyncio.to_thread(os.remove, path + '.part')
+        raise
+
+    os.replace(path + '.part', path)
+    return count, os.path.getsize(path), list(last_lines)
+
+def read_transcript(path):
+    """Построчное чтение архива (генератор словарей)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as handle:
+        for line in handle:
+            yield json.loads(line)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import time
+
+class VoiceTracker:
+    """Учет времени в голосовых каналах.
+
+    Открытые сессии лежат в словаре по ключу (guild_id, user_id), поэтому
+    вход и выход - O(1). Раз в минуту collect() отдает целые минуты,
+    накопленные каждой сессией, а persist() сохраняет измененные сессии в
+    таблицу voice_sessions одной транзакцией, чтобы перезапуск не терял время.
+    """
+    def __init__(self, adb, clock=time.time):
+        self.adb = adb
+        self.clock = clock
+        self._sessions = {}   # (guild_id, user_id) -> [started_at, credited_at]
+        self._dirty = set()   # сессии, которые нужно сохранить
+        self._ended = set()   # сессии, которые нужно удалить из базы
+        self.joins = 0
+        self.leaves = 0
+        self.minutes_awarded = 0
+
+    def join(self, guild_id, user_id, started_at=None, credited_at=None):
+        key = (guild_id, user_id)
+        if key in self._sessions:
+            return
+        
+        now = self.clock()
+        started_at = started_at or now
+        self._sessions[key] = [started_at, credited_at or started_at]
+        self._dirty.add(key)
+        self._ended.discard(key)
+        self.joins += 1
+
+    def leave(self, guild_id, user_id):
+        """Закрыть сессию. Возвращает число еще не начисленных целых минут"""
+        key = (guild_id, user_id)
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return 0
+        
+        self._dirty.discard(key)
+        self._ended.add(key)
+        self.leaves += 1
+        
+        minutes = int((self.clock() - session[1]) // 60)
+        self.minutes_awarded += minutes
+        return minutes
+
+    def collect(self):
+        """Забрать накопленные целые минуты: список (guild_id, user_id, минуты)"""
+        now = self.clock()
+        awards = []
+        
+        for key, session in self._sessions.items():
+            minutes = int((now - session[1]) // 60)
+            if minutes > 0:
+                session[1] += minutes * 60
+                self._dirty.add(key)
+                awards.append((key[0], key[1], minutes))
+                self.minutes_awarded += minutes
+        
+        return awards
+
+    async def restore(self):
+        """Сохраненные сессии: (guild_id, user_id) -> (started_at, credited_at)"""
+        rows = await self.adb.get_voice_sessions()
+        return {(guild_id, user_id): (started_at, credited_at) for guild_id, user_id, started_at, credited_at in rows}
+
+    def discard(self, guild_id, user_id):
+        """Удалить сохраненную сессию без начисления (пользователь ушел, пока бот был выключен)"""
+        self._ended.add((guild_id, user_id))
+
+    async def persist(self):
+        if not self._dirty and not self._ended:
+            return
+        
+        dirty, self._dirty = self._dirty, set()
+        ended, self._ended = self._ended, set()
+        upserts = [(key[0], key[1], *self._sessions[key]) for key in dirty if key in self._sessions]
+        
+        try:
+            await self.adb.save_voice_sessions(upserts, list(ended))
+        except Exception as e:
+            print(f"❌ Ошибка сохранения голосовых сессий: {e}")
+            self._dirty |= dirty
+            self._ended |= ended
+
+    def forget_guild(self, guild_id):
+        self._sessions = {key: value for key, value in self._sessions.items() if key[0] != guild_id}
+        self._dirty = {key for key in self._dirty if key[0] != guild_id}
+        self._ended = {key for key in self._ended if key[0] != guild_id}
+
+    def stats(self):
+        return {
+            'voice_sessions': len(self._sessions),
+            'voice_joins': self.joins,
+            'voice_leaves': self.leaves,
+            'voice_minutes_awarded': self.minutes_awarded
+        }
\ No newline at end of file
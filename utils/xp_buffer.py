@@ -0,0 +1,105 @@
+import asyncio
+
+class XPAccumulator:
+    """Накопитель опыта за сообщения.
+
+    Опыт копится в памяти по ключу (guild_id, user_id) и записывается в таблицу
+    users одной транзакцией - по таймеру, при превышении порога или при выгрузке.
+    Текущие суммы держатся в памяти, поэтому новый уровень виден сразу.
+    """
+    def __init__(self, adb, max_pending=500):
+        self.adb = adb
+        self.max_pending = max_pending
+        self._totals = {}   # (guild_id, user_id) -> [xp, level]
+        self._pending = {}  # (guild_id, user_id) -> [прирост xp, новый уровень или None]
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self.messages = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    async def _load(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        totals = self._totals.get(key)
+        if totals is None:
+            user_data = await self.adb.get_user(user_id, guild_id)
+            # Пока ждали базу, запись могла появиться из другого сообщения
+            totals = self._totals.setdefault(key, [user_data[3], user_data[4]])
+        return totals
+
+    async def add(self, guild_id, user_id, amount, calculate_level):
+        """Начислить опыт. Возвращает (старый уровень, новый уровень)"""
+        key = (guild_id, user_id)
+        totals = await self._load(guild_id, user_id)
+        
+        totals[0] += amount
+        old_level = totals[1]
+        new_level = calculate_level(totals[0])
+        
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = [0, None]
+        pending[0] += amount
+        
+        if new_level > old_level:
+            totals[1] = new_level
+            pending[1] = new_level
+        
+        self.messages += 1
+        if len(self._pending) >= self.max_pending and not self._flushing():
+            self._flush_task = asyncio.create_task(self.flush())
+        
+        return old_level, new_level
+
+    def get(self, guild_id, user_id):
+        """Текущие (xp, level) с учетом еще не записанного опыта или None"""
+        totals = self._totals.get((guild_id, user_id))
+        return tuple(totals) if totals else None
+
+    def _flushing(self):
+        return self._flush_task is not None and not self._flush_task.done()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            
+            batch, self._pending = self._pending, {}
+            rows = [(xp, level, user_id, guild_id) for (guild_id, user_id), (xp, level) in batch.items()]
+            
+            try:
+                await self.adb.apply_xp_deltas(rows)
+            except Exception as e:
+                print(f"❌ Ошибка записи опыта: {e}")
+                # Возвращаем несохраненный прирост обратно в очередь
+                for key, (xp, level) in batch.items():
+                    pending = self._pending.setdefault(key, [0, None])
+                    pending[0] += xp
+                    if level is not None and (pending[1] is None or level > pending[1]):
+                        pending[1] = level
+                return 0
+            
+            # Суммы без новых изменений перечитаются из базы при следующем сообщении
+            self._totals = {key: totals for key, totals in self._totals.items() if key in self._pending}
+            self.flushes += 1
+            self.rows_flushed += len(rows)
+            return len(rows)
+
+    def forget(self, guild_id, user_id):
+        """Сбросить кэш пользователя (например, после setxp)"""
+        key = (guild_id, user_id)
+        self._totals.pop(key, None)
+        self._pending.pop(key, None)
+
+    def forget_guild(self, guild_id):
+        self._totals = {key: value for key, value in self._totals.items() if key[0] != guild_id}
+        self._pending = {key: value for key, value in self._pending.items() if key[0] != guild_id}
+
+    def stats(self):
+        return {
+            'xp_messages': self.messages,
+            'xp_flushes': self.flushes,
+            'xp_rows_flushed': self.rows_flushed,
+            'xp_pending': len(self._pending),
+            'xp_cached_users': len(self._totals)
+        }
\ No newline at end of file